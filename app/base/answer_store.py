@@ -0,0 +1,137 @@
+"""
+answers to templated catalog questions ("what is the warranty on X", "how much is Y"), rendered from the catalog
+"""
+from __future__ import annotations
+
+import re
+from typing import Dict, Optional, Tuple
+
+from app.base.catalog import CatalogIndex, get_catalog_index, normalize_text
+from app.base.moderation import moderator
+from app.config.settings import get_settings
+from app.utils.metrics_utils import metrics
+
+# intent: pattern matched against the normalized question
+INTENT_PATTERNS = {
+    "price": re.compile(r"\b(how much|price|prices|priced|cost|costs)\b"),
+    "warranty": re.compile(r"\b(warranty|warranties|guarantee)\b"),
+    "rating": re.compile(r"\b(rating|rated|reviews|stars)\b"),
+    "model_number": re.compile(r"\bmodel (number|no)\b"),
+    "features": re.compile(r"\b(features|specs|specifications)\b"),
+}
+# words of questions that need more than a single catalog fact, these go to the LLM
+_OPEN_QUESTION_WORDS = {
+    "compare", "compared", "comparison", "vs", "versus", "better", "best", "cheaper", "recommend",
+    "alternative", "alternatives", "instead", "discount", "deal", "why",
+}
+_FOLLOW_UP = "Is there anything else you would like to know about it?"
+
+
+def _render_price(product: dict) -> str:
+    return f"The {product['name']} is priced at ${product['price']:.2f}. {_FOLLOW_UP}"
+
+
+def _render_warranty(product: dict) -> str:
+    return f"The {product['name']} comes with a {product['warranty']} warranty. {_FOLLOW_UP}"
+
+
+def _render_rating(product: dict) -> str:
+    return f"The {product['name']} has a customer rating of {product['rating']} out of 5. {_FOLLOW_UP}"
+
+
+def _render_model_number(product: dict) -> str:
+    return f"The model number of the {product['name']} is {product['model_number']}. {_FOLLOW_UP}"
+
+
+def _render_features(product: dict) -> str:
+    return f"The {product['name']} features: {', '.join(product['features'])}. {_FOLLOW_UP}"
+
+
+# intent: (product field the answer is rendered from, renderer)
+INTENT_RENDERERS = {
+    "price": ("price", _render_price),
+    "warranty": ("warranty", _render_warranty),
+    "rating": ("rating", _render_rating),
+    "model_number": ("model_number", _render_model_number),
+    "features": ("features", _render_features),
+}
+
+
+class AnswerStore:
+    """
+    answers for every (intent, product) pair of the catalog, rendered up front
+    each answer is stored with the version of the product it was rendered from. On a catalog update only the
+    answers of added, changed or removed products are rendered again or dropped.
+    """
+
+    def __init__(self, max_words: int):
+        self.max_words = max_words
+        self.catalog_version = None
+        self._product_versions: Dict[str, str] = {}
+        self._answers: Dict[Tuple[str, str], str] = {}
+
+    @classmethod
+    def from_settings(cls) -> "AnswerStore":
+        return cls(max_words=get_settings().answer_store_max_words)
+
+    def refresh(self, catalog: CatalogIndex) -> None:
+        """
+        bring the stored answers up to date with catalog
+        :param catalog: CatalogIndex
+        """
+        for name in set(self._product_versions) - set(catalog.product_versions):
+            self._drop_product(name)
+        for name, version in catalog.product_versions.items():
+            if self._product_versions.get(name) == version:
+                continue
+            if name in self._product_versions:
+                self._drop_product(name)
+            self._render_product(catalog.products[name])
+            self._product_versions[name] = version
+        self.catalog_version = catalog.version
+
+    def get_intent(self, normalized_text: str) -> Optional[str]:
+        """
+        the single templated intent of the question, None if it has none or more than one
+        :param normalized_text: str | normalized question
+        :return: str
+        """
+        words = normalized_text.split()
+        if len(words) > self.max_words or _OPEN_QUESTION_WORDS.intersection(words):
+            return None
+        intents = [_intent for _intent, _pattern in INTENT_PATTERNS.items() if _pattern.search(normalized_text)]
+        return intents[0] if len(intents) == 1 else None
+
+    def lookup(self, user_input: str) -> Optional[str]:
+        """
+        the stored answer to user_input, if it asks a templated question about exactly one product
+        :param user_input: str
+        :return: str | None if the question has to be answered by the LLM
+        """
+        catalog = get_catalog_index()
+        if catalog.version != self.catalog_version:
+            self.refresh(catalog)
+        answer = None
+        if intent := self.get_intent(normalize_text(user_input)):
+            extracted = catalog.extract_products(user_input)
+            if len(extracted) == 1 and len(extracted[0].get("products", [])) == 1:
+                answer = self._answers.get((intent, extracted[0]["products"][0]))
+        metrics.incr("answer_store.hits" if answer else "answer_store.misses")
+        return answer
+
+    def _render_product(self, product: dict) -> None:
+        for intent, (field, render) in INTENT_RENDERERS.items():
+            if product.get(field) not in (None, "", []):
+                answer = self._answers[(intent, product["name"])] = render(product)
+                # rendered from catalog data, the output moderation passes it by the allow-list
+                moderator.allow(answer)
+
+    def _drop_product(self, name: str) -> None:
+        for intent in INTENT_RENDERERS:
+            if (answer := self._answers.pop((intent, name), None)) is not None:
+                moderator.disallow(answer)
+        del self._product_versions[name]
+        metrics.incr("answer_store.invalidated_products")
+
+
+answer_store = AnswerStore.from_settings()
@@ -0,0 +1,164 @@
+"""
+in-memory index of the product catalog, with a local (no LLM) product/category extractor
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from app.config.settings import get_settings
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+PRODUCTS_FILE = os.path.join(os.path.dirname(__file__), "products.json")
+
+# words of category names that are too generic to signal a category on their own
+_CATEGORY_STOPWORDS = {"and", "accessories", "systems", "equipment", "home"}
+
+
+def normalize_text(text: str) -> str:
+    """
+    lower-case text and collapse everything that is not a letter or digit into single spaces
+    :param text: str
+    :return: str
+    """
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+def _get_version(data) -> str:
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+class CatalogIndex:
+    def __init__(self, products: Dict[str, dict]):
+        self.products = products
+        self.version = _get_version(products)
+        # per-product versions, to invalidate what was derived from a single product
+        self.product_versions = {_name: _get_version(_product) for _name, _product in products.items()}
+        self.by_normalized_name = {
+            normalize_text(_name): _product for _name, _product in products.items()
+        }
+        by_category = defaultdict(list)
+        for _product in products.values():
+            by_category[_product["category"]].append(_product)
+        self.by_category = dict(by_category)
+        self.category_keywords = {
+            _category: self._get_category_keywords(_category) for _category in self.by_category
+        }
+
+    @classmethod
+    def from_file(cls, file_path: str = PRODUCTS_FILE) -> "CatalogIndex":
+        with open(file_path, "r", encoding="utf-8") as fp:
+            return cls(json.load(fp))
+
+    @staticmethod
+    def _get_category_keywords(category: str) -> set:
+        keywords = set()
+        for _word in normalize_text(category).split():
+            if _word not in _CATEGORY_STOPWORDS:
+                keywords.add(_word)
+                keywords.add(_word[:-1] if _word.endswith("s") else _word)
+        return keywords
+
+    def get_product(self, name: str) -> dict:
+        return self.products.get(name) or self.by_normalized_name.get(normalize_text(name))
+
+    def get_products_by_category(self, category: str) -> List[dict]:
+        return self.by_category.get(category, [])
+
+    def extract_products(self, text: str) -> List[dict]:
+        """
+        local replacement for the LLM extraction step, returns the same format:
+        [{'category': <category>, 'products': [<product names>]}, {'category': <category>}]
+        products are matched by their full (normalized) name, categories by keywords of the category name
+        :param text: str | user message
+        :return: list of dicts
+        """
+        padded_text = f" {normalize_text(text)} "
+        products_by_category = defaultdict(list)
+        for _normalized_name, _product in self.by_normalized_name.items():
+            if f" {_normalized_name} " in padded_text:
+                products_by_category[_product["category"]].append(_product["name"])
+                # matched names must not count again as category keywords ("gaming laptop")
+                padded_text = padded_text.replace(f" {_normalized_name} ", " ")
+
+        extracted = [
+            {"category": _category, "products": _names}
+            for _category, _names in products_by_category.items()
+        ]
+        words = set(padded_text.split())
+        extracted.extend(
+            {"category": _category}
+            for _category, _keywords in self.category_keywords.items()
+            if _category not in products_by_category and words & _keywords
+        )
+        return extracted
+
+
+class CatalogLoader:
+    """
+    the catalog index of file_path, read on first use. Later calls check the mtime and size of the file at most
+    every check_interval_s seconds and read it again once they changed. A new index has new (product) versions,
+    which invalidates the answer store and the near-duplicate caches for the changed products.
+    A file that cannot be read (e.g. while it is being written) is reported, the previous index is kept.
+    """
+
+    def __init__(self, file_path: str = PRODUCTS_FILE, check_interval_s: float = 0.0):
+        self.file_path = file_path
+        self.check_interval_s = check_interval_s
+        self._index: Optional[CatalogIndex] = None
+        self._stat_signature = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def get(self) -> CatalogIndex:
+        """
+        :return: CatalogIndex
+        :raises FileNotFoundError: if there is no catalog file and none was read before
+        """
+        if self._index is None or time.monotonic() - self._checked_at >= self.check_interval_s:
+            self.reload()
+        return self._index
+
+    def reload(self, force: bool = False) -> CatalogIndex:
+        """
+        read the catalog file again if it changed since it was last read
+        :param force: bool | read it even if its mtime and size did not change
+        :return: CatalogIndex
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.file_path)
+                stat_signature = (stat.st_mtime_ns, stat.st_size)
+                if force or stat_signature != self._stat_signature:
+                    index = CatalogIndex.from_file(self.file_path)
+                    if self._index is None or index.version != self._index.version:
+                        self._index = index
+                        metrics.incr("catalog.loads")
+                    self._stat_signature = stat_signature
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                if self._index is None:
+                    raise
+                metrics.incr("catalog.load_errors")
+                log.warning(f"Keeping catalog version {self._index.version}, reading {self.file_path} failed: {e}")
+            return self._index
+
+
+catalog_loader = CatalogLoader(check_interval_s=get_settings().catalog_reload_interval_s)
+
+
+def get_catalog_index() -> CatalogIndex:
+    """
+    return the process-wide catalog index, products.json is only read again once it changed
+    :return: CatalogIndex
+    """
+    return catalog_loader.get()
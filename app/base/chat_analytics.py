@@ -0,0 +1,293 @@
+"""
+records of chat turns, buffered in memory and loaded into BigQuery in batches
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import time
+import uuid
+from collections import deque
+from typing import List
+
+from app.config.settings import get_settings
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+# steps of a turn whose latency is recorded, each one is a column <step>_ms
+TURN_STEPS = ("input_moderation", "extraction", "lookup", "completion", "output_moderation", "evaluation")
+# columns of the analytics table, as (name, BigQuery type, mode)
+TURN_RECORD_COLUMNS = [
+    ("turn_id", "STRING", "REQUIRED"),
+    ("created_at", "TIMESTAMP", "REQUIRED"),
+    ("session_id", "STRING", "NULLABLE"),
+    ("batch", "BOOLEAN", "NULLABLE"),
+    ("streamed", "BOOLEAN", "NULLABLE"),
+    ("total_ms", "FLOAT64", "NULLABLE"),
+    *((f"{_step}_ms", "FLOAT64", "NULLABLE") for _step in TURN_STEPS),
+    ("prompt_tokens", "INT64", "NULLABLE"),
+    ("completion_tokens", "INT64", "NULLABLE"),
+    ("input_flagged", "BOOLEAN", "NULLABLE"),
+    ("output_flagged", "BOOLEAN", "NULLABLE"),
+    ("evaluation", "STRING", "NULLABLE"),
+    ("answer_source", "STRING", "NULLABLE"),
+    ("matched_products", "STRING", "REPEATED"),
+    ("degradations", "STRING", "REPEATED"),
+    ("error", "STRING", "NULLABLE"),
+]
+
+
+class TurnRecord:
+    """
+    what happened during one chat turn, filled in by aprocess_user_message
+    token counts are estimates (see conversation_store.estimate_tokens), evaluation is one of
+    approved, disapproved, skipped or background (evaluated after the response was sent),
+    answer_source is llm, answer_store or answer_cache
+    """
+
+    def __init__(self, session_id: str = None, batch: bool = False, streamed: bool = False):
+        self.turn_id = uuid.uuid4().hex
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.session_id = session_id
+        self.batch = batch
+        self.streamed = streamed
+        self.step_ms = {}
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.input_flagged = None
+        self.output_flagged = None
+        self.evaluation = None
+        self.answer_source = None
+        self.matched_products = []
+        self.degradations = []
+        self.error = None
+        self._started_at = time.monotonic()
+        self.total_ms = None
+
+    @contextlib.contextmanager
+    def step(self, name: str):
+        """
+        record the latency of the with-block as latency of step name
+        """
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.step_ms[name] = round((time.monotonic() - started_at) * 1000, 3)
+
+    def finish(self, degradations: List[str] = None, error: BaseException = None) -> None:
+        self.total_ms = round((time.monotonic() - self._started_at) * 1000, 3)
+        self.degradations = list(degradations or [])
+        if error is not None:
+            self.error = type(error).__name__
+
+    def to_row(self) -> dict:
+        """
+        the record as row of the analytics table
+        :return: dict
+        """
+        return {
+            "turn_id": self.turn_id,
+            "created_at": self.created_at.isoformat(),
+            "session_id": self.session_id,
+            "batch": self.batch,
+            "streamed": self.streamed,
+            "total_ms": self.total_ms,
+            **{f"{_step}_ms": self.step_ms.get(_step) for _step in TURN_STEPS},
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "input_flagged": self.input_flagged,
+            "output_flagged": self.output_flagged,
+            "evaluation": self.evaluation,
+            "answer_source": self.answer_source,
+            "matched_products": self.matched_products,
+            "degradations": self.degradations,
+            "error": self.error,
+        }
+
+
+class AnalyticsSink:
+    """
+    buffer of turn rows, flushed as one BigQuery load job once flush_size rows are buffered
+    or flush_interval_s seconds passed. Load jobs run in a worker thread, off the event loop.
+    Rows of a failed load are spilled to newline-delimited json files in spill_dir, which are
+    loaded again after the next successful flush. If the buffer grows beyond max_buffer rows
+    (e.g. while flushes are slow) the oldest rows are dropped.
+    """
+
+    def __init__(
+        self,
+        dataset_name: str,
+        table_name: str,
+        flush_size: int,
+        flush_interval_s: int,
+        max_buffer: int,
+        spill_dir: str,
+    ):
+        self.dataset_name = dataset_name
+        self.table_name = table_name
+        self.flush_size = flush_size
+        self.flush_interval_s = flush_interval_s
+        self.spill_dir = spill_dir
+        self._buffer = deque(maxlen=max_buffer)
+        self._table = None
+        self._flush_lock = None
+        self._flusher = None
+        self._flush_task = None
+
+    @classmethod
+    def from_settings(cls) -> "AnalyticsSink":
+        settings = get_settings()
+        return cls(
+            dataset_name=settings.analytics_dataset,
+            table_name=settings.analytics_table,
+            flush_size=settings.analytics_flush_size,
+            flush_interval_s=settings.analytics_flush_interval_s,
+            max_buffer=settings.analytics_max_buffer,
+            spill_dir=settings.analytics_spill_dir,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.dataset_name)
+
+    def add(self, record: TurnRecord) -> None:
+        """
+        buffer the row of record, must be called from the event loop
+        :param record: TurnRecord
+        """
+        if not self.enabled:
+            return
+        self._ensure_started()
+        if len(self._buffer) == self._buffer.maxlen:
+            metrics.incr("analytics.dropped_rows")
+        self._buffer.append(record.to_row())
+        metrics.set_gauge("analytics.buffered_rows", len(self._buffer))
+        if len(self._buffer) >= self.flush_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> None:
+        """
+        load all buffered rows in one load job, the rows are spilled to disk if the load fails
+        """
+        async with self._get_flush_lock():
+            if not self._buffer:
+                return
+            rows = list(self._buffer)
+            self._buffer.clear()
+            metrics.set_gauge("analytics.buffered_rows", 0)
+            started_at = time.monotonic()
+            try:
+                await asyncio.to_thread(self._load, rows)
+            except asyncio.CancelledError:
+                # the load may still finish in its thread, rows are deduplicated by turn_id in the analysis
+                self._spill(rows)
+                raise
+            except Exception as e:
+                log.warning(f"Loading {len(rows)} analytics rows failed, spilling to disk: {e}", exc_info=True)
+                metrics.incr("analytics.failed_flushes")
+                await asyncio.to_thread(self._spill, rows)
+                return
+            metrics.incr("analytics.flushed_rows", len(rows))
+            metrics.observe("analytics.flush_ms", (time.monotonic() - started_at) * 1000)
+            await asyncio.to_thread(self._load_spilled)
+
+    async def close(self, timeout: float = None) -> None:
+        """
+        stop the periodic flush and flush the buffer (at most timeout seconds), left rows are spilled
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if not self._buffer:
+            return
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if self._buffer:
+            rows = list(self._buffer)
+            self._buffer.clear()
+            self._spill(rows)
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._flusher is not None and self._flusher.get_loop() is loop:
+            return
+        self._flush_lock = asyncio.Lock()
+        self._flusher = asyncio.ensure_future(self._flush_periodically())
+
+    def _get_flush_lock(self) -> asyncio.Lock:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        return self._flush_lock
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            await self.flush()
+
+    def warmup(self) -> None:
+        """
+        create the table (and its client) ahead of the first flush
+        """
+        if self.enabled:
+            self._get_table()
+
+    def _get_table(self):
+        # created by the warmup or on first flush, the chat service does not depend on BigQuery being reachable
+        if self._table is None:
+            from google.cloud import bigquery
+            from gcp.big_query.big_query_table import BigQueryTable
+
+            table = BigQueryTable(
+                project_id=None,
+                dataset_name=self.dataset_name,
+                table_name=self.table_name,
+                schema=[
+                    bigquery.SchemaField(_name, _type, mode=_mode)
+                    for _name, _type, _mode in TURN_RECORD_COLUMNS
+                ],
+            )
+            if not table.exists:
+                table.create()
+            self._table = table
+        return self._table
+
+    def _load(self, rows: List[dict]) -> None:
+        if self._get_table().update_from_json_data(rows) is None:
+            raise RuntimeError(f"load job into {self._table.table_id} reported errors")
+
+    def _spill(self, rows: List[dict]) -> None:
+        os.makedirs(self.spill_dir, exist_ok=True)
+        file_path = os.path.join(self.spill_dir, f"turns_{time.time_ns()}.ndjson")
+        with open(file_path, "w", encoding="utf-8") as fp:
+            fp.writelines(json.dumps(_row) + "\n" for _row in rows)
+        metrics.incr("analytics.spilled_rows", len(rows))
+
+    def _load_spilled(self) -> None:
+        if not os.path.isdir(self.spill_dir):
+            return
+        for file_name in sorted(os.listdir(self.spill_dir)):
+            file_path = os.path.join(self.spill_dir, file_name)
+            with open(file_path, "r", encoding="utf-8") as fp:
+                rows = [json.loads(_line) for _line in fp if _line.strip()]
+            try:
+                if rows:
+                    self._load(rows)
+            except Exception as e:
+                log.warning(
+                    f"Loading spilled analytics rows of {file_name} failed, retrying after the next flush: {e}",
+                    exc_info=True,
+                )
+                return
+            os.remove(file_path)
+            metrics.incr("analytics.reloaded_rows", len(rows))
+
+
+analytics_sink = AnalyticsSink.from_settings()
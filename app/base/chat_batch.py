@@ -0,0 +1,112 @@
+"""
+processing of many chat turns in one request, with bounded concurrency and batched upstream calls
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncIterator, List
+
+from app.base.conversation_store import conversation_store
+from app.base.deadline import Deadline, DeadlineExceeded
+from app.base.moderation import moderator
+from app.base.process_user_message import aprocess_conversation_turn, aprocess_user_message
+from app.config.settings import get_settings
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+class ChatBatch:
+    """
+    state shared by the turns of one batch:
+    * the inputs are moderated up front, the ones the local moderation tiers cannot decide
+      MODERATION_BATCH_SIZE inputs per upstream request
+    * turns with identical (normalized) inputs share one extraction call
+    """
+
+    def __init__(self, items: List[dict], concurrency: int = None, deadline_ms: int = None):
+        settings = get_settings()
+        self.items = items
+        # asyncio.Semaphore needs at least 1, the request model rejects smaller values
+        self.concurrency = max(
+            1, min(concurrency or settings.chat_batch_concurrency, settings.chat_batch_max_concurrency)
+        )
+        self.deadline_ms = deadline_ms or settings.chat_deadline_ms
+        self.moderation_batch_size = settings.moderation_batch_size
+        self.input_verdicts = {}
+        self._extractions = {}
+
+    def get_input_verdict(self, user_input: str):
+        return self.input_verdicts.get(_normalize(user_input))
+
+    async def moderate_inputs(self) -> None:
+        """
+        moderate all distinct inputs of the batch, inputs whose moderation failed are moderated again by their turn
+        """
+        texts = list(dict.fromkeys(_normalize(_item["message"]) for _item in self.items))
+        for i in range(0, len(texts), self.moderation_batch_size):
+            chunk = texts[i:i + self.moderation_batch_size]
+            try:
+                self.input_verdicts.update(zip(chunk, await moderator.amoderate_many(chunk, len(chunk))))
+            except Exception as e:
+                log.warning(f"Batched moderation of {len(chunk)} inputs failed, moderating per turn: {e}")
+
+    async def extract(self, normalized_input: str, coro_fn):
+        """
+        await the extraction for normalized_input, started by the first turn asking for it
+        a turn that stops waiting (e.g. on its deadline) does not cancel the extraction for the others
+        """
+        task = self._extractions.get(normalized_input)
+        if task is None:
+            task = self._extractions[normalized_input] = asyncio.ensure_future(coro_fn())
+        else:
+            metrics.incr("chat_batch.shared_extractions")
+        return await asyncio.shield(task)
+
+    async def run(self) -> AsyncIterator[dict]:
+        """
+        process all items, results are yielded in order of completion
+        :return: async iterator of result dicts, each with the index of its item
+        """
+        await self.moderate_inputs()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [
+            asyncio.ensure_future(self._run_item(_index, _item, semaphore))
+            for _index, _item in enumerate(self.items)
+        ]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            for task in tasks + list(self._extractions.values()):
+                task.cancel()
+
+    async def _run_item(self, index: int, item: dict, semaphore: asyncio.Semaphore) -> dict:
+        result = {"index": index, "id": item.get("id"), "session_id": item.get("session_id")}
+        async with semaphore:
+            deadline = Deadline(self.deadline_ms)
+            try:
+                if item.get("session_id"):
+                    response, _ = await aprocess_conversation_turn(
+                        conversation_store.get(item["session_id"]),
+                        item["message"],
+                        deadline=deadline,
+                        batch=self,
+                    )
+                else:
+                    response, _ = await aprocess_user_message(
+                        item["message"], [], debug=False, deadline=deadline, batch=self
+                    )
+                result["response"] = response
+            except DeadlineExceeded as e:
+                result["error"] = str(e)
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            result["degradations"] = deadline.degradations
+        metrics.incr("chat_batch.errors" if result.get("error") else "chat_batch.turns")
+        return result
@@ -1,25 +1,177 @@
+import asyncio
+import contextlib
 import os
-import openai
+from functools import lru_cache
 
 from dotenv import load_dotenv, find_dotenv
 
-load_dotenv(find_dotenv())
-openai.api_key = os.environ['OPENAI_API_KEY']
+from app.utils.cassette import cassette
+from app.utils.metrics_utils import metrics
+from app.utils.single_flight import SingleFlight, get_call_key
+
+# identical concurrent calls (same messages/params or same moderation text) share one upstream request
+completion_flights = SingleFlight("completion")
+moderation_flights = SingleFlight("moderation")
+
+
+class UpstreamTimeout(asyncio.TimeoutError):
+    """
+    an upstream (openai) call did not finish within its request timeout
+    """
+
+
+@lru_cache(maxsize=None)
+def get_openai():
+    """
+    the openai module, imported (and given the api key) on the first upstream call
+    importing openai also imports its optional data libraries (numpy, pandas), which is slow on a cold start
+    :return: module
+    """
+    import openai
+
+    load_dotenv(find_dotenv())
+    openai.api_key = os.environ['OPENAI_API_KEY']
+    return openai
+
+
+@contextlib.contextmanager
+def _upstream_call(kind: str):
+    openai = get_openai()
+    try:
+        yield openai
+    except asyncio.CancelledError:
+        metrics.incr(f"openai.{kind}.cancelled")
+        raise
+    except openai.error.Timeout as e:
+        raise UpstreamTimeout(str(e)) from e
+
+
+def _get_completion_request(messages, model, temperature, max_tokens) -> dict:
+    # the params a completion depends on, as recorded on the cassette
+    return {"messages": messages, "model": model, "temperature": temperature, "max_tokens": max_tokens}
 
 
 class GenerateResponse:
     @staticmethod
     def get_completion_from_messages(messages, model="gpt-3.5-turbo",
                                      temperature=0,
-                                     max_tokens=500):
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
+                                     max_tokens=500,
+                                     timeout=None):
+        def _create():
+            with _upstream_call("completion") as openai:
+                response = openai.ChatCompletion.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    request_timeout=timeout,
+                )
+            return response.choices[0].message["content"]
+
+        return cassette.call("completion", _get_completion_request(messages, model, temperature, max_tokens), _create)
+
+    @staticmethod
+    async def aget_completion_from_messages(messages, model="gpt-3.5-turbo",
+                                            temperature=0,
+                                            max_tokens=500,
+                                            timeout=None):
+        """
+        the shared upstream call has no request timeout of its own, as callers with different budgets join it:
+        each caller only waits for timeout seconds (UpstreamTimeout), the call is cancelled once no caller waits
+        :return: str | the response
+        """
+        try:
+            return await completion_flights.do(
+                get_call_key(messages, model, temperature, max_tokens),
+                lambda: cassette.acall(
+                    "completion",
+                    _get_completion_request(messages, model, temperature, max_tokens),
+                    lambda: GenerateResponse._acreate_completion(messages, model, temperature, max_tokens),
+                ),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError as e:
+            raise UpstreamTimeout(f"Completion did not finish within {timeout}s") from e
+
+    @staticmethod
+    async def _acreate_completion(messages, model, temperature, max_tokens):
+        with _upstream_call("completion") as openai:
+            response = await openai.ChatCompletion.acreate(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
         return response.choices[0].message["content"]
 
+    @staticmethod
+    async def astream_completion_from_messages(messages, on_token, model="gpt-3.5-turbo",
+                                               temperature=0,
+                                               max_tokens=500,
+                                               timeout=None):
+        """
+        stream the completion, on_token (async callable) is awaited with every token as it arrives
+        :return: str | the complete response
+        """
+        return await cassette.astream(
+            _get_completion_request(messages, model, temperature, max_tokens),
+            on_token,
+            lambda _on_token: GenerateResponse._astream_completion(
+                messages, _on_token, model, temperature, max_tokens, timeout
+            ),
+        )
+
+    @staticmethod
+    async def _astream_completion(messages, on_token, model, temperature, max_tokens, timeout):
+        tokens = []
+        with _upstream_call("completion") as openai:
+            response = await openai.ChatCompletion.acreate(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                request_timeout=timeout,
+                stream=True,
+            )
+            async for chunk in response:
+                if token := chunk.choices[0].delta.get("content"):
+                    tokens.append(token)
+                    await on_token(token)
+        return "".join(tokens)
+
+    @staticmethod
+    async def aget_moderation(inp):
+        # moderation verdicts do not depend on surrounding whitespace
+        inp = " ".join(inp.split()) if isinstance(inp, str) else inp
+        return await moderation_flights.do(
+            get_call_key(inp),
+            lambda: cassette.acall("moderation", {"input": inp}, lambda: GenerateResponse._acreate_moderation(inp)),
+        )
+
+    @staticmethod
+    async def aget_moderations(inputs):
+        """
+        moderate a list of texts with a single upstream request
+        :param inputs: list of str
+        :return: list of moderation results, in the order of inputs
+        """
+        return await cassette.acall(
+            "moderations", {"input": inputs}, lambda: GenerateResponse._acreate_moderations(inputs)
+        )
+
+    @staticmethod
+    async def _acreate_moderations(inputs):
+        with _upstream_call("moderation") as openai:
+            response = await openai.Moderation.acreate(input=inputs)
+        metrics.incr("openai.moderation.batched_inputs", len(inputs))
+        return response["results"]
+
+    @staticmethod
+    async def _acreate_moderation(inp):
+        with _upstream_call("moderation") as openai:
+            response = await openai.Moderation.acreate(input=inp)
+        return response["results"][0]
+
     @staticmethod
     def collect_messages(prompt, debug=False):
         from app.base.process_user_message import process_user_message
@@ -0,0 +1,141 @@
+"""
+WebSocket transport for chat: one connection is bound to one conversation, turns are sent as json frames
+"""
+import asyncio
+import contextlib
+
+from pydantic import ValidationError
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from app.base.conversation_store import conversation_store
+from app.base.deadline import Deadline, DeadlineExceeded
+from app.base.process_user_message import aprocess_conversation_turn
+from app.config.settings import get_settings
+from app.models.models import ChatFrame
+from app.utils.admission_control import AdmissionController, AdmissionRejected
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+# close code for frames that are not json
+CLOSE_UNSUPPORTED_DATA = 1003
+
+
+async def _read_frames(websocket: WebSocket, frames: asyncio.Queue) -> None:
+    """
+    put the frames of the client into frames until it disconnects, raises on a frame that is not json
+    """
+    try:
+        while True:
+            await frames.put(await websocket.receive_json())
+    except WebSocketDisconnect:
+        pass
+
+
+async def _send_error(websocket: WebSocket, status_code: int, detail: str, retry_after: int = None) -> None:
+    await websocket.send_json(
+        {"type": "error", "status_code": status_code, "detail": detail, "retry_after": retry_after}
+    )
+
+
+async def serve_chat_websocket(
+    websocket: WebSocket, session_id: str, tenant: str, admission_controller: AdmissionController
+) -> None:
+    """
+    serve the turns of a chat connection until the client disconnects
+    client frames: {"message": str, "deadline_ms": int (optional)}
+    server frames:
+    * {"type": "token", "content": str} for every streamed token of the response
+    * {"type": "final", "response": str, "replaces_stream": bool, "degradations": list, "conversation": dict}
+      once the turn is done. The response replaces the streamed tokens, if replaces_stream is set
+    * {"type": "error", "status_code": int, "detail": str, "retry_after": int} if the turn could not be processed,
+      e.g. 422 for a frame without message
+    a turn in progress is cancelled when the client disconnects. A frame that is not json is answered with an error
+    frame (400) and the connection is closed with code 1003, a turn in progress is cancelled.
+    """
+    await websocket.accept()
+    conversation = conversation_store.get(session_id)
+    frames = asyncio.Queue()
+    reader = asyncio.ensure_future(_read_frames(websocket, frames))
+    metrics.incr("chat_websocket.connections")
+    try:
+        while True:
+            next_frame = asyncio.ensure_future(frames.get())
+            await asyncio.wait({next_frame, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_frame.done():
+                next_frame.cancel()
+                break
+            turn = asyncio.ensure_future(
+                _run_turn(websocket, conversation, next_frame.result(), tenant, admission_controller)
+            )
+            await asyncio.wait({turn, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if not turn.done():
+                metrics.incr("chat.cancelled_on_disconnect")
+                turn.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await turn
+                break
+            turn.result()
+        if reader.done() and not reader.cancelled() and (error := reader.exception()) is not None:
+            await _close_unreadable(websocket, error)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        reader.cancel()
+
+
+async def _close_unreadable(websocket: WebSocket, error: BaseException) -> None:
+    metrics.incr("chat_websocket.unreadable_frames")
+    log.warning(f"Closing chat connection after an unreadable frame: {type(error).__name__}: {error}")
+    # the client may be gone already
+    with contextlib.suppress(Exception):
+        await _send_error(websocket, 400, f"Frame is not valid json: {error}")
+        await websocket.close(code=CLOSE_UNSUPPORTED_DATA)
+
+
+async def _run_turn(websocket, conversation, frame, tenant, admission_controller):
+    try:
+        frame = ChatFrame.parse_obj(frame)
+    except ValidationError as e:
+        await _send_error(websocket, 422, str(e))
+        return
+    deadline = Deadline(frame.deadline_ms or get_settings().chat_deadline_ms)
+    streamed = []
+
+    async def _send_token(token):
+        streamed.append(token)
+        await websocket.send_json({"type": "token", "content": token})
+
+    try:
+        async with admission_controller.admit(tenant=tenant, session_id=conversation.session_id):
+            response, _ = await aprocess_conversation_turn(
+                conversation, frame.message, deadline=deadline, on_token=_send_token
+            )
+    except AdmissionRejected as e:
+        await _send_error(websocket, e.status_code, str(e), e.retry_after)
+        return
+    except DeadlineExceeded as e:
+        await _send_error(websocket, 504, str(e))
+        return
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        # the connection stays usable for the next turn
+        metrics.incr("chat_websocket.turn_errors")
+        log.error(f"Chat turn failed: {type(e).__name__}: {e}")
+        await _send_error(websocket, 500, f"{type(e).__name__}: {e}")
+        return
+    await websocket.send_json(
+        {
+            "type": "final",
+            "response": response,
+            "replaces_stream": response != "".join(streamed),
+            "degradations": deadline.degradations,
+            "conversation": {
+                "session_id": conversation.session_id,
+                "turns": conversation.turns,
+                "history_tokens": conversation.history_tokens,
+                "injected_products": sorted(conversation.injected_products),
+            },
+        }
+    )
@@ -0,0 +1,99 @@
+"""
+in-memory store of chat conversations, keyed by session-id
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import List
+
+from app.config.settings import get_settings
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    rough token count of text, ~4 characters per token for english text
+    :param text: str
+    :return: int
+    """
+    return len(text) // 4 + 1
+
+
+class Conversation:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.messages: List[dict] = []
+        # names of products whose information is already part of messages
+        self.injected_products = set()
+        # rolling (estimated) token count of messages, i.e. of the history sent with the next turn
+        self.history_tokens = 0
+        self.turns = 0
+        self.updated_at = time.monotonic()
+        self._lock = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        """
+        turns of one conversation must run one after the other, as each turn extends the history
+        the lock is created lazily, so that it is bound to the running event loop
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def touch(self) -> None:
+        self.updated_at = time.monotonic()
+
+    def add_turn(self, messages: List[dict]) -> None:
+        """
+        replace the history by messages, the history of the previous turn extended by the latest turn
+        :param messages: list of dicts
+        """
+        self.history_tokens += sum(
+            estimate_tokens(_message["content"]) for _message in messages[len(self.messages):]
+        )
+        self.messages = messages
+        self.turns += 1
+        self.touch()
+
+
+class ConversationStore:
+    def __init__(self, max_sessions: int, ttl_seconds: int):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._conversations: OrderedDict[str, Conversation] = OrderedDict()
+
+    def get(self, session_id: str) -> Conversation:
+        """
+        return the conversation for session_id, a new one is started for unknown or expired session-ids
+        :param session_id: str
+        :return: Conversation
+        """
+        self.evict_expired()
+        conversation = self._conversations.get(session_id)
+        if conversation is None:
+            conversation = self._conversations[session_id] = Conversation(session_id)
+            while len(self._conversations) > self.max_sessions:
+                self._conversations.popitem(last=False)
+        self._conversations.move_to_end(session_id)
+        conversation.touch()
+        return conversation
+
+    def evict_expired(self) -> None:
+        expired_before = time.monotonic() - self.ttl_seconds
+        # conversations are kept in order of last use, so the expired ones are at the front
+        while self._conversations:
+            session_id, conversation = next(iter(self._conversations.items()))
+            if conversation.updated_at >= expired_before:
+                break
+            del self._conversations[session_id]
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+
+conversation_store = ConversationStore(
+    max_sessions=get_settings().conversation_max_sessions,
+    ttl_seconds=get_settings().conversation_ttl_seconds,
+)
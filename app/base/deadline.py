@@ -0,0 +1,121 @@
+"""
+per-request deadline, carried through all steps of the chat pipeline
+"""
+from __future__ import annotations
+
+import time
+from typing import Iterable, List
+
+# degradations, in the order in which they are applied when the budget runs short
+SKIP_EVALUATION = "skip_evaluation"
+LOCAL_EXTRACTION = "local_extraction"
+SHRINK_PRODUCT_CONTEXT = "shrink_product_context"
+DEGRADATION_ORDER = (SKIP_EVALUATION, LOCAL_EXTRACTION, SHRINK_PRODUCT_CONTEXT)
+
+# rough p90 latencies of the pipeline steps in ms, used to decide whether a step still fits the budget
+STEP_ESTIMATES_MS = {
+    "moderation": 400,
+    "extraction": 1500,
+    "completion": 3000,
+    "completion_short": 2000,
+    "evaluation": 1200,
+}
+
+
+class DeadlineExceeded(Exception):
+    """
+    the time budget of the request ran out before a step that cannot be degraded
+    """
+
+    pass
+
+
+class Deadline:
+    def __init__(self, budget_ms: int, step_estimates_ms: dict = None):
+        self.budget_ms = budget_ms
+        self.step_estimates_ms = step_estimates_ms or STEP_ESTIMATES_MS
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget_ms / 1000
+        self.degradations: List[str] = []
+
+    def remaining(self) -> float:
+        """
+        remaining budget in seconds, never negative
+        :return: float
+        """
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def remaining_ms(self) -> int:
+        return int(self.remaining() * 1000)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, step: str) -> None:
+        """
+        raise DeadlineExceeded if there is no budget left for given step
+        :param step: str | name of step about to run
+        """
+        if self.expired():
+            raise DeadlineExceeded(
+                f"Deadline of {self.budget_ms}ms exceeded before step '{step}'"
+            )
+
+    def timeout(self, step: str, reserved_steps: Iterable[str] = ()) -> float:
+        """
+        timeout in seconds to be passed to an upstream call made by given step
+        the estimated cost of the steps still to run after this one is kept in reserve
+        :param step: str | name of step about to run
+        :param reserved_steps: iterable of step names that have to run after this step
+        :return: float
+        """
+        self.check(step)
+        reserved_ms = self.estimate_ms(self._apply_degradations(list(reserved_steps)))
+        timeout = self.remaining() - reserved_ms / 1000
+        if timeout <= 0:
+            raise DeadlineExceeded(
+                f"Not enough budget left for step '{step}': {self.remaining_ms()}ms remaining, {reserved_ms}ms reserved"
+            )
+        return timeout
+
+    def degrade(self, degradation: str) -> None:
+        if degradation not in self.degradations:
+            self.degradations.append(degradation)
+
+    def is_degraded(self, degradation: str) -> bool:
+        return degradation in self.degradations
+
+    def plan(self, pending_steps: Iterable[str]) -> List[str]:
+        """
+        apply degradations in DEGRADATION_ORDER until the estimated cost of the pending steps fits the remaining
+        budget. Degradations that do not affect any pending step are not applied, applied ones are sticky.
+        :param pending_steps: iterable of step names still to run, keys of STEP_ESTIMATES_MS
+        :return: list of degradations applied so far
+        """
+        pending_steps = self._apply_degradations(list(pending_steps))
+        for degradation in DEGRADATION_ORDER:
+            if self.remaining_ms() >= self.estimate_ms(pending_steps):
+                break
+            degraded_steps = self._apply_degradation(pending_steps, degradation)
+            if degraded_steps != pending_steps:
+                self.degrade(degradation)
+                pending_steps = degraded_steps
+        return self.degradations
+
+    def estimate_ms(self, steps: Iterable[str]) -> int:
+        return sum(self.step_estimates_ms.get(_step, 0) for _step in steps)
+
+    def _apply_degradations(self, steps: List[str]) -> List[str]:
+        for degradation in self.degradations:
+            steps = self._apply_degradation(steps, degradation)
+        return steps
+
+    @staticmethod
+    def _apply_degradation(steps: List[str], degradation: str) -> List[str]:
+        if degradation == SKIP_EVALUATION:
+            return [_step for _step in steps if _step != "evaluation"]
+        if degradation == LOCAL_EXTRACTION:
+            return [_step for _step in steps if _step != "extraction"]
+        if degradation == SHRINK_PRODUCT_CONTEXT:
+            return ["completion_short" if _step == "completion" else _step for _step in steps]
+        return steps
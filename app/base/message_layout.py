@@ -0,0 +1,48 @@
+"""
+layout of the messages sent upstream: a fixed prefix of static messages, followed by the variable ones
+"""
+from __future__ import annotations
+
+from typing import List, Sequence
+
+from app.base.conversation_store import estimate_tokens
+from app.utils.metrics_utils import metrics
+
+
+class MessageLayout:
+    """
+    messages of a prompt type (chat, extraction, evaluation) are always laid out as
+    [static prefix] + [history] + [variable messages]
+    The static prefix (system prompt, product list) is built once and byte-identical in every prompt, the history
+    is append-only. So each prompt starts with the complete prompt of the previous turn of its conversation,
+    which is what upstream prompt caching and our completion caches need.
+    Per build, the estimated tokens of the stable part (prefix and history) and its share of the prompt are
+    recorded as prompt_layout.<name>.* metrics.
+    """
+
+    def __init__(self, name: str, prefix: Sequence[dict]):
+        self.name = name
+        self.prefix = tuple(dict(_message) for _message in prefix)
+        self.prefix_tokens = sum(estimate_tokens(_message["content"]) for _message in self.prefix)
+
+    @property
+    def system_message(self) -> str:
+        return self.prefix[0]["content"]
+
+    def build(self, variable: Sequence[dict], history: Sequence[dict] = (), history_tokens: int = None) -> List[dict]:
+        """
+        the messages of a prompt
+        :param variable: list of dicts | messages that change with every prompt, e.g. the user message
+        :param history: list of dicts | (optional) conversation so far, without the static prefix
+        :param history_tokens: int | (optional) estimated tokens of history, if already known
+        :return: list of dicts
+        """
+        if history_tokens is None:
+            history_tokens = sum(estimate_tokens(_message["content"]) for _message in history)
+        stable_tokens = self.prefix_tokens + history_tokens
+        total_tokens = stable_tokens + sum(estimate_tokens(_message["content"]) for _message in variable)
+        metrics.incr(f"prompt_layout.{self.name}.builds")
+        metrics.observe(f"prompt_layout.{self.name}.stable_prefix_tokens", stable_tokens)
+        metrics.observe(f"prompt_layout.{self.name}.stable_prefix_share", stable_tokens / total_tokens)
+        # copies of the prefix, so that no caller can change it for all later prompts
+        return [*(dict(_message) for _message in self.prefix), *history, *variable]
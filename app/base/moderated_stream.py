@@ -0,0 +1,78 @@
+"""
+streamed completion tokens held back until the text they belong to passed the output checks
+"""
+from __future__ import annotations
+
+import re
+from typing import Awaitable, Callable, List
+
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+# a segment is sent once it ends a sentence (or line)
+_SEGMENT_END = re.compile(r"[.!?\n]\s*$")
+
+
+class ModeratedTokenStream:
+    """
+    tokens are collected into segments of at least min_segment_chars that end a sentence. Before a segment is
+    sent, the text sent so far plus the segment is moderated; once a segment could not be moderated the rest of the
+    response is only sent by release(), once the complete response passed the output moderation (and the
+    evaluation). Once a segment is flagged nothing is sent anymore.
+    With hold=True (inline evaluation) no segment is sent before release().
+    """
+
+    def __init__(
+        self,
+        on_token: Callable[[str], Awaitable[None]],
+        is_flagged: Callable[[str], Awaitable[bool]],
+        min_segment_chars: int,
+        hold: bool = False,
+    ):
+        self.on_token = on_token
+        self.is_flagged = is_flagged
+        self.min_segment_chars = min_segment_chars
+        self.hold = hold
+        self.stopped = False
+        self.flagged = False
+        self.sent: List[str] = []
+        self._pending: List[str] = []
+        self._pending_chars = 0
+
+    async def add_token(self, token: str) -> None:
+        """
+        on_token for the streamed completion
+        """
+        self._pending.append(token)
+        self._pending_chars += len(token)
+        if self.hold or self.stopped or self._pending_chars < self.min_segment_chars:
+            return
+        segment = "".join(self._pending)
+        if not _SEGMENT_END.search(segment):
+            return
+        try:
+            flagged = await self.is_flagged("".join(self.sent) + segment)
+        except Exception as e:
+            # the final output moderation decides about the rest of the response
+            log.warning(f"Moderating a streamed segment failed, holding back the rest of the response: {e}")
+            self.stopped = True
+            return
+        if flagged:
+            metrics.incr("chat.stream.flagged_segments")
+            self.stopped = self.flagged = True
+            return
+        await self._send(segment)
+
+    async def release(self) -> None:
+        """
+        send the held back rest of the response, only to be called once the complete response passed all checks
+        """
+        if self._pending and not self.flagged:
+            await self._send("".join(self._pending))
+
+    async def _send(self, segment: str) -> None:
+        self._pending, self._pending_chars = [], 0
+        self.sent.append(segment)
+        await self.on_token(segment)
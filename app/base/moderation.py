@@ -0,0 +1,164 @@
+"""
+two-tier moderation: local allow-/block-lists and a verdict cache in front of the remote moderation API
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+from app.base.catalog import normalize_text
+from app.base.chat_response import GenerateResponse
+from app.config.settings import get_settings
+from app.utils.metrics_utils import metrics
+
+
+def _normalize(text: str) -> str:
+    # moderation verdicts do not depend on surrounding whitespace
+    return " ".join(text.split())
+
+
+def _get_text_key(text: str) -> str:
+    return hashlib.sha256(_normalize(text).encode("utf-8")).hexdigest()
+
+
+def _read_lines(file_path: Optional[str]) -> List[str]:
+    if not file_path:
+        return []
+    with open(file_path, "r", encoding="utf-8") as fp:
+        return [_line.strip() for _line in fp if _line.strip() and not _line.startswith("#")]
+
+
+class ModerationVerdictCache:
+    """
+    remote verdicts by hash of the whitespace-normalized text, least recently used are evicted beyond max_entries
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._verdicts: OrderedDict[str, tuple] = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._verdicts.get(key)
+        if entry is None:
+            return None
+        verdict, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._verdicts[key]
+            return None
+        self._verdicts.move_to_end(key)
+        return verdict
+
+    def put(self, key: str, verdict: dict) -> None:
+        self._verdicts[key] = (verdict, time.monotonic())
+        self._verdicts.move_to_end(key)
+        while len(self._verdicts) > self.max_entries:
+            self._verdicts.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._verdicts)
+
+
+class Moderator:
+    """
+    texts are decided in this order:
+    1. allow-list: texts the service produced itself from catalog data (e.g. answer store answers) and
+       the texts of the allow-list file pass without a check
+    2. block-list: texts containing a phrase of the block-list file are flagged
+    3. verdict cache: verdicts of the remote moderation for the same text
+    4. remote moderation API, only for texts the tiers above could not decide
+    Verdicts are dicts with at least the key "flagged", as returned by the moderation API.
+    """
+
+    def __init__(self, block_phrases: Iterable[str], allow_texts: Iterable[str], verdict_cache: ModerationVerdictCache):
+        self._allowed = {_get_text_key(_text) for _text in allow_texts}
+        phrases = sorted({normalize_text(_phrase) for _phrase in block_phrases} - {""}, key=len, reverse=True)
+        # one alternation of all phrases, matched on whole words of the normalized text
+        self._block_pattern = (
+            re.compile(r"\b(?:" + "|".join(map(re.escape, phrases)) + r")\b") if phrases else None
+        )
+        self.verdict_cache = verdict_cache
+
+    @classmethod
+    def from_settings(cls) -> "Moderator":
+        settings = get_settings()
+        return cls(
+            block_phrases=_read_lines(settings.moderation_blocklist_file),
+            allow_texts=_read_lines(settings.moderation_allowlist_file),
+            verdict_cache=ModerationVerdictCache(
+                max_entries=settings.moderation_cache_max_entries,
+                ttl_seconds=settings.moderation_cache_ttl_seconds,
+            ),
+        )
+
+    def allow(self, text: str) -> None:
+        """
+        let text pass moderation without a check, for texts rendered by the service itself
+        :param text: str
+        """
+        self._allowed.add(_get_text_key(text))
+
+    def disallow(self, text: str) -> None:
+        """
+        undo allow(text), e.g. for an answer of a product that changed
+        :param text: str
+        """
+        self._allowed.discard(_get_text_key(text))
+
+    def decide_locally(self, text: str, key: str = None) -> Optional[dict]:
+        """
+        the verdict of the local tiers (allow-list, block-list, verdict cache)
+        :param text: str
+        :param key: str | (optional) hash of the normalized text, if already computed
+        :return: dict | None if text has to be moderated remotely
+        """
+        key = key or _get_text_key(text)
+        if key in self._allowed:
+            metrics.incr("moderation.allowed_locally")
+            return {"flagged": False, "source": "allowlist"}
+        if self._block_pattern is not None and self._block_pattern.search(normalize_text(text)):
+            metrics.incr("moderation.blocked_locally")
+            return {"flagged": True, "source": "blocklist"}
+        if (verdict := self.verdict_cache.get(key)) is not None:
+            metrics.incr("moderation.cache_hits")
+            return verdict
+        return None
+
+    async def amoderate(self, text: str) -> dict:
+        """
+        verdict for text, the remote moderation is only called if the local tiers cannot decide
+        :param text: str
+        :return: dict
+        """
+        key = _get_text_key(text)
+        if (verdict := self.decide_locally(text, key)) is not None:
+            return verdict
+        metrics.incr("moderation.remote_calls")
+        verdict = await GenerateResponse.aget_moderation(text)
+        self.verdict_cache.put(key, verdict)
+        return verdict
+
+    async def amoderate_many(self, texts: List[str], batch_size: int) -> List[dict]:
+        """
+        verdicts for texts, the undecided ones are moderated remotely batch_size texts per request
+        :param texts: list of str
+        :param batch_size: int
+        :return: list of dicts | in the order of texts
+        """
+        keys = [_get_text_key(_text) for _text in texts]
+        verdicts = [self.decide_locally(_text, _key) for _text, _key in zip(texts, keys)]
+        undecided = [_i for _i, _verdict in enumerate(verdicts) if _verdict is None]
+        for start in range(0, len(undecided), batch_size):
+            chunk = undecided[start:start + batch_size]
+            metrics.incr("moderation.remote_calls")
+            results = await GenerateResponse.aget_moderations([_normalize(texts[_i]) for _i in chunk])
+            for i, verdict in zip(chunk, results):
+                verdicts[i] = verdict
+                self.verdict_cache.put(keys[i], verdict)
+        return verdicts
+
+
+moderator = Moderator.from_settings()
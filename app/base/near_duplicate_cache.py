@@ -0,0 +1,195 @@
+"""
+cache of results for rephrased (near-duplicate) questions, using MinHash signatures with LSH banding
+"""
+from __future__ import annotations
+
+import hashlib
+import random
+import time
+from collections import OrderedDict, defaultdict, deque
+from typing import Any, Hashable, List, Optional, Tuple
+
+from app.base.catalog import get_catalog_index, normalize_text
+from app.config.settings import get_settings
+from app.utils.metrics_utils import metrics
+
+# words that do not change what a question asks for
+_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "of", "on", "for", "to", "in", "it", "its", "this", "that",
+    "what", "whats", "how", "do", "does", "you", "your", "i", "me", "my", "can", "could", "please", "tell",
+    "about", "have", "has", "there", "s",
+}
+# common rephrasings, mapped to one word
+_SYNONYMS = {
+    "much": "price", "cost": "price", "costs": "price", "priced": "price", "prices": "price",
+    "guarantee": "warranty", "warranties": "warranty",
+    "specs": "features", "specifications": "features",
+}
+_SHINGLE_SIZE = 3
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def get_canonical_text(text: str) -> str:
+    """
+    normalized text without stopwords and with synonyms replaced
+    :param text: str
+    :return: str
+    """
+    return " ".join(_SYNONYMS.get(_word, _word) for _word in normalize_text(text).split() if _word not in _STOPWORDS)
+
+
+def get_shingles(canonical_text: str) -> set:
+    """
+    character shingles of canonical_text
+    :param canonical_text: str
+    :return: set of str
+    """
+    if len(canonical_text) <= _SHINGLE_SIZE:
+        return {canonical_text}
+    return {canonical_text[i:i + _SHINGLE_SIZE] for i in range(len(canonical_text) - _SHINGLE_SIZE + 1)}
+
+
+class _Entry:
+    __slots__ = ("signature", "band_keys", "value", "created_at")
+
+    def __init__(self, signature, band_keys, value):
+        self.signature = signature
+        self.band_keys = band_keys
+        self.value = value
+        self.created_at = time.monotonic()
+
+
+class NearDuplicateCache:
+    """
+    results stored by question, returned for questions whose estimated (Jaccard) similarity of shingles
+    with a stored question is at least threshold.
+    Entries are scoped: a lookup only sees entries stored with the same scope (e.g. catalog version and
+    conversation state). Numbers of the question (4k, 65 inch) and the catalog products it names are part of the
+    scope, as similar questions about different products ("GameSphere X" / "GameSphere Y") must not share a result.
+    Entries are evicted least recently used first beyond max_entries, and after ttl_seconds.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        threshold: float,
+        max_entries: int,
+        ttl_seconds: int,
+        num_perm: int = 64,
+        bands: int = 16,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.name = name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.bands = bands
+        self.rows = num_perm // bands
+        _random = random.Random(num_perm)
+        self._permutations = [
+            (_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)
+        ]
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._buckets = defaultdict(set)
+        # (created_at, entry-id) in order of insertion, for the ttl eviction
+        self._expiry = deque()
+        self._next_id = 0
+
+    def get(self, text: str, scope: Hashable) -> Optional[Any]:
+        """
+        the result stored for the most similar question to text within scope
+        :param text: str | question
+        :param scope: hashable | scope of the lookup
+        :return: stored result, None if no question is similar enough
+        """
+        signature, band_keys = self._get_lookup_keys(text, scope)
+        self._evict_expired()
+        candidates = set().union(*(self._buckets.get(_key, ()) for _key in band_keys))
+        best_id, best_similarity = None, self.threshold
+        for entry_id in candidates:
+            similarity = self._get_similarity(signature, self._entries[entry_id].signature)
+            if similarity >= best_similarity:
+                best_id, best_similarity = entry_id, similarity
+        if best_id is None:
+            metrics.incr(f"near_duplicate_cache.{self.name}.misses")
+            return None
+        self._entries.move_to_end(best_id)
+        metrics.incr(f"near_duplicate_cache.{self.name}.hits")
+        metrics.observe(f"near_duplicate_cache.{self.name}.hit_similarity", best_similarity)
+        return self._entries[best_id].value
+
+    def put(self, text: str, scope: Hashable, value: Any) -> None:
+        """
+        store value as result for text within scope
+        """
+        signature, band_keys = self._get_lookup_keys(text, scope)
+        entry_id, self._next_id = self._next_id, self._next_id + 1
+        self._entries[entry_id] = _Entry(signature, band_keys, value)
+        self._expiry.append((self._entries[entry_id].created_at, entry_id))
+        for key in band_keys:
+            self._buckets[key].add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_lookup_keys(self, text: str, scope: Hashable) -> Tuple[Tuple[int, ...], List[tuple]]:
+        canonical_text = get_canonical_text(text)
+        numbers = tuple(sorted({_word for _word in canonical_text.split() if any(_c.isdigit() for _c in _word)}))
+        products = tuple(sorted(
+            _name for _item in get_catalog_index().extract_products(text) for _name in _item.get("products", ())
+        ))
+        scope = (scope, numbers, products)
+        signature = self._get_signature(get_shingles(canonical_text))
+        band_keys = [
+            (scope, _band, signature[_band * self.rows:(_band + 1) * self.rows]) for _band in range(self.bands)
+        ]
+        return signature, band_keys
+
+    def _get_signature(self, shingles: set) -> Tuple[int, ...]:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(_shingle.encode("utf-8"), digest_size=8).digest(), "big")
+            for _shingle in shingles
+        ]
+        return tuple(
+            min((_a * _hash + _b) % _MERSENNE_PRIME for _hash in hashes) for _a, _b in self._permutations
+        )
+
+    @staticmethod
+    def _get_similarity(signature: Tuple[int, ...], other_signature: Tuple[int, ...]) -> float:
+        return sum(_x == _y for _x, _y in zip(signature, other_signature)) / len(signature)
+
+    def _evict_expired(self) -> None:
+        expired_before = time.monotonic() - self.ttl_seconds
+        # a hit does not extend the lifetime of an entry, so entries expire in order of insertion
+        while self._expiry and self._expiry[0][0] < expired_before:
+            _, entry_id = self._expiry.popleft()
+            if entry_id in self._entries:
+                self._evict(entry_id)
+
+    def _evict(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for key in entry.band_keys:
+            bucket = self._buckets[key]
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[key]
+        metrics.incr(f"near_duplicate_cache.{self.name}.evictions")
+
+
+def _new_cache(name: str, threshold_percent: int) -> NearDuplicateCache:
+    settings = get_settings()
+    return NearDuplicateCache(
+        name=name,
+        threshold=threshold_percent / 100,
+        max_entries=settings.near_duplicate_cache_max_entries,
+        ttl_seconds=settings.near_duplicate_cache_ttl_seconds,
+    )
+
+
+# extracted products/categories, scoped to the catalog version
+extraction_cache = _new_cache("extraction", get_settings().near_duplicate_extraction_threshold)
+# final responses, scoped to the catalog version and the conversation history
+answer_cache = _new_cache("answer", get_settings().near_duplicate_answer_threshold)
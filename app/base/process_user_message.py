@@ -1,11 +1,64 @@
-import openai
-import prompt_utils
+import asyncio
+import json
+
+from app.base import prompt_utils
+from app.base.answer_store import answer_store
+from app.base.catalog import get_catalog_index
+from app.base.chat_analytics import TurnRecord, analytics_sink
 from app.base.chat_response import GenerateResponse
+from app.base.conversation_store import estimate_tokens
+from app.base.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    LOCAL_EXTRACTION,
+    SHRINK_PRODUCT_CONTEXT,
+    SKIP_EVALUATION,
+)
+from app.base.message_layout import MessageLayout
+from app.base.moderated_stream import ModeratedTokenStream
+from app.base.moderation import moderator
+from app.base.near_duplicate_cache import answer_cache, extraction_cache
+from app.config.settings import get_settings
+from app.utils.metrics_utils import metrics
+from app.utils.single_flight import get_call_key
+from app.utils.task_queue import background_tasks
+
+# product fields kept when the product context has to be shrunk
+SHRUNK_PRODUCT_FIELDS = ("name", "category", "price", "warranty", "rating")
+CHAT_SYSTEM_MESSAGE = """
+                     You are a customer service assistant for a large electronic store. \
+                     Respond in a friendly and helpful tone, with concise answers. \
+                     Make sure to ask the user relevant follow-up questions.
+                     """
+# the completion and the evaluation of a turn share the system prompt as their static prefix
+chat_layout = MessageLayout("chat", [{'role': 'system', 'content': CHAT_SYSTEM_MESSAGE}])
+evaluation_layout = MessageLayout("evaluation", [{'role': 'system', 'content': CHAT_SYSTEM_MESSAGE}])
+# errors raised when an upstream call does not finish within the timeout given to it,
+# GenerateResponse raises openai timeouts as UpstreamTimeout (an asyncio.TimeoutError)
+UPSTREAM_TIMEOUT_ERRORS = (asyncio.TimeoutError,)
+
+
+def log_step(debug, message):
+    """
+    print message if debug, off the request path when called from the event loop
+    """
+    if not debug:
+        return
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        print(message)
+        return
+    background_tasks.submit(print, message)
 
 
-def check_moderation_flags(inp, debug):
-    response = openai.Moderation.create(input=inp)
-    moderation_output = response["results"][0]
+async def acheck_moderation_flags(inp, debug, deadline, reserved_steps=(), moderation_output=None):
+    if moderation_output is None:
+        timeout = deadline.timeout("moderation", reserved_steps=reserved_steps)
+        try:
+            moderation_output = await asyncio.wait_for(moderator.amoderate(inp), timeout)
+        except UPSTREAM_TIMEOUT_ERRORS as e:
+            raise DeadlineExceeded(f"Moderation did not finish within the deadline of {deadline.budget_ms}ms") from e
     flag_msg = ""
 
     if moderation_output["flagged"]:
@@ -17,24 +70,105 @@ def check_moderation_flags(inp, debug):
 
 def extract_products_list(data, debug):
     category_and_product_list = prompt_utils.read_string_to_list(data)
-    if debug:
-        print("Step 2: Extracted list of products.")
+    log_step(debug, "Step 2: Extracted list of products.")
     return category_and_product_list
 
 
-def product_lookup(data, debug):
-    product_information = prompt_utils.generate_output_string(data)
-    if debug:
-        print("Step 3: Looked up product information.")
+async def afind_products(user_input, deadline, debug, batch=None):
+    """
+    extract mentioned products and categories, falls back to the local extractor
+    if the deadline does not leave enough budget for the LLM extraction
+    model output that cannot be parsed falls back to the local extractor as well
+    turns of the same batch share the extraction of identical (normalized) inputs,
+    rephrasings of questions already extracted are served from the extraction cache
+    """
+    use_cache = get_settings().near_duplicate_cache_enabled
+    scope = get_catalog_index().version
+    if use_cache and (category_and_product_list := extraction_cache.get(user_input, scope)):
+        log_step(debug, "Step 2: Extracted list of products from the cache.")
+        return category_and_product_list
+    if not deadline.is_degraded(LOCAL_EXTRACTION):
+        try:
+            timeout = deadline.timeout("extraction", reserved_steps=["completion", "moderation"])
+            # whitespace-normalized input, so that concurrent identical questions share one extraction call
+            normalized_input = " ".join(user_input.split())
+
+            def _extract():
+                return prompt_utils.afind_category_and_product_only(
+                    normalized_input,
+                    prompt_utils.get_products_and_category(),
+                    timeout=timeout,
+                )
+
+            category_and_product_response = await asyncio.wait_for(
+                batch.extract(normalized_input, _extract) if batch else _extract(),
+                timeout,
+            )
+            category_and_product_list = extract_products_list(data=category_and_product_response, debug=debug)
+            if category_and_product_list is not None:
+                if use_cache and category_and_product_list:
+                    extraction_cache.put(user_input, scope, category_and_product_list)
+                return category_and_product_list
+            # unparsable model output, the local extractor still finds the products named in the input
+        except (DeadlineExceeded, *UPSTREAM_TIMEOUT_ERRORS):
+            deadline.degrade(LOCAL_EXTRACTION)
+    category_and_product_list = get_catalog_index().extract_products(user_input)
+    log_step(debug, "Step 2: Extracted list of products locally.")
+    return category_and_product_list
+
+
+def get_mentioned_product_names(data_list):
+    """
+    names of the catalog products referenced by the extracted data, in order of mention, without duplicates
+    products of a mentioned category are all referenced
+    """
+    catalog = get_catalog_index()
+    names = []
+    for data in data_list or []:
+        try:
+            if "products" in data:
+                products = filter(None, map(catalog.get_product, data["products"]))
+            elif "category" in data:
+                products = catalog.get_products_by_category(data["category"])
+            else:
+                print("Error: Invalid object format")
+                continue
+            names.extend(_product["name"] for _product in products)
+        except Exception as e:
+            print(f"Error: {e}")
+    return list(dict.fromkeys(names))
+
+
+def product_lookup(data, debug, deadline=None, injected_products=None):
+    """
+    product information to be put in the prompt for the extracted data
+    :param data: list | extracted categories and products
+    :param debug: bool
+    :param deadline: Deadline | (optional) shrinks the product information if degraded
+    :param injected_products: set | (optional) names of products already put in the conversation history,
+        these are left out, the names put in the returned information are added
+    :return: str
+    """
+    catalog = get_catalog_index()
+    names = get_mentioned_product_names(data)
+    if injected_products is not None:
+        names = [_name for _name in names if _name not in injected_products]
+    if deadline and deadline.is_degraded(SHRINK_PRODUCT_CONTEXT):
+        names = names[:get_settings().shrunk_product_context_limit]
+        product_information = "\n".join(
+            json.dumps({_field: catalog.get_product(_name).get(_field) for _field in SHRUNK_PRODUCT_FIELDS})
+            for _name in names
+        )
+    else:
+        product_information = "".join(json.dumps(catalog.get_product(_name), indent=4) + "\n" for _name in names)
+    if injected_products is not None:
+        injected_products.update(names)
+    log_step(debug, "Step 3: Looked up product information.")
     return product_information
 
 
-def get_messages(delimiter, product_information):
-    system_message = f"""
-                     You are a customer service assistant for a large electronic store. \
-                     Respond in a friendly and helpful tone, with concise answers. \
-                     Make sure to ask the user relevant follow-up questions.
-                     """
+def get_messages(delimiter, user_input, product_information):
+    system_message = chat_layout.system_message
     messages = [
         {'role': 'system', 'content': system_message},
         {'role': 'user', 'content': f"{delimiter}{user_input}{delimiter}"},
@@ -44,59 +178,274 @@ def get_messages(delimiter, product_information):
     return {"sys_msg": system_message, "messages": messages}
 
 
-def process_user_message(user_input, all_messages, debug=True):
-    delimiter = "```"
+async def aprocess_conversation_turn(conversation, user_input, debug=False, deadline=None, batch=None, on_token=None):
+    """
+    run one turn of a stored conversation, the history of the conversation is extended by the turn
+    turns of the same conversation are run one after the other, products already injected into the history
+    are not injected again
+    :return: tuple | response to the user and the updated history, as aprocess_user_message
+    """
+    async with conversation.lock:
+        # only a completed turn changes the conversation
+        injected_products = set(conversation.injected_products)
+        response, messages = await aprocess_user_message(
+            user_input,
+            conversation.messages,
+            debug=debug,
+            deadline=deadline,
+            batch=batch,
+            on_token=on_token,
+            injected_products=injected_products,
+            turn_record=TurnRecord(
+                session_id=conversation.session_id, batch=batch is not None, streamed=on_token is not None
+            ),
+        )
+        conversation.injected_products = injected_products
+        conversation.add_turn(messages + [{'role': 'assistant', 'content': f"{response}"}])
+    return response, conversation.messages
+
+
+def process_user_message(user_input, all_messages, debug=True, deadline=None):
+    """
+    synchronous entrypoint for aprocess_user_message, must not be called from a running event loop
+    """
+    async def _run():
+        try:
+            return await aprocess_user_message(user_input, all_messages, debug=debug, deadline=deadline)
+        finally:
+            # the event loop is closed on return, finish the work queued by the turn first
+            await background_tasks.drain()
+
+    return asyncio.run(_run())
 
-    if flag_msg := check_moderation_flags(inp=user_input, debug=debug):
-        return flag_msg,all_messages
-    if debug:
-        print("Step 1: Input passed moderation check.")
 
-    category_and_product_response = prompt_utils.find_category_and_product_only(
+async def aprocess_user_message(
         user_input,
-        prompt_utils.get_products_and_category())
-    category_and_product_list = extract_products_list(data=category_and_product_response, debug=debug)
-    product_information = product_lookup(data=category_and_product_list,
-                                         debug=debug
-                                         )
-
-    system_message = get_messages(delimiter, product_information).get("sys_msg")
-    messages = get_messages(delimiter, product_information).get("messages")
-    final_response = GenerateResponse.get_completion_from_messages(messages=all_messages + messages)
-    if debug:
-        print("Step 4: Generated response to user question.")
+        all_messages,
+        debug=True,
+        deadline=None,
+        batch=None,
+        on_token=None,
+        injected_products=None,
+        turn_record=None,
+):
+    """
+    run one chat turn through moderation, extraction, lookup, completion, moderation and evaluation
+    all steps share the time budget of deadline (CHAT_DEADLINE_MS if not passed), when the budget runs short the
+    turn is degraded in the order: skip evaluation, local extraction only, shrink product context.
+    Applied degradations are recorded in deadline.degradations.
+    Raises DeadlineExceeded if the budget runs out before a step that cannot be degraded.
+    Cancelling the task running this coroutine cancels the upstream call in flight and all steps after it.
+    batch (ChatBatch) is passed for turns of a /chat/batch request, to reuse its batched input moderation
+    and shared extractions.
+    If on_token (async callable) is passed, the completion is streamed and on_token is awaited for every segment
+    of it (ModeratedTokenStream). Nothing is sent that did not pass the moderation: with CHAT_EVALUATION_MODE=inline
+    the response is only sent once it passed the output moderation and the evaluation, in background mode each
+    segment is moderated before it is sent. A response that fails is not sent (further), the returned response
+    replaces the streamed text.
+    Debug output is printed by the background task queue. With CHAT_EVALUATION_MODE=background the evaluation
+    is run there as well, and the response is returned as soon as it passed the output moderation.
+    injected_products (set) is passed on to product_lookup.
+    Templated questions about a single product (price, warranty, ...) are answered from the answer store,
+    without extraction, completion and evaluation; their answers pass the output moderation by its allow-list.
+    Rephrasings of questions answered before in the same conversation state are answered from the answer cache.
+    The turn is recorded in turn_record (TurnRecord, a new one if not passed), which is handed to the
+    analytics sink by the background task queue once the turn is over.
+    """
+    deadline = deadline or Deadline(get_settings().chat_deadline_ms)
+    turn_record = turn_record or TurnRecord(batch=batch is not None, streamed=on_token is not None)
+    error = None
+    try:
+        return await _aprocess_user_message(
+            user_input, all_messages, debug, deadline, batch, on_token, injected_products, turn_record
+        )
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        turn_record.finish(degradations=deadline.degradations, error=error)
+        background_tasks.submit(analytics_sink.add, turn_record)
+
+
+async def _aprocess_user_message(
+        user_input, all_messages, debug, deadline, batch, on_token, injected_products, turn_record
+):
+    delimiter = "```"
+
+    with turn_record.step("input_moderation"):
+        flag_msg = await acheck_moderation_flags(
+            inp=user_input,
+            debug=debug,
+            deadline=deadline,
+            reserved_steps=["completion", "moderation"],
+            moderation_output=batch.get_input_verdict(user_input) if batch else None,
+        )
+    turn_record.input_flagged = bool(flag_msg)
+    if flag_msg:
+        return flag_msg, all_messages
+    log_step(debug, "Step 1: Input passed moderation check.")
+
+    if get_settings().answer_store_enabled and (answer := answer_store.lookup(user_input)):
+        turn_record.answer_source = "answer_store"
+        log_step(debug, "Step 2: Answered from the answer store.")
+        # answers of the store are on the allow-list of the moderation, no remote call
+        with turn_record.step("output_moderation"):
+            flag_msg = await acheck_moderation_flags(inp=answer, debug=debug, deadline=deadline)
+        turn_record.output_flagged = bool(flag_msg)
+        if flag_msg:
+            return flag_msg, all_messages
+        if on_token:
+            await on_token(answer)
+        return answer, all_messages + [{'role': 'user', 'content': f"{delimiter}{user_input}{delimiter}"}]
+    use_cache = get_settings().near_duplicate_cache_enabled
+    # answers depend on the conversation so far, only the same history shares them
+    answer_scope = (get_catalog_index().version, get_call_key(all_messages))
+    if use_cache and (cached := answer_cache.get(user_input, answer_scope)):
+        turn_record.answer_source = "answer_cache"
+        turn_record.matched_products = cached["product_names"]
+        log_step(debug, "Step 2: Answered from the answer cache.")
+        if injected_products is not None:
+            injected_products.update(cached["product_names"])
+        if on_token:
+            await on_token(cached["response"])
+        messages = get_messages(delimiter, user_input, cached["product_information"]).get("messages")
+        return cached["response"], all_messages + messages[1:]
+    turn_record.answer_source = "llm"
+
+    def _cache_answer():
+        # answers of degraded turns are not worth reusing
+        if use_cache and not deadline.degradations:
+            answer_cache.put(user_input, answer_scope, {
+                "response": final_response,
+                "product_information": product_information,
+                "product_names": turn_record.matched_products,
+            })
+
+    # in background mode the evaluation does not take from the budget of the turn
+    evaluate_inline = get_settings().chat_evaluation_mode != "background"
+    deadline.plan(["extraction", "completion", "moderation"] + (["evaluation"] if evaluate_inline else []))
+    with turn_record.step("extraction"):
+        category_and_product_list = await afind_products(user_input, deadline=deadline, debug=debug, batch=batch)
+    with turn_record.step("lookup"):
+        turn_record.matched_products = get_mentioned_product_names(category_and_product_list)
+        product_information = product_lookup(data=category_and_product_list,
+                                             debug=debug,
+                                             deadline=deadline,
+                                             injected_products=injected_products,
+                                             )
+
+    messages = get_messages(delimiter, user_input, product_information).get("messages")
+    prompt_messages = chat_layout.build(variable=messages[1:], history=all_messages)
+    turn_record.prompt_tokens = sum(estimate_tokens(_message["content"]) for _message in prompt_messages)
+    stream = None
+    if on_token:
+
+        async def _is_flagged(text):
+            return bool(await acheck_moderation_flags(
+                inp=text, debug=False, deadline=deadline, reserved_steps=["moderation"]
+            ))
+
+        stream = ModeratedTokenStream(
+            on_token, _is_flagged, get_settings().chat_stream_segment_chars, hold=evaluate_inline
+        )
+    try:
+        timeout = deadline.timeout("completion", reserved_steps=["moderation"])
+        if stream:
+            completion = GenerateResponse.astream_completion_from_messages(
+                messages=prompt_messages, on_token=stream.add_token, timeout=timeout
+            )
+        else:
+            completion = GenerateResponse.aget_completion_from_messages(messages=prompt_messages, timeout=timeout)
+        with turn_record.step("completion"):
+            final_response = await asyncio.wait_for(completion, timeout)
+    except UPSTREAM_TIMEOUT_ERRORS as e:
+        raise DeadlineExceeded(f"Completion did not finish within the deadline of {deadline.budget_ms}ms") from e
+    turn_record.completion_tokens = estimate_tokens(final_response)
+    log_step(debug, "Step 4: Generated response to user question.")
     all_messages = all_messages + messages[1:]
 
-    if flag_msg := check_moderation_flags(inp=final_response, debug=debug):
-        return flag_msg,all_messages
-    if debug:
-        print("Step 5: Response passed moderation check.")
+    with turn_record.step("output_moderation"):
+        flag_msg = await acheck_moderation_flags(inp=final_response, debug=debug, deadline=deadline)
+    turn_record.output_flagged = bool(flag_msg)
+    if flag_msg:
+        return flag_msg, all_messages
+    log_step(debug, "Step 5: Response passed moderation check.")
 
-    user_message = f"""
-        Customer message: {delimiter}{user_input}{delimiter}
-        Agent response: {delimiter}{final_response}{delimiter}
-        Does the response sufficiently answer the question?
-    """
-    messages = [
-        {'role': 'system', 'content': system_message},
-        {'role': 'user', 'content': user_message}
-    ]
-    evaluation_response = GenerateResponse.get_completion_from_messages(messages)
-    if debug:
-        print("Step 6: Model evaluated the response.")
+    async def _release():
+        if stream:
+            await stream.release()
+
+    if not evaluate_inline:
+        turn_record.evaluation = "background"
+        # cached only once the evaluation approved it, as in inline mode
+        background_tasks.submit(
+            aevaluate_in_background, delimiter, user_input, final_response, debug, on_approved=_cache_answer
+        )
+        await _release()
+        return final_response, all_messages
+    deadline.plan(["evaluation"])
+    if deadline.is_degraded(SKIP_EVALUATION):
+        turn_record.evaluation = "skipped"
+        log_step(debug, "Step 6: Skipped evaluation, deadline too close.")
+        await _release()
+        return final_response, all_messages
+
+    try:
+        timeout = deadline.timeout("evaluation")
+        with turn_record.step("evaluation"):
+            evaluation_response = await asyncio.wait_for(
+                GenerateResponse.aget_completion_from_messages(
+                    get_evaluation_messages(delimiter, user_input, final_response), timeout=timeout
+                ),
+                timeout,
+            )
+    except (DeadlineExceeded, *UPSTREAM_TIMEOUT_ERRORS):
+        deadline.degrade(SKIP_EVALUATION)
+        turn_record.evaluation = "skipped"
+        log_step(debug, "Step 6: Evaluation did not finish within the deadline, skipped.")
+        await _release()
+        return final_response, all_messages
+    log_step(debug, "Step 6: Model evaluated the response.")
 
     if "Y" in evaluation_response:
-        if debug:
-            print("Step 7: Model approved the response.")
+        turn_record.evaluation = "approved"
+        _cache_answer()
+        log_step(debug, "Step 7: Model approved the response.")
+        await _release()
         return final_response, all_messages
     else:
-        if debug:
-            print("Step 7: Model disapproved the response.")
+        turn_record.evaluation = "disapproved"
+        log_step(debug, "Step 7: Model disapproved the response.")
         neg_str = "I'm unable to provide the information you're looking\
                    for. I'll connect you with a human representative for further assistance."
         return neg_str, all_messages
 
 
+def get_evaluation_messages(delimiter, user_input, final_response):
+    user_message = f"""
+        Customer message: {delimiter}{user_input}{delimiter}
+        Agent response: {delimiter}{final_response}{delimiter}
+        Does the response sufficiently answer the question?
+    """
+    return evaluation_layout.build(variable=[{'role': 'user', 'content': user_message}])
+
+
+async def aevaluate_in_background(delimiter, user_input, final_response, debug=False, on_approved=None):
+    """
+    evaluate a response that was already sent (CHAT_EVALUATION_MODE=background), the verdict is counted
+    on_approved (callable) is called if the evaluation approved the response, e.g. to cache it
+    """
+    messages = get_evaluation_messages(delimiter, user_input, final_response)
+    # not bound to the deadline of the turn, but to a full turn budget
+    timeout = get_settings().chat_deadline_ms / 1000
+    evaluation_response = await GenerateResponse.aget_completion_from_messages(messages, timeout=timeout)
+    approved = "Y" in evaluation_response
+    metrics.incr("chat.evaluation.approved" if approved else "chat.evaluation.disapproved")
+    log_step(debug, f"Step 7: Model {'approved' if approved else 'disapproved'} the sent response.")
+    if approved and on_approved:
+        on_approved()
+
+
 if __name__ == "__main__":
     user_input = "I want to kill a man"
     response, _ = process_user_message(user_input, [])
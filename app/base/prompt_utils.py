@@ -1,8 +1,11 @@
 import json
-import openai
+import os
 from collections import defaultdict
 
-products_file = 'products.json'
+from app.base.message_layout import MessageLayout
+from app.base.structured_output import parse_category_and_product_list
+
+products_file = os.path.join(os.path.dirname(__file__), 'products.json')
 categories_file = 'categories.json'
 
 delimiter = "####"
@@ -108,12 +111,15 @@ step_6_system_message_content = f"""
 step_6_system_message = {'role': 'system', 'content': step_6_system_message_content}
 
 
-def get_completion_from_messages(messages, model="gpt-3.5-turbo", temperature=0, max_tokens=500):
-    response = openai.ChatCompletion.create(
+def get_completion_from_messages(messages, model="gpt-3.5-turbo", temperature=0, max_tokens=500, timeout=None):
+    from app.base.chat_response import get_openai
+
+    response = get_openai().ChatCompletion.create(
         model=model,
         messages=messages,
         temperature=temperature,
         max_tokens=max_tokens,
+        request_timeout=timeout,
     )
     return response.choices[0].message["content"]
 
@@ -207,9 +213,8 @@ def find_category_and_product(user_input, products_and_category):
     return get_completion_from_messages(messages)
 
 
-def find_category_and_product_only(user_input, products_and_category):
-    delimiter = "####"
-    system_message = f"""
+# static prefix of every extraction prompt, built once
+category_and_product_only_system_message = f"""
     You will be provided with customer service queries. \
     The customer service query will be delimited with {delimiter} characters.
     Output a python list of objects, where each object has the following format:
@@ -267,11 +272,26 @@ def find_category_and_product_only(user_input, products_and_category):
         
     Only output the list of objects, nothing else.
     """
-    messages = [
-        {'role': 'system', 'content': system_message},
-        {'role': 'user', 'content': f"{delimiter}{user_input}{delimiter}"},
-    ]
-    return get_completion_from_messages(messages)
+extraction_layout = MessageLayout(
+    "extraction", [{'role': 'system', 'content': category_and_product_only_system_message}]
+)
+
+
+def get_category_and_product_only_messages(user_input):
+    delimiter = "####"
+    return extraction_layout.build(variable=[{'role': 'user', 'content': f"{delimiter}{user_input}{delimiter}"}])
+
+
+def find_category_and_product_only(user_input, products_and_category, timeout=None):
+    messages = get_category_and_product_only_messages(user_input)
+    return get_completion_from_messages(messages, timeout=timeout)
+
+
+async def afind_category_and_product_only(user_input, products_and_category, timeout=None):
+    from app.base.chat_response import GenerateResponse
+
+    messages = get_category_and_product_only_messages(user_input)
+    return await GenerateResponse.aget_completion_from_messages(messages, timeout=timeout)
 
 
 def get_products_from_query(user_msg):
@@ -349,16 +369,11 @@ def get_mentioned_product_info(data_list):
 
 
 def read_string_to_list(input_string):
-    if input_string is None:
-        return None
-
-    try:
-        input_string = input_string.replace("'", "\"")  # Replace single quotes with double quotes for valid JSON
-        data = json.loads(input_string)
-        return data
-    except json.JSONDecodeError:
-        print("Error: Invalid JSON string")
-        return None
+    """
+    parse the output of the extraction prompt, see structured_output.parse_category_and_product_list
+    :return: list of dicts | None if no list could be parsed
+    """
+    return parse_category_and_product_list(input_string)
 
 
 def generate_output_string(data_list):
@@ -0,0 +1,139 @@
+"""
+tolerant parser for the structured (list of objects) output of the extraction step
+"""
+from __future__ import annotations
+
+import ast
+import json
+import re
+from typing import Iterator, List, Optional
+
+from app.base.catalog import CatalogIndex, get_catalog_index
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+_CLOSING_BRACKETS = {"[": "]", "{": "}"}
+# a single-quoted string, apostrophes followed by a letter or digit are part of it
+_SINGLE_QUOTED = re.compile(r"'((?:[^'\\]|\\.|'(?=\w))*)'")
+
+
+def iter_lists(text: str) -> Iterator[str]:
+    """
+    the complete (bracket-balanced) lists in text, outermost only, in order
+    prose before, between and after them is skipped. Brackets within quoted strings are ignored, as are
+    apostrophes within words ("Joe's"), so product names do not break the scan.
+    :param text: str | model output
+    :return: iterator of str | list literals
+    """
+    start = text.find("[")
+    while start != -1:
+        stack, quote, escaped, end = [], None, False, None
+        for i in range(start, len(text)):
+            char = text[i]
+            if char == "'" and text[i - 1:i].isalnum() and text[i + 1:i + 2].isalnum():
+                continue
+            if quote:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == quote:
+                    quote = None
+            elif char in "\"'":
+                quote = char
+            elif char in _CLOSING_BRACKETS:
+                stack.append(_CLOSING_BRACKETS[char])
+            elif char in "]}":
+                if not stack or stack.pop() != char:
+                    break
+                if not stack:
+                    end = i + 1
+                    break
+        else:
+            # unclosed list (truncated output), lists after start would be nested in it
+            return
+        if end is None:
+            start = text.find("[", start + 1)
+        else:
+            yield text[start:end]
+            start = text.find("[", end)
+
+
+def _load_literal(literal: str):
+    try:
+        return json.loads(literal)
+    except json.JSONDecodeError:
+        pass
+    # python literal: single quotes, True/None
+    try:
+        return ast.literal_eval(literal)
+    except (ValueError, SyntaxError):
+        pass
+    # single-quoted strings with an unescaped apostrophe ('Joe's Laptop'), not valid python either
+    try:
+        return json.loads(_SINGLE_QUOTED.sub(lambda _match: json.dumps(_match.group(1)), literal))
+    except json.JSONDecodeError:
+        return None
+
+
+def validate_category_and_product_list(data: list, catalog: CatalogIndex) -> List[dict]:
+    """
+    keep the well-formed items of data, with product and category names as in the catalog
+    an item is {'category': <category>, 'products': [<product names>]} or {'category': <category>},
+    unknown products are dropped, an unknown category is taken from the item's products.
+    :param data: list | parsed model output
+    :param catalog: CatalogIndex
+    :return: list of dicts
+    """
+    validated = []
+    for item in data:
+        if not isinstance(item, dict):
+            metrics.incr("structured_output.invalid_items")
+            continue
+        category = item.get("category")
+        category = category if isinstance(category, str) and category in catalog.by_category else None
+        names = item.get("products")
+        if names is None:
+            if category is None:
+                metrics.incr("structured_output.invalid_items")
+                continue
+            validated.append({"category": category})
+            continue
+        if isinstance(names, str):
+            names = [names]
+        if not isinstance(names, list):
+            metrics.incr("structured_output.invalid_items")
+            continue
+        products = [catalog.get_product(_name) for _name in names if isinstance(_name, str)]
+        if unknown := len(names) - len(products := [_product for _product in products if _product]):
+            metrics.incr("structured_output.unknown_products", unknown)
+        if not products:
+            if category is not None:
+                validated.append({"category": category})
+            continue
+        validated.append({
+            "category": category or products[0]["category"],
+            "products": [_product["name"] for _product in products],
+        })
+    return validated
+
+
+def parse_category_and_product_list(text: Optional[str], catalog: CatalogIndex = None) -> Optional[List[dict]]:
+    """
+    parse the output of the category/product extraction prompt
+    :param text: str | model output, possibly with prose around the list
+    :param catalog: CatalogIndex | (optional) the process-wide index if not passed
+    :return: list of dicts | None if the output does not contain a parsable list
+    """
+    if text is None:
+        return None
+    # the first literal that loads as list, "[best]" in prose before the actual list does not
+    data = next(filter(lambda _data: isinstance(_data, list), map(_load_literal, iter_lists(text))), None)
+    if data is None:
+        metrics.incr("structured_output.parse_failures")
+        log.warning(f"No list of objects found in model output: {text[:200]!r}")
+        return None
+    metrics.incr("structured_output.parsed")
+    return validate_category_and_product_list(data, catalog or get_catalog_index())
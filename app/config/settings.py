@@ -0,0 +1,120 @@
+"""
+runtime settings for the chat service, read from env-vars (or .env file)
+"""
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+
+def _get_int(env_var: str, default: int) -> int:
+    value = os.getenv(env_var)
+    return int(value) if value not in (None, "") else default
+
+
+def _get_float(env_var: str, default: float) -> float:
+    value = os.getenv(env_var)
+    return float(value) if value not in (None, "") else default
+
+
+class Settings:
+    def __init__(self):
+        load_dotenv()
+        # overall time budget for one chat turn, can be overridden per request
+        self.chat_deadline_ms = _get_int("CHAT_DEADLINE_MS", 8000)
+        # number of products kept in the product context once it has to be shrunk
+        self.shrunk_product_context_limit = _get_int("CHAT_SHRUNK_PRODUCT_LIMIT", 3)
+        # conversations kept in memory for chats with a session-id
+        self.conversation_max_sessions = _get_int("CONVERSATION_MAX_SESSIONS", 10000)
+        self.conversation_ttl_seconds = _get_int("CONVERSATION_TTL_SECONDS", 3600)
+        # turns of a /chat/batch request processed at the same time, per request default and upper limit
+        self.chat_batch_concurrency = _get_int("CHAT_BATCH_CONCURRENCY", 8)
+        self.chat_batch_max_concurrency = _get_int("CHAT_BATCH_MAX_CONCURRENCY", 32)
+        # turns per /chat/batch request, a batch holds a single admission slot
+        self.chat_batch_max_turns = _get_int("CHAT_BATCH_MAX_TURNS", 100)
+        # inputs sent in one moderation request when moderating a batch
+        self.moderation_batch_size = _get_int("MODERATION_BATCH_SIZE", 32)
+        # admission control of chat requests, per worker process
+        self.admission_max_in_flight = _get_int("ADMISSION_MAX_IN_FLIGHT", 32)
+        self.admission_max_queue = _get_int("ADMISSION_MAX_QUEUE", 64)
+        self.admission_queue_timeout_ms = _get_int("ADMISSION_QUEUE_TIMEOUT_MS", 2000)
+        self.admission_max_per_tenant = _get_int("ADMISSION_MAX_PER_TENANT", 16)
+        self.admission_max_per_session = _get_int("ADMISSION_MAX_PER_SESSION", 2)
+        self.admission_retry_after_s = _get_int("ADMISSION_RETRY_AFTER_S", 1)
+        # in-process queue for work done after the response is sent
+        self.background_queue_capacity = _get_int("BACKGROUND_QUEUE_CAPACITY", 1000)
+        self.background_queue_workers = _get_int("BACKGROUND_QUEUE_WORKERS", 2)
+        self.background_drain_timeout_s = _get_int("BACKGROUND_DRAIN_TIMEOUT_S", 10)
+        # warmup of a worker before it reports ready, and draining of in-flight turns on shutdown
+        self.warmup_timeout_s = _get_int("WARMUP_TIMEOUT_S", 30)
+        self.shutdown_drain_timeout_s = _get_int("SHUTDOWN_DRAIN_TIMEOUT_S", 5)
+        # sampling profiler for single requests, the middleware is only installed if enabled
+        self.profiler_enabled = bool(_get_int("PROFILER_ENABLED", 0))
+        # share of requests profiled, requests with the header X-Profile: 1 are always profiled
+        self.profiler_sample_rate = _get_float("PROFILER_SAMPLE_RATE", 0.0)
+        self.profiler_interval_ms = _get_int("PROFILER_INTERVAL_MS", 5)
+        self.profiler_dir = os.getenv("PROFILER_DIR") or os.path.join("data", "profiles")
+        self.profiler_max_bytes = _get_int("PROFILER_MAX_BYTES", 50 * 1024 * 1024)
+        # allocation tracking with tracemalloc, slows down the worker, only to be enabled for diagnostics
+        self.memory_diagnostics_enabled = bool(_get_int("MEMORY_DIAGNOSTICS_ENABLED", 0))
+        self.memory_snapshot_interval_s = _get_int("MEMORY_SNAPSHOT_INTERVAL_S", 300)
+        # frames stored per allocation, 1 is enough to group by file and line
+        self.memory_trace_frames = _get_int("MEMORY_TRACE_FRAMES", 1)
+        self.memory_top_n = _get_int("MEMORY_TOP_N", 20)
+        # share of requests whose peak allocations are recorded
+        self.memory_request_sample_rate = _get_float("MEMORY_REQUEST_SAMPLE_RATE", 0.01)
+        # "inline": a response is only sent once the evaluation approved it,
+        # "background": the response is sent right away, the evaluation is only recorded in the metrics
+        self.chat_evaluation_mode = os.getenv("CHAT_EVALUATION_MODE") or "inline"
+        # streamed responses are sent in segments of at least this many characters, each moderated before it is sent
+        self.chat_stream_segment_chars = _get_int("CHAT_STREAM_SEGMENT_CHARS", 120)
+        # seconds between checks whether the product catalog file changed, it is read again once it did
+        self.catalog_reload_interval_s = _get_float("CATALOG_RELOAD_INTERVAL_S", 5.0)
+        # answers to templated catalog questions rendered from the catalog instead of generated by the LLM
+        self.answer_store_enabled = bool(_get_int("ANSWER_STORE_ENABLED", 1))
+        # longer questions always go to the LLM
+        self.answer_store_max_words = _get_int("ANSWER_STORE_MAX_WORDS", 20)
+        # cache of results for rephrased questions, thresholds are minimum similarities in percent
+        self.near_duplicate_cache_enabled = bool(_get_int("NEAR_DUPLICATE_CACHE_ENABLED", 1))
+        self.near_duplicate_cache_max_entries = _get_int("NEAR_DUPLICATE_CACHE_MAX_ENTRIES", 10000)
+        self.near_duplicate_cache_ttl_seconds = _get_int("NEAR_DUPLICATE_CACHE_TTL_SECONDS", 3600)
+        self.near_duplicate_extraction_threshold = _get_int("NEAR_DUPLICATE_EXTRACTION_THRESHOLD", 80)
+        self.near_duplicate_answer_threshold = _get_int("NEAR_DUPLICATE_ANSWER_THRESHOLD", 90)
+        # local tiers of the moderation, files with one phrase/text per line
+        self.moderation_blocklist_file = os.getenv("MODERATION_BLOCKLIST_FILE") or os.path.join(
+            os.path.dirname(__file__), "moderation_blocklist.txt"
+        )
+        self.moderation_allowlist_file = os.getenv("MODERATION_ALLOWLIST_FILE") or None
+        # cache of the verdicts of the remote moderation
+        self.moderation_cache_max_entries = _get_int("MODERATION_CACHE_MAX_ENTRIES", 50000)
+        self.moderation_cache_ttl_seconds = _get_int("MODERATION_CACHE_TTL_SECONDS", 86400)
+        # record/replay of model and moderation calls: off, record or replay
+        self.cassette_mode = os.getenv("CASSETTE_MODE") or "off"
+        self.cassette_path = os.getenv("CASSETTE_PATH") or os.path.join("data", "cassettes", "chat.jsonl.gz")
+        # replay with the recorded latencies instead of instantly
+        self.cassette_replay_latency = bool(_get_int("CASSETTE_REPLAY_LATENCY", 0))
+        # BigQuery analytics of chat turns, disabled unless a dataset is set
+        self.analytics_dataset = os.getenv("ANALYTICS_DATASET") or None
+        self.analytics_table = os.getenv("ANALYTICS_TABLE") or "chat_turns"
+        self.analytics_flush_size = _get_int("ANALYTICS_FLUSH_SIZE", 500)
+        self.analytics_flush_interval_s = _get_int("ANALYTICS_FLUSH_INTERVAL_S", 30)
+        self.analytics_max_buffer = _get_int("ANALYTICS_MAX_BUFFER", 10000)
+        # rows that could not be loaded are kept here until BigQuery is reachable again
+        self.analytics_spill_dir = os.getenv("ANALYTICS_SPILL_DIR") or os.path.join("data", "analytics_spill")
+        # seconds to wait for the GCP metadata server when resolving the project id, off GCP it never answers
+        self.gcp_metadata_timeout_s = _get_float("GCP_METADATA_TIMEOUT_S", 1.0)
+        # seconds a failed project id resolution is kept before it is tried again
+        self.gcp_project_retry_s = _get_float("GCP_PROJECT_RETRY_S", 30.0)
+        # transformations of at least this many records cast whole columns at once (pandas) instead of each value
+        self.transform_columnar_min_rows = _get_int("TRANSFORM_COLUMNAR_MIN_ROWS", 1000)
+        # records per chunk of streamed transformations, memory grows with it instead of with the file size
+        self.transform_chunk_size = _get_int("TRANSFORM_CHUNK_SIZE", 10000)
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    return the process-wide settings object, env-vars are read only once
+    :return: Settings
+    """
+    return Settings()
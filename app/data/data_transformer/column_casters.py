@@ -0,0 +1,249 @@
+"""
+casting whole columns of raw values at once (pandas/numpy), with per-value fallback and error capture
+"""
+from __future__ import annotations
+
+import json
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from app.data.data_transformer.mapping_plan import (
+    ALLOWED_STRING_FORMATS,
+    TIMESTAMP_OUTPUT_FORMAT,
+    parse_timestamp_string,
+)
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+# (row index, exception) of the values that could not be cast
+CastErrors = List[Tuple[int, Exception]]
+
+# strptime formats parsed column-wise, in the order of convert_timestamp. Formats with %Z are left to the
+# per-value fallback, pandas handles time zone names differently than strptime.
+TIMESTAMP_COLUMN_FORMATS = [_format for _format in ALLOWED_STRING_FORMATS if "%Z" not in _format]
+# DATE strings are parsed with dateutil, which reads these formats the same way
+DATE_COLUMN_FORMATS = ["%Y-%m-%d", "%Y-%m-%d %H:%M:%S"]
+# strings of a column the format is inferred from
+DATETIME_SAMPLE_SIZE = 50
+
+
+def cast_rows(result: list, values: Sequence, rows: Sequence[int], cast: Callable) -> CastErrors:
+    """
+    cast the values of rows one by one into result, the values that fail are left None
+    :param result: list | cast values, changed in place
+    :param values: list | raw values
+    :param rows: row indices to cast
+    :param cast: callable | per-value caster
+    :return: list of (row index, exception)
+    """
+    errors = []
+    for row in rows:
+        try:
+            result[row] = cast(values[row])
+        except Exception as e:
+            errors.append((row, e))
+    return errors
+
+
+def _get_present_rows(values: Sequence) -> List[int]:
+    return [_row for _row, _value in enumerate(values) if _value is not None]
+
+
+def _cast_float_column(values: Sequence, cast: Callable, stats: dict) -> Tuple[list, CastErrors]:
+    import numpy as np
+
+    result = [None] * len(values)
+    numbers = [_row for _row, _value in enumerate(values) if type(_value) in (int, float)]
+    if numbers:
+        for row, number in zip(numbers, np.array([values[_row] for _row in numbers], dtype="float64").tolist()):
+            result[row] = number
+    # strings are read with float() itself, pandas does not round-trip all decimal strings
+    # (to_numeric("3.14159265358979323846") is not float("3.14159265358979323846"))
+    numbers = set(numbers)
+    return result, cast_rows(
+        result, values, [_row for _row in _get_present_rows(values) if _row not in numbers], cast
+    )
+
+
+def _cast_int_column(values: Sequence, cast: Callable, stats: dict) -> Tuple[list, CastErrors]:
+    import pandas as pd
+
+    result = [None] * len(values)
+    rows = _get_present_rows(values)
+    if not rows:
+        return result, []
+    numbers = pd.to_numeric(pd.Series([values[_row] for _row in rows], dtype=object), errors="coerce")
+    if numbers.dtype.kind not in "iu":
+        # floats, non-integer strings or values to_numeric does not read: int() decides per value,
+        # so that 1.9 is truncated and "1.9" fails as before
+        return result, cast_rows(result, values, rows, cast)
+    for row, number in zip(rows, numbers.tolist()):
+        result[row] = number
+    return result, []
+
+
+def _cast_each(values: Sequence, cast: Callable) -> Tuple[list, CastErrors]:
+    result = [None] * len(values)
+    return result, cast_rows(result, values, _get_present_rows(values), cast)
+
+
+def _cast_bool_column(values: Sequence, cast: Callable, stats: dict) -> Tuple[list, CastErrors]:
+    # ints (and bools) are mapped to bools, everything else is kept as is
+    return [bool(_value) if isinstance(_value, int) else _value for _value in values], []
+
+
+def _is_utc_process() -> bool:
+    # epoch values are cast to local time (datetime.fromtimestamp), pandas only does that for UTC
+    return time.timezone == 0 and not time.daylight
+
+
+def infer_datetime_format(strings: Sequence[str], formats: Sequence[str]) -> Optional[str]:
+    """
+    the format most values of a sample of strings (spread over the column) are in
+    :param strings: list of str
+    :param formats: strptime formats to choose from, on a tie the earlier one
+    :return: str | None if no value of the sample is in any of formats
+    """
+    sample = strings[:: max(1, len(strings) // DATETIME_SAMPLE_SIZE)][:DATETIME_SAMPLE_SIZE]
+    counts = Counter(parse_timestamp_string(_string, list(formats))[1] for _string in sample)
+    counts.pop(None, None)
+    return max(counts, key=lambda _format: (counts[_format], -formats.index(_format))) if counts else None
+
+
+def _parse_datetime_column(strings: Sequence[str], _format: str):
+    """
+    parse strings with _format, values that are not exactly in _format are NaT
+    pandas reads ISO formats leniently (e.g. "%Y-%m-%d" also reads "2020-01-01T10:00:00+02:00", tz-aware), so a
+    value only counts as matched if it is naive and formatting it with _format gives the string back
+    :return: pandas.Series of datetime64
+    """
+    import numpy as np
+    import pandas as pd
+
+    raw = pd.Series(strings, dtype=object)
+    parsed = pd.to_datetime(raw, format=_format, exact=True, utc=False, errors="coerce")
+    if not pd.api.types.is_datetime64_dtype(parsed):
+        # tz-aware values, the column is object or tz-aware dtype then
+        naive = np.fromiter(
+            (isinstance(_value, datetime) and _value.tzinfo is None for _value in parsed),
+            dtype=bool,
+            count=len(parsed),
+        )
+        parsed = pd.to_datetime(parsed.where(naive, None), errors="coerce")
+    return parsed.where(parsed.dt.strftime(_format) == raw)
+
+
+def parse_datetime_strings(
+    values: Sequence, rows: List[int], formats: Sequence[str], output_format: str, result: list
+) -> Tuple[List[int], List[str]]:
+    """
+    parse the string values of rows column-wise into result: the format of the column is inferred from a sample
+    and all values are parsed with it at once. If values are left, the format of the rest is inferred the same way.
+    :return: tuple | (rows not in any inferred format, the inferred formats)
+    """
+    formats, inferred = list(formats), []
+    while rows and formats and (_format := infer_datetime_format([values[_row] for _row in rows], formats)):
+        formats.remove(_format)
+        inferred.append(_format)
+        parsed = _parse_datetime_column([values[_row] for _row in rows], _format)
+        matched = parsed.notna().to_numpy()
+        for row, formatted in zip(
+            (_row for _row, _matched in zip(rows, matched) if _matched),
+            parsed[matched].dt.strftime(output_format).tolist(),
+        ):
+            result[row] = formatted
+        rows = [_row for _row, _matched in zip(rows, matched) if not _matched]
+    return rows, inferred
+
+
+def _cast_epoch_ms(values: Sequence, rows: List[int], output_format: str, result: list) -> List[int]:
+    """
+    format the epoch (ms) values of rows column-wise into result
+    :return: list | rows pandas reads as NaT (-2**63 is its NaT sentinel), left to the per-value fallback
+    """
+    import pandas as pd
+
+    formatted = pd.to_datetime(pd.Series([values[_row] for _row in rows], dtype="int64"), unit="ms")
+    formatted = formatted.dt.strftime(output_format)
+    not_a_time = formatted.isna().tolist()
+    for row, value, _not_a_time in zip(rows, formatted.tolist(), not_a_time):
+        if not _not_a_time:
+            result[row] = value
+    return [_row for _row, _not_a_time in zip(rows, not_a_time) if _not_a_time]
+
+
+def _get_datetime_column_caster(formats: Sequence[str], output_format: str) -> Callable:
+    def _cast_datetime_column(values: Sequence, cast: Callable, stats: dict) -> Tuple[list, CastErrors]:
+        result = [None] * len(values)
+        strings = [_row for _row, _value in enumerate(values) if isinstance(_value, str)]
+        epochs = [
+            _row for _row, _value in enumerate(values)
+            if isinstance(_value, int) and not isinstance(_value, bool)
+        ] if _is_utc_process() else []
+        undecided, stats["formats"] = parse_datetime_strings(values, strings, formats, output_format, result)
+        if epochs:
+            try:
+                undecided.extend(_cast_epoch_ms(values, epochs, output_format, result))
+            except (OverflowError, ValueError):
+                # out of the range of pandas timestamps, left to the per-value fallback
+                undecided.extend(epochs)
+        decided = set(strings).union(epochs).difference(undecided)
+        outliers = [_row for _row in _get_present_rows(values) if _row not in decided]
+        stats["outliers"] = len(outliers)
+        return result, cast_rows(result, values, outliers, cast)
+
+    return _cast_datetime_column
+
+
+def _cast_json_column(values: Sequence, cast: Callable, stats: dict) -> Tuple[list, CastErrors]:
+    try:
+        return [None if _value is None else json.dumps(_value) for _value in values], []
+    except (TypeError, ValueError):
+        return _cast_each(values, cast)
+
+
+def _cast_default_column(values: Sequence, cast: Callable, stats: dict) -> Tuple[list, CastErrors]:
+    try:
+        return [
+            None if _value is None else json.dumps(_value) if isinstance(_value, dict) else str(_value)
+            for _value in values
+        ], []
+    except (TypeError, ValueError):
+        return _cast_each(values, cast)
+
+
+COLUMN_CASTERS = {
+    "BOOL": _cast_bool_column,
+    "DATE": _get_datetime_column_caster(DATE_COLUMN_FORMATS, "%Y-%m-%d"),
+    "FLOAT64": _cast_float_column,
+    "INT64": _cast_int_column,
+    "JSON": _cast_json_column,
+    "TIMESTAMP": _get_datetime_column_caster(TIMESTAMP_COLUMN_FORMATS, TIMESTAMP_OUTPUT_FORMAT),
+}
+
+
+def cast_column(
+    values: Sequence, data_type: Optional[str], cast: Callable, stats: dict = None
+) -> Tuple[list, CastErrors]:
+    """
+    cast all values of a column to data_type, the result is the same as casting each value with cast
+    :param values: list | raw values of the column, None for missing values
+    :param data_type: str | GBQ data-type of the column, None if the mapping has none
+    :param cast: callable | per-value caster of data_type, used for the values the column-wise cast cannot decide
+    :param stats: dict | filled with details of the cast, for TIMESTAMP and DATE columns the inferred formats
+                  and the number of outliers (values cast one by one)
+    :return: tuple | (cast values, [(row index, exception)]), values that cannot be cast are None
+    """
+    stats = {} if stats is None else stats
+    try:
+        return COLUMN_CASTERS.get(data_type, _cast_default_column)(values, cast, stats)
+    except Exception as e:
+        # values pandas cannot handle must not cost the whole transformation, the column is cast value by value
+        log.warning(f"Casting column-wise to {data_type} failed, casting each value: {e}")
+        metrics.incr("transformer.column_cast_fallbacks")
+        stats.clear()
+        return _cast_each(values, cast)
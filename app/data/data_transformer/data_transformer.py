@@ -4,14 +4,17 @@ uses calls to ProcessedData class
 """
 from __future__ import annotations
 
-from typing import Dict, List, Union
+from itertools import islice
+from typing import Dict, Iterator, List, Union
 
 import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 
+from app.config.settings import get_settings
 from app.data.data_transformer.transformed_data import TransformedData
 from app.utils.file_utils import get_data_from_json_file
+from app.utils.json_stream_utils import iter_json_records
 from app.utils.logging_utils import get_logger
 
 
@@ -81,20 +84,78 @@ class DataTransformer:
         cleaned_data = _transformed_data.get_cleaned_data(raw_json_data=raw_json_obj)
         if not self.schema:
             self.schema = _transformed_data.schema
-        structured_data_df = pd.json_normalize(cleaned_data)
-        structured_data_df.replace("None", np.NaN, inplace=True)
-        self._test_cleaned_data(
-            raw_df=pd.DataFrame(raw_json_obj),
-            structured_data_df=structured_data_df,
+        raw_count = len(
+            _transformed_data.get_raw_data_envelope(raw_json_obj=raw_json_obj, mapping=_transformed_data.key_map)
+            or []
         )
+        # the records are in the data-frame now, the other copies are not needed any more
+        _transformed_data.raw_data_list = []
+        structured_data_df = self._get_structured_data_df(cleaned_data)
+        del cleaned_data
+        self._test_cleaned_data(raw_count, structured_data_df.shape[0])
         return structured_data_df.to_dict(orient="records")
 
-    def _test_cleaned_data(self, raw_df, structured_data_df):
-        raw_df_len = raw_df.shape[0]
-        struct_df_len = structured_data_df.shape[0]
-        if raw_df_len != struct_df_len:
+    def iter_transformed_data(
+        self,
+        config_mapping_key: str,
+        raw_json_obj: Union[Dict, List[Dict]] = None,
+        file_path: str = None,
+        schema: dict = None,
+        chunk_size: int = None,
+    ) -> Iterator[list]:
+        """
+        processed/cleaned data in chunks of chunk_size records, same records as get_transformed_data
+        a file is read incrementally down to the data envelope of the mapping, so that memory depends on
+        chunk_size and not on the size of the file. Custom function values are computed once for all chunks,
+        mappings with ${getAllData} (all records in one value) cannot be streamed.
+        :param config_mapping_key: str | key of the mapping used for processing incoming data
+        :param raw_json_obj: raw data, used instead of file_path if given
+        :param file_path: str | path of a json file
+        :param schema: dict
+        :param chunk_size: int | records of the data envelope per chunk, defaults to the transform_chunk_size setting
+        :return: iterator of lists of records
+        :raises ValueError: if the mapping uses ${getAllData}
+        """
+        chunk_size = chunk_size or get_settings().transform_chunk_size
+        _transformed_data = TransformedData(
+            schema=schema, mapping_key=config_mapping_key, **self.kwargs
+        )
+        if _transformed_data.needs_all_records():
+            raise ValueError(
+                f"Mapping {config_mapping_key} uses getAllData, which needs all records at once."
+                f" Use get_transformed_data instead."
+            )
+        if raw_json_obj:
+            raw_records = _transformed_data.get_raw_data_envelope(
+                raw_json_obj=raw_json_obj, mapping=_transformed_data.key_map
+            )
+        else:
+            raw_records = iter_json_records(file_path, _transformed_data.get_data_envelope_keys())
+        raw_records = iter(raw_records or [])
+        raw_count = processed_count = 0
+        while chunk := list(islice(raw_records, chunk_size)):
+            raw_count += len(chunk)
+            cleaned_data = _transformed_data.get_cleaned_chunk(chunk)
+            _transformed_data.raw_data_list = []
+            del chunk
+            structured_data_df = self._get_structured_data_df(cleaned_data)
+            del cleaned_data
+            processed_count += structured_data_df.shape[0]
+            if not self.schema:
+                self.schema = _transformed_data.schema
+            yield structured_data_df.to_dict(orient="records")
+        self._test_cleaned_data(raw_count, processed_count)
+
+    @staticmethod
+    def _get_structured_data_df(cleaned_data: list):
+        structured_data_df = pd.json_normalize(cleaned_data)
+        structured_data_df.replace("None", np.NaN, inplace=True)
+        return structured_data_df
+
+    def _test_cleaned_data(self, raw_count: int, processed_count: int):
+        if raw_count != processed_count:
             self.log.info(
                 f"The lengths of raw-data and processed data are unequal."
-                f" Raw-data has {raw_df_len} records, processed-data has {struct_df_len} records."
+                f" Raw-data has {raw_count} records, processed-data has {processed_count} records."
                 f" If this is expected, you can ignore this message."
             )
@@ -0,0 +1,285 @@
+"""
+schema mappings compiled into execution plans: prebuilt accessors and type casters per db column
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dateutil.parser import parse
+
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+TIMESTAMP_OUTPUT_FORMAT = "%Y-%m-%dT%H:%M:%S+00:00"
+ALLOWED_STRING_FORMATS = [
+    "%Y %m %d %H %M %S %f",
+    "%Y %m %d %H %M %S",
+    "%Y-%m-%d %H:%M:%S %Z",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d",
+]
+
+
+def parse_timestamp_string(date_timestamp: str, formats: List[str] = None) -> Tuple[Optional[datetime], Optional[str]]:
+    """
+    :param date_timestamp: str
+    :param formats: list of str | strptime formats tried in turn, defaults to ALLOWED_STRING_FORMATS
+    :return: tuple | (datetime, the format that matched), (None, None) if none did
+    """
+    for _format in ALLOWED_STRING_FORMATS if formats is None else formats:
+        with contextlib.suppress(ValueError):
+            return datetime.strptime(date_timestamp, _format), _format
+    return None, None
+
+
+def convert_timestamp(date_timestamp, output_format: str = TIMESTAMP_OUTPUT_FORMAT) -> str:
+    """
+    timestamp as string in output_format
+    :param date_timestamp: str | in one of the allowed formats, or anything dateutil can parse
+                           int | unix epoch in ms
+    :param output_format: str
+    :return: str
+    """
+    if isinstance(date_timestamp, str):
+
+        d, _ = parse_timestamp_string(date_timestamp)
+        if d is not None:
+            return d.strftime(output_format)
+        with contextlib.suppress(ValueError):
+            return parse(date_timestamp).strftime(output_format)
+    try:
+        # unix epoch timestamp
+        epoch = date_timestamp / 1000
+        return datetime.fromtimestamp(epoch).strftime(output_format)
+    except ValueError as e:
+        raise ValueError("The timestamp did not match any of the allowed formats") from e
+
+
+def get_timestamp_caster(output_format: str = TIMESTAMP_OUTPUT_FORMAT) -> Callable:
+    """
+    convert_timestamp for the values of one column: the format of the last string is tried first,
+    the values of a column mostly share one format. The allowed formats do not overlap, so the result is the same.
+    :param output_format: str
+    :return: callable
+    """
+    last_format = None
+
+    def _convert(date_timestamp) -> str:
+        nonlocal last_format
+        if isinstance(date_timestamp, str):
+            if last_format is not None:
+                with contextlib.suppress(ValueError):
+                    return datetime.strptime(date_timestamp, last_format).strftime(output_format)
+            d, _format = parse_timestamp_string(date_timestamp)
+            if d is not None:
+                last_format = _format
+                return d.strftime(output_format)
+        return convert_timestamp(date_timestamp, output_format)
+
+    return _convert
+
+
+def _cast_bool(value):
+    return bool(value) if isinstance(value, int) else value
+
+
+def _cast_date(value) -> str:
+    return (
+        datetime.fromtimestamp(value / 1e3).strftime("%Y-%m-%d")
+        if isinstance(value, int)
+        else parse(value).strftime("%Y-%m-%d")
+    )
+
+
+def _cast_default(value) -> str:
+    return json.dumps(value) if isinstance(value, dict) else str(value)
+
+
+CASTERS: Dict[Optional[str], Callable] = {
+    "BOOL": _cast_bool,
+    "DATE": _cast_date,
+    "FLOAT64": float,
+    "INT64": int,
+    "JSON": json.dumps,
+    "TIMESTAMP": convert_timestamp,
+}
+
+
+def get_caster(data_type: Optional[str]) -> Callable:
+    """
+    caster for data_type, None is passed through by all casters
+    :param data_type: str | GBQ data-type of the mapping, e.g. INT64, None if the mapping has none
+    :return: callable
+    """
+    cast = get_timestamp_caster() if data_type == "TIMESTAMP" else CASTERS.get(data_type, _cast_default)
+
+    def _cast(value):
+        return None if value is None else cast(value)
+
+    return _cast
+
+
+def get_accessor(path: Tuple[str, ...]) -> Callable[[dict], object]:
+    """
+    accessor of the value at path in a raw json object, None if there is none
+    :param path: tuple of str | keys from the outermost
+    :return: callable
+    """
+    if len(path) == 1:
+        key = path[0]
+        return lambda _obj: _obj.get(key)
+
+    def _get(obj):
+        try:
+            for _key in path:
+                obj = obj[_key]
+            return obj
+        except (TypeError, KeyError):
+            return None
+
+    return _get
+
+
+class ColumnPlan:
+    """
+    how to get the value of one db column from a raw json object
+    columns mapped to a custom function (${getDate}) have no accessor, their value is the same for all records
+    """
+
+    __slots__ = ("name", "source_key", "path", "data_type", "custom_function", "get_value", "cast")
+
+    def __init__(self, name: str, mapping_value: str, split_json_by_dot: bool):
+        self.name = name
+        if "${" in mapping_value:
+            self.custom_function = mapping_value
+            self.source_key = self.path = self.data_type = self.get_value = self.cast = None
+            return
+        self.custom_function = None
+        self.source_key, _, data_type = mapping_value.partition(":")
+        self.data_type = data_type or None
+        self.path = tuple(self.source_key.split(".")) if split_json_by_dot else (self.source_key,)
+        self.get_value = get_accessor(self.path)
+        self.cast = get_caster(self.data_type)
+
+
+class MappingPlan:
+    """
+    a schema mapping {db column: "json.key:TYPE" or "${customFunction}"} compiled once, applied to every record
+    """
+
+    def __init__(self, schema: Dict[str, str], split_json_by_dot: bool):
+        self.columns: List[ColumnPlan] = [
+            ColumnPlan(_name, _value, split_json_by_dot) for _name, _value in schema.items()
+        ]
+        self.custom_columns = [_column for _column in self.columns if _column.custom_function]
+
+    def get_custom_values(
+        self, get_custom_function_value: Callable[[str], object], on_error: Callable[[str], None] = print
+    ) -> Dict[str, object]:
+        """
+        values of the custom function columns, computed once for all records of a transformation
+        :param get_custom_function_value: callable returning the value for a custom function mapping
+        :param on_error: callable receiving the error message
+        :return: dict | column name -> value, None if it could not be computed
+        """
+        custom_values = {}
+        for column in self.custom_columns:
+            try:
+                custom_values[column.name] = get_custom_function_value(column.custom_function)
+            except Exception as e:
+                on_error(f"Exception: {e}")
+                custom_values[column.name] = None
+        return custom_values
+
+    def apply(self, raw_obj: dict, custom_values: Dict[str, object], on_error: Callable[[str], None] = print) -> dict:
+        """
+        map raw_obj to {db column: value}, a value that cannot be cast is None (and reported to on_error)
+        :param raw_obj: dict | raw json object
+        :param custom_values: dict | from get_custom_values
+        :param on_error: callable receiving the error message
+        :return: dict
+        """
+        row = {}
+        for column in self.columns:
+            if column.custom_function:
+                row[column.name] = custom_values[column.name]
+                continue
+            try:
+                row[column.name] = column.cast(column.get_value(raw_obj))
+            except Exception as e:
+                on_error(f"Exception: {e}")
+                row[column.name] = None
+        return row
+
+    def apply_columnar(
+        self, raw_objs: List[dict], custom_values: Dict[str, object], on_error: Callable[[str], None] = print
+    ) -> List[dict]:
+        """
+        map all raw_objs at once: the values of each column are extracted into a list and cast in one
+        column-wise operation per data-type. The rows are the same as from apply, errors are reported per row.
+        :param raw_objs: list of dict | raw json objects
+        :param custom_values: dict | from get_custom_values
+        :param on_error: callable receiving the error message
+        :return: list of dict
+        """
+        from app.data.data_transformer.column_casters import cast_column
+
+        column_values = []
+        for column in self.columns:
+            if column.custom_function:
+                column_values.append([custom_values[column.name]] * len(raw_objs))
+                continue
+            values, errors = self._extract(column, raw_objs)
+            stats = {}
+            values, cast_errors = cast_column(values, column.data_type, column.cast, stats)
+            if stats.get("outliers"):
+                # values not in the inferred format(s) of the column are parsed one by one
+                metrics.incr("transformer.datetime_outliers", stats["outliers"])
+                log.info(
+                    f"Column {column.name}: {stats['outliers']} of {len(values)} values not in the inferred "
+                    f"format(s) {stats['formats']}"
+                )
+            for row, e in sorted(errors + cast_errors, key=lambda _error: _error[0]):
+                on_error(f"Exception: {e} (row {row}, column {column.name})")
+                values[row] = None
+            column_values.append(values)
+        names = [_column.name for _column in self.columns]
+        return [dict(zip(names, _row_values)) for _row_values in zip(*column_values)] if names else [
+            {} for _ in raw_objs
+        ]
+
+    @staticmethod
+    def _extract(column: ColumnPlan, raw_objs: List[dict]) -> Tuple[list, list]:
+        try:
+            return [column.get_value(_obj) for _obj in raw_objs], []
+        except Exception:
+            # e.g. a record that is not an object, only its value of the column is lost
+            values, errors = [], []
+            for row, raw_obj in enumerate(raw_objs):
+                try:
+                    values.append(column.get_value(raw_obj))
+                except Exception as e:
+                    values.append(None)
+                    errors.append((row, e))
+            return values, errors
+
+
+@lru_cache(maxsize=256)
+def _compile(schema_items: Tuple[Tuple[str, str], ...], split_json_by_dot: bool) -> MappingPlan:
+    return MappingPlan(dict(schema_items), split_json_by_dot)
+
+
+def get_mapping_plan(schema: Dict[str, str], split_json_by_dot: bool) -> MappingPlan:
+    """
+    the compiled plan of schema, compiled only on the first call for a schema
+    :param schema: dict | {db column: mapping value}
+    :param split_json_by_dot: bool | whether dotted keys are paths into nested objects
+    :return: MappingPlan
+    """
+    return _compile(tuple(schema.items()), split_json_by_dot)
@@ -0,0 +1,164 @@
+"""
+process-wide registry of the mapping config (json_key_mapping.json), loaded once and reloaded only on change
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+from app.data.data_transformer.mapping_plan import MappingPlan
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+
+def validate_mapping(key: str, mapping) -> None:
+    """
+    :param key: str | key of mapping in the config file
+    :param mapping: the mapping of key
+    :raises ValueError: if mapping cannot be used by the transformer and schema builders
+    """
+    if not isinstance(mapping, dict):
+        raise ValueError(f"mapping {key} is not an object")
+    db_col_mapping = mapping.get("db_col_to_json_mapping")
+    if db_col_mapping is not None and not (
+        isinstance(db_col_mapping, dict)
+        and all(isinstance(_value, str) for _value in db_col_mapping.values())
+    ):
+        raise ValueError(f"db_col_to_json_mapping of mapping {key} is not an object of strings")
+    if not isinstance(mapping.get("json_data_config", {}), dict):
+        raise ValueError(f"json_data_config of mapping {key} is not an object")
+    if not isinstance(mapping.get("special_mapping", []), list):
+        raise ValueError(f"special_mapping of mapping {key} is not a list")
+
+
+class MappingEntry:
+    """
+    one mapping of the config with the artifacts derived from it: the compiled plan of its
+    db_col_to_json_mapping, its BigQuery schema and load-job configs (the latter two built on first use)
+    The config is shared by all users of the entry and must not be changed.
+    """
+
+    def __init__(self, key: str, config: dict):
+        self.key = key
+        self.config = config
+        self.db_col_mapping: Dict[str, str] = config.get("db_col_to_json_mapping") or {}
+        self.split_json_by_dot = config.get("split_json_by_dot") == "True"
+        self.plan = MappingPlan(self.db_col_mapping, self.split_json_by_dot)
+        self._schema_fields = None
+        self._load_job_configs = {}
+
+    @property
+    def schema_fields(self) -> list:
+        """
+        BigQuery schema of the mapping, the data-type of a column is the part of its mapping after the last colon
+        :return: list of bigquery.SchemaField
+        """
+        if self._schema_fields is None:
+            from google.cloud import bigquery
+
+            self._schema_fields = [
+                bigquery.SchemaField(_key, _val.split(":")[-1]) for _key, _val in self.db_col_mapping.items()
+            ]
+        return self._schema_fields
+
+    def get_load_job_config(self, source: str = None):
+        """
+        load-job config for tables with the schema of the mapping, a copy of a template built once per source
+        :param source: str | json/csv/df
+        :return: bigquery.LoadJobConfig | a copy, so that it can be changed (e.g. its write disposition)
+        """
+        from google.cloud import bigquery
+
+        if (template := self._load_job_configs.get(source)) is None:
+            if source == "json":
+                source_format = bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
+            elif source in {"df", "csv"}:
+                source_format = bigquery.SourceFormat.CSV
+            else:
+                source_format = None
+            template = self._load_job_configs[source] = bigquery.LoadJobConfig(
+                autodetect=False,
+                schema=self.schema_fields,
+                source_format=source_format,
+                allow_quoted_newlines=True,
+                allow_jagged_rows=True,
+            )
+        return bigquery.LoadJobConfig.from_api_repr(template.to_api_repr())
+
+
+class MappingRegistry:
+    """
+    the config file is read on first use. On later lookups it is only read again if its mtime or size changed,
+    and only parsed again if its content (hash) changed. Invalid mappings are reported and left out.
+    """
+
+    def __init__(self, file_path: str = None):
+        self._file_path = file_path
+        self._entries: Dict[str, MappingEntry] = {}
+        self._stat_signature = None
+        self._content_hash = None
+        self._lock = threading.Lock()
+
+    @property
+    def file_path(self) -> str:
+        if self._file_path is None:
+            from app.utils.file_utils import get_config_filepath
+
+            self._file_path = get_config_filepath("MAPPING_CONFIG_FILE")
+        return self._file_path
+
+    def get(self, key: str) -> Optional[MappingEntry]:
+        """
+        :param key: str | key of the mapping in the config file
+        :return: MappingEntry | None if there is no (valid) mapping for key
+        :raises FileNotFoundError: if there is no config file
+        """
+        self._reload_if_changed()
+        return self._entries.get(key)
+
+    def get_config(self, key: str) -> Optional[dict]:
+        """
+        :param key: str | key of the mapping in the config file
+        :return: dict | the mapping as in the config file, None if there is none
+        """
+        entry = self.get(key)
+        return entry.config if entry else None
+
+    def _reload_if_changed(self) -> None:
+        stat = os.stat(self.file_path)
+        stat_signature = (stat.st_mtime_ns, stat.st_size)
+        if stat_signature == self._stat_signature:
+            return
+        with self._lock:
+            if stat_signature == self._stat_signature:
+                return
+            with open(self.file_path, "rb") as fp:
+                content = fp.read()
+            content_hash = hashlib.sha1(content).hexdigest()
+            if content_hash != self._content_hash:
+                self._entries = self._get_entries(json.loads(content))
+                self._content_hash = content_hash
+                metrics.incr("mapping_registry.loads")
+            self._stat_signature = stat_signature
+
+    def _get_entries(self, json_data) -> Dict[str, MappingEntry]:
+        if not isinstance(json_data, dict):
+            raise ValueError(f"mapping config {self.file_path} is not an object")
+        entries = {}
+        for key, mapping in json_data.items():
+            try:
+                validate_mapping(key, mapping)
+            except ValueError as e:
+                metrics.incr("mapping_registry.invalid_mappings")
+                log.warning(f"Skipping invalid mapping: {e}")
+                continue
+            entries[key] = MappingEntry(key, mapping)
+        return entries
+
+
+mapping_registry = MappingRegistry()
@@ -4,19 +4,20 @@ class to handle transformation of data (for processing/transform-step) before up
 
 from __future__ import annotations
 
-import contextlib
-import json
 from datetime import datetime, timezone
 
 from dotenv import load_dotenv
 
-from app.utils.file_utils import (
-    get_config_filepath,
-    get_data_from_json_file,
-    get_filename_from_path,
+from app.config.settings import get_settings
+from app.data.data_transformer.mapping_plan import (
+    TIMESTAMP_OUTPUT_FORMAT,
+    convert_timestamp,
+    get_caster,
+    get_mapping_plan,
 )
+from app.data.data_transformer.mapping_registry import mapping_registry
+from app.utils.file_utils import get_filename_from_path
 from app.utils.logging_utils import get_logger
-from dateutil.parser import parse
 
 
 class TransformedData:
@@ -26,10 +27,15 @@ class TransformedData:
         self.account_id = kwargs.pop("account_id", None)
         self.file_path = kwargs.pop("file_name", None)
         self.table_name = kwargs.pop("table_name", None)
+        # None: columnar for transformations of at least transform_columnar_min_rows records
+        self.columnar = kwargs.pop("columnar", None)
         self.time_zone = timezone.utc
         self.schema = schema or {}
+        self.mapping_key = mapping_key
         self.key_map = self.get_key_map(mapping_key)
         self.raw_data_list = []
+        # values of the custom function columns, the same for all records (and chunks) of the transformation
+        self.custom_values = None
 
     @staticmethod
     def get_key_map(config_mapping_key: str) -> dict:
@@ -40,15 +46,12 @@ class TransformedData:
         """
         key_map = {}
         try:
-            if json_data := get_data_from_json_file(
-                get_config_filepath("MAPPING_CONFIG_FILE"),
-            ):
-
-                key_map = json_data.get(config_mapping_key)
-                if not key_map:
-                    print(
-                        f"Key: {config_mapping_key} not available in 'json_key_mapping.json' file."
-                    )
+            # the config file is only read again once it changed
+            key_map = mapping_registry.get_config(config_mapping_key)
+            if not key_map:
+                print(
+                    f"Key: {config_mapping_key} not available in 'json_key_mapping.json' file."
+                )
 
         except Exception as e:
             print(f"get_key_mapping Exception Occurred: {e}")
@@ -89,32 +92,88 @@ class TransformedData:
                     "Key: 'no schema found for mapping raw data. Add on json-config-mapping file"
                 )
 
-            for raw_obj in self.raw_data_list:
-                tmp = {
-                    map_k: self.get_value_for_db_col(
-                        raw_data_obj=raw_obj,
-                        mapping_value=map_v,  # file_name=file_name
-                    )
-                    for map_k, map_v in self.schema.items()
-                }
-
-                result.append(tmp)
+            # mapping strings are parsed once per schema, not per record and column
+            entry = mapping_registry.get(self.mapping_key) if self.mapping_key else None
+            if entry is not None and list(self.schema.items()) == list(entry.db_col_mapping.items()):
+                plan = entry.plan
+            else:
+                plan = get_mapping_plan(
+                    self.schema, split_json_by_dot=self.key_map.get("split_json_by_dot") == "True"
+                )
+            if self.custom_values is None:
+                self.custom_values = plan.get_custom_values(self.get_custom_function_value, on_error=self.log.error)
+            custom_values = self.custom_values
+            if self.is_columnar(len(self.raw_data_list)):
+                result = plan.apply_columnar(self.raw_data_list, custom_values, on_error=self.log.error)
+            else:
+                result = [
+                    plan.apply(raw_obj, custom_values, on_error=self.log.error)
+                    for raw_obj in self.raw_data_list
+                ]
         except Exception as e:
             self.log.error(f"Exception: {e}")
         return result
 
+    def get_cleaned_chunk(self, raw_records: list) -> list:
+        """
+        clean a chunk of the records of the data envelope, for transformations in chunks
+        custom function values are computed for the first chunk and kept for the others, see needs_all_records
+        :param raw_records: list | records of the data envelope
+        :return: list
+        """
+        self.raw_data_list = self.get_unique_objects(raw_records)
+        if self.key_map:
+            return self.map_raw_data_to_db_col()
+        return self.raw_data_list
+
+    def needs_all_records(self) -> bool:
+        """
+        whether a column is mapped to ${getAllData}, whose value depends on all records of the transformation
+        so that they cannot be transformed in chunks
+        :return: bool
+        """
+        db_col_mapping = (self.key_map or {}).get("db_col_to_json_mapping") or {}
+        return any("getAllData" in _value for _value in [*self.schema.values(), *db_col_mapping.values()])
+
+    def get_data_envelope_keys(self) -> list:
+        """
+        :return: list of str | keys from the outermost object to the data envelope, empty if there is none
+        """
+        data_envelope = ((self.key_map or {}).get("json_data_config") or {}).get("data_envelope")
+        if not data_envelope:
+            return []
+        return data_envelope if isinstance(data_envelope, list) else [data_envelope]
+
+    def is_columnar(self, n_records: int) -> bool:
+        """
+        whether the records are cast column-wise, for few records the per-value casts are faster
+        :param n_records: int
+        :return: bool
+        """
+        if self.columnar is not None:
+            return self.columnar
+        return n_records >= get_settings().transform_columnar_min_rows
+
     def generate_unique_raw_objects(self, raw_json_obj: dict) -> list:
         """
         apply mapping-config and extract list of dicts containing info to be uploaded
         :param raw_json_obj: dict
         :return: list
         """
+        raw_data_envelope = self.get_raw_data_envelope(
+            raw_json_obj=raw_json_obj, mapping=self.key_map
+        )
+        return self.get_unique_objects(raw_data_envelope)
+
+    def get_unique_objects(self, raw_data_envelope: list) -> list:
+        """
+        split the records of the data envelope as per special mapping keys
+        :param raw_data_envelope: list | records of the data envelope, or a chunk of them
+        :return: list
+        """
         unique_objects = []
         # self.log.info("Creating unique records as per Special Mapping Keys")
         mapping = self.key_map
-        raw_data_envelope = self.get_raw_data_envelope(
-            raw_json_obj=raw_json_obj, mapping=mapping
-        )
         try:
             if len(mapping["special_mapping"]) > 0:
                 for data_obj in raw_data_envelope:
@@ -259,34 +318,7 @@ class TransformedData:
         :param data_type: str | data-type to which value is to be casted
         :return:
         """
-        if value is None:
-            return None
-
-        if data_type == "BOOL":
-            return (
-                bool(value)
-                if isinstance(value, int)
-                else value
-                if isinstance(value, bool)
-                else value
-            )
-        elif data_type == "DATE":
-            return (
-                datetime.fromtimestamp(value / 1e3).strftime("%Y-%m-%d")
-                if isinstance(value, int)
-                else parse(value).strftime("%Y-%m-%d")
-            )
-
-        elif data_type == "FLOAT64":
-            return float(value)
-        elif data_type == "INT64":
-            return int(value)
-        elif data_type == "JSON":
-            return json.dumps(value)
-        elif data_type == "TIMESTAMP":
-            return self.convert_timestamp(date_timestamp=value)
-        else:
-            return json.dumps(value) if isinstance(value, dict) else str(value)
+        return get_caster(data_type)(value)
 
     #
     # @staticmethod
@@ -306,28 +338,8 @@ class TransformedData:
     #     return _timestamp
 
     @staticmethod
-    def convert_timestamp(date_timestamp, output_format="%Y-%m-%dT%H:%M:%S+00:00"):
-        ALLOWED_STRING_FORMATS = [
-            "%Y %m %d %H %M %S %f",
-            "%Y %m %d %H %M %S",
-            "%Y-%m-%d %H:%M:%S %Z",
-            "%Y-%m-%d %H:%M:%S",
-            "%Y-%m-%d",
-        ]
-        if isinstance(date_timestamp, str):
-
-            for _format in ALLOWED_STRING_FORMATS:
-                with contextlib.suppress(ValueError):
-                    d = datetime.strptime(date_timestamp, _format)
-                    return d.strftime(output_format)
-            with contextlib.suppress(ValueError):
-                return parse(date_timestamp).strftime(output_format)
-        try:
-            # unix epoch timestamp
-            epoch = date_timestamp / 1000
-            return datetime.fromtimestamp(epoch).strftime(output_format)
-        except ValueError as e:
-            raise ValueError("The timestamp did not match any of the allowed formats") from e
+    def convert_timestamp(date_timestamp, output_format=TIMESTAMP_OUTPUT_FORMAT):
+        return convert_timestamp(date_timestamp, output_format=output_format)
 
     def get_custom_function_value(self, func_name) -> str:
         """
@@ -1,11 +1,32 @@
 """
 main code for FastAPI setup
 """
-import uvicorn
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+import asyncio
+import json
+import os
+
+from fastapi import FastAPI, Header, HTTPException, Request, Response, WebSocket
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from app.api import Api
-from app.models.models import AppDetails
+from app.base.answer_store import answer_store
+from app.base.catalog import get_catalog_index
+from app.base.chat_analytics import analytics_sink
+from app.base.chat_batch import ChatBatch
+from app.base.chat_response import get_openai
+from app.base.chat_websocket import serve_chat_websocket
+from app.base.conversation_store import conversation_store
+from app.base.deadline import Deadline, DeadlineExceeded
+from app.base.process_user_message import aprocess_conversation_turn, aprocess_user_message
+from app.config.settings import get_settings
+from app.models.models import AppDetails, ChatBatchRequest, ChatRequest, ChatResponse
+from app.utils.admission_control import AdmissionController, AdmissionRejected
+from app.utils.cassette import REPLAY, cassette
+from app.utils.disconnect_utils import ClientDisconnected, run_until_disconnected
+from app.utils.lifecycle import Lifecycle
+from app.utils.memory_diagnostics import MemoryDiagnostics, MemoryDiagnosticsMiddleware
+from app.utils.metrics_utils import metrics
+from app.utils.request_profiler import RequestProfiler, RequestProfilerMiddleware
+from app.utils.task_queue import background_tasks
 
 description = """
 API for serving as a chatbot for product verfication🚀
@@ -16,6 +37,10 @@ tags_metadata = [
         "name": "default",
         "description": "endpoints for details of app",
     },
+    {
+        "name": "chat",
+        "description": "endpoints for chatting with the bot",
+    },
 ]
 
 app = FastAPI(
@@ -24,6 +49,62 @@ app = FastAPI(
     version="0.1",
     docs_url="/docs",
 )
+admission_controller = AdmissionController.from_settings()
+request_profiler = RequestProfiler.from_settings()
+if get_settings().profiler_enabled:
+    # not installed at all otherwise, so that requests do not pay for it
+    app.add_middleware(RequestProfilerMiddleware, profiler=request_profiler)
+memory_diagnostics = MemoryDiagnostics.from_settings()
+if get_settings().memory_diagnostics_enabled:
+    app.add_middleware(MemoryDiagnosticsMiddleware, diagnostics=memory_diagnostics)
+lifecycle = Lifecycle(warmup_timeout_s=get_settings().warmup_timeout_s)
+
+
+async def _warmup_catalog():
+    catalog = await asyncio.to_thread(get_catalog_index)
+    # on the event loop, as lookups of requests served meanwhile may refresh the answer store as well
+    answer_store.refresh(catalog)
+
+
+lifecycle.add_warmup_step("catalog", _warmup_catalog)
+# replayed calls never reach openai, which needs OPENAI_API_KEY
+if cassette.mode != REPLAY:
+    lifecycle.add_warmup_step("openai", get_openai)
+lifecycle.add_warmup_step("cassette", cassette.load)
+# analytics are best effort, a worker without a BigQuery connection can still serve chats
+lifecycle.add_warmup_step("analytics_table", analytics_sink.warmup, required=False)
+
+
+@app.on_event("startup")
+async def start_warmup():
+    # in the background, so that /health is served right away and /ready tells when the warmup is done
+    lifecycle.start_warmup()
+    if get_settings().memory_diagnostics_enabled:
+        memory_diagnostics.start()
+
+
+@app.on_event("shutdown")
+async def drain_background_work():
+    settings = get_settings()
+    await lifecycle.drain(
+        get_in_flight=lambda: admission_controller.in_flight + admission_controller.queue_depth,
+        timeout=settings.shutdown_drain_timeout_s,
+    )
+    await background_tasks.drain(timeout=settings.background_drain_timeout_s)
+    # rows of the turns finished while draining are in the buffer now
+    await analytics_sink.close(timeout=settings.background_drain_timeout_s)
+    cassette.close()
+    if memory_diagnostics.tracing:
+        await memory_diagnostics.stop()
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc), "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 @app.get(
@@ -36,10 +117,156 @@ def root():
     }
 
 
+@app.get("/health", tags=["default"])
+def health():
+    """
+    liveness of the worker, does not depend on the warmup or any upstream service
+    """
+    return {"status": "ok"}
+
+
+@app.get("/ready", tags=["default"])
+def ready():
+    """
+    readiness of the worker: 503 until the warmup is done and again while draining on shutdown
+    to be used as startup probe, so that no request is routed to a worker that is still warming up
+    """
+    return JSONResponse(status_code=200 if lifecycle.ready else 503, content=lifecycle.get_status())
+
+
 @app.get("/appinfo/", tags=["default"])
 def get_app_info() -> AppDetails:
     return AppDetails(**Api().get_app_details())
 
 
+@app.get("/metrics/", tags=["default"])
+def get_metrics() -> dict:
+    return metrics.snapshot()
+
+
+@app.get("/profiles/", tags=["default"])
+def list_profiles() -> list:
+    """
+    the most recent request profiles, newest first
+    """
+    return request_profiler.list_recent()
+
+
+@app.get("/profiles/{profile_id}", tags=["default"])
+def get_profile(profile_id: str):
+    """
+    the folded stacks of a profile, e.g. for flamegraph.pl or speedscope
+    """
+    file_path = request_profiler.get_file_path(profile_id)
+    if file_path is None or not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail=f"No profile {profile_id}")
+    return FileResponse(file_path, media_type="text/plain", filename=os.path.basename(file_path))
+
+
+@app.get("/diagnostics/memory", tags=["default"])
+async def get_memory_diagnostics(snapshot: bool = False) -> dict:
+    """
+    top allocation sites and their growth between snapshots, peak allocations of sampled requests
+    with snapshot=true a snapshot is taken right away instead of reporting the last periodic one
+    """
+    if snapshot:
+        if not memory_diagnostics.tracing:
+            raise HTTPException(status_code=409, detail="Memory diagnostics are not enabled")
+        await memory_diagnostics.take_snapshot()
+    return memory_diagnostics.get_report()
+
+
+@app.post("/chat/", tags=["chat"])
+async def chat(chat_request: ChatRequest, request: Request, x_tenant_id: str = Header("default")):
+    async with admission_controller.admit(tenant=x_tenant_id, session_id=chat_request.session_id):
+        return await _chat(chat_request, request)
+
+
+async def _chat(chat_request: ChatRequest, request: Request):
+    deadline = Deadline(chat_request.deadline_ms or get_settings().chat_deadline_ms)
+    if chat_request.session_id:
+        turn = aprocess_conversation_turn(
+            conversation_store.get(chat_request.session_id), chat_request.message, deadline=deadline
+        )
+    else:
+        turn = aprocess_user_message(chat_request.message, chat_request.messages, debug=False, deadline=deadline)
+    try:
+        response, messages = await run_until_disconnected(request, turn)
+    except ClientDisconnected:
+        # nobody is listening anymore, 499 only shows up in the access logs
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        raise HTTPException(
+            status_code=504,
+            detail={"message": str(e), "degradations": deadline.degradations},
+        ) from e
+    return ChatResponse(response=response, messages=messages, degradations=deadline.degradations)
+
+
+@app.post("/chat/batch", tags=["chat"])
+async def chat_batch(batch_request: ChatBatchRequest, x_tenant_id: str = Header("default")):
+    """
+    process all messages of the batch, results are streamed back as newline-delimited json in order of completion
+    each result line carries the index of its message in the request
+    the batch is admitted as one request, its slot is held until the last result is streamed
+    """
+    await admission_controller.acquire(tenant=x_tenant_id)
+    released = False
+
+    def _release():
+        nonlocal released
+        if not released:
+            released = True
+            admission_controller.release(tenant=x_tenant_id)
+
+    try:
+        batch = ChatBatch(
+            items=[_item.dict() for _item in batch_request.messages],
+            concurrency=batch_request.concurrency,
+            deadline_ms=batch_request.deadline_ms,
+        )
+    except Exception:
+        _release()
+        raise
+
+    async def _ndjson_lines():
+        try:
+            async for result in batch.run():
+                yield json.dumps(result) + "\n"
+        finally:
+            _release()
+
+    return _StreamingResponseWithCleanup(_ndjson_lines(), cleanup=_release, media_type="application/x-ndjson")
+
+
+class _StreamingResponseWithCleanup(StreamingResponse):
+    """
+    calls cleanup once the response is done, also if the stream was never started (the client went away before)
+    or failed
+    """
+
+    def __init__(self, content, cleanup, **kwargs):
+        super().__init__(content, **kwargs)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.cleanup()
+
+
+@app.websocket("/ws/chat/{session_id}")
+async def chat_websocket(websocket: WebSocket, session_id: str):
+    await serve_chat_websocket(
+        websocket,
+        session_id=session_id,
+        tenant=websocket.headers.get("x-tenant-id", "default"),
+        admission_controller=admission_controller,
+    )
+
+
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run("app.main:app", port=8080, reload=True, debug=True, workers=3)
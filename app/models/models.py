@@ -1,5 +1,7 @@
-from pydantic import BaseModel
-from typing import Union, List
+from pydantic import BaseModel, conint, conlist
+from typing import Union, List, Optional
+
+from app.config.settings import get_settings
 
 
 class AppDetails(BaseModel):
@@ -9,6 +11,37 @@ class AppDetails(BaseModel):
     author: str
 
 
+class ChatRequest(BaseModel):
+    message: str
+    messages: List[dict] = []
+    session_id: Optional[str] = None
+    deadline_ms: Optional[int] = None
+
+
+class ChatFrame(BaseModel):
+    message: str
+    deadline_ms: Optional[int] = None
+
+
+class ChatResponse(BaseModel):
+    response: str
+    messages: List[dict] = []
+    degradations: List[str] = []
+
+
+class ChatBatchItem(BaseModel):
+    message: str
+    session_id: Optional[str] = None
+    id: Optional[str] = None
+
+
+class ChatBatchRequest(BaseModel):
+    # bounded, as all turns of a batch share the admission slot of one request
+    messages: conlist(ChatBatchItem, max_items=get_settings().chat_batch_max_turns)
+    concurrency: Optional[conint(ge=1)] = None
+    deadline_ms: Optional[int] = None
+
+
 class GbqTableDetails:
     def __init__(self, table_id: str):
         table_id = table_id.replace("`", "")
@@ -0,0 +1,156 @@
+"""
+admission control for chat turns: bounded concurrency and queue per worker, per-tenant and per-session limits
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import time
+from collections import defaultdict, deque
+
+from app.config.settings import get_settings
+from app.utils.metrics_utils import metrics
+
+
+class AdmissionRejected(Exception):
+    """
+    the request was not admitted, it should be retried after retry_after seconds
+    """
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(f"Request rejected: {reason}")
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    at most max_in_flight turns run at the same time, up to max_queue more wait (FIFO) for at most queue_timeout_ms.
+    Requests beyond that are rejected right away (503), as are requests of a tenant/session that already has
+    max_per_tenant/max_per_session requests running or waiting (429).
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queue: int,
+        queue_timeout_ms: int,
+        max_per_tenant: int,
+        max_per_session: int,
+        retry_after: int,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout_ms = queue_timeout_ms
+        self.max_per_tenant = max_per_tenant
+        self.max_per_session = max_per_session
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._waiters = deque()
+        self._per_tenant = defaultdict(int)
+        self._per_session = defaultdict(int)
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        settings = get_settings()
+        return cls(
+            max_in_flight=settings.admission_max_in_flight,
+            max_queue=settings.admission_max_queue,
+            queue_timeout_ms=settings.admission_queue_timeout_ms,
+            max_per_tenant=settings.admission_max_per_tenant,
+            max_per_session=settings.admission_max_per_session,
+            retry_after=settings.admission_retry_after_s,
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    @contextlib.asynccontextmanager
+    async def admit(self, tenant: str, session_id: str = None):
+        """
+        hold a slot for the duration of the with-block
+        :param tenant: str | tenant the request is made for
+        :param session_id: str | (optional) chat session of the request
+        :raises AdmissionRejected: if no slot is available
+        """
+        await self.acquire(tenant, session_id)
+        try:
+            yield
+        finally:
+            self.release(tenant, session_id)
+
+    async def acquire(self, tenant: str, session_id: str = None) -> None:
+        if self._per_tenant.get(tenant, 0) >= self.max_per_tenant:
+            self._reject(429, "tenant_limit")
+        if session_id and self._per_session.get(session_id, 0) >= self.max_per_session:
+            self._reject(429, "session_limit")
+
+        self._per_tenant[tenant] += 1
+        if session_id:
+            self._per_session[session_id] += 1
+        try:
+            if self.in_flight < self.max_in_flight and not self._waiters:
+                self.in_flight += 1
+            elif len(self._waiters) >= self.max_queue:
+                self._reject(503, "queue_full")
+            else:
+                await self._wait_for_slot()
+        except BaseException:
+            self._release_counts(tenant, session_id)
+            raise
+        finally:
+            self._update_gauges()
+
+    def release(self, tenant: str, session_id: str = None) -> None:
+        self._release_counts(tenant, session_id)
+        self._release_slot()
+        self._update_gauges()
+
+    def _release_counts(self, tenant: str, session_id: str = None) -> None:
+        self._decrement(self._per_tenant, tenant)
+        if session_id:
+            self._decrement(self._per_session, session_id)
+
+    async def _wait_for_slot(self) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._update_gauges()
+        started_at = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout_ms / 1000)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as we stopped waiting, pass it on
+                self._release_slot()
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(503, "queue_timeout")
+            raise
+        finally:
+            with contextlib.suppress(ValueError):
+                self._waiters.remove(waiter)
+            metrics.observe("admission.wait_ms", (time.monotonic() - started_at) * 1000)
+
+    def _release_slot(self) -> None:
+        # hand the slot over to the longest waiting request, if any
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _reject(self, status_code: int, reason: str) -> None:
+        metrics.incr(f"admission.rejected.{reason}")
+        raise AdmissionRejected(status_code=status_code, reason=reason, retry_after=self.retry_after)
+
+    @staticmethod
+    def _decrement(counts: dict, key: str) -> None:
+        counts[key] -= 1
+        if counts[key] <= 0:
+            del counts[key]
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("admission.in_flight", self.in_flight)
+        metrics.set_gauge("admission.queue_depth", len(self._waiters))
@@ -0,0 +1,183 @@
+"""
+record/replay of upstream (model and moderation) calls, to run the chat path offline and deterministically
+"""
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from app.config.settings import get_settings
+from app.utils.metrics_utils import metrics
+from app.utils.single_flight import get_call_key
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+
+
+class CassetteMiss(KeyError):
+    """
+    a call was made in replay mode that is not on the cassette
+    """
+
+
+class Cassette:
+    """
+    in record mode every call is passed upstream and its response and latency are appended to the cassette file,
+    one compact json line per call (gzip-compressed if the path ends with .gz). The request itself is only
+    stored as key (hash of kind and request params).
+    In replay mode calls are served from the file and never passed upstream. Calls with the same key get the
+    recorded responses in the order they were recorded (cycling), so replaying a transcript is deterministic.
+    With replay_latency the recorded latencies are reproduced, streamed tokens arrive with their recorded offsets.
+    """
+
+    def __init__(self, path: str, mode: str = OFF, replay_latency: bool = False):
+        if mode not in (OFF, RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._recordings = None
+        self._replay_counts = defaultdict(int)
+        self._file = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "Cassette":
+        settings = get_settings()
+        return cls(
+            path=settings.cassette_path,
+            mode=settings.cassette_mode,
+            replay_latency=settings.cassette_replay_latency,
+        )
+
+    async def acall(self, kind: str, request: dict, coro_fn):
+        """
+        await coro_fn() for request, or its recorded response when replaying
+        :param kind: str | type of call, e.g. completion or moderation
+        :param request: dict | params that determine the response
+        :param coro_fn: callable returning the coroutine doing the upstream call
+        :return: the (recorded) response, must be json serializable
+        """
+        if self.mode == OFF:
+            return await coro_fn()
+        key = get_call_key(kind, request)
+        if self.mode == REPLAY:
+            recording = self._get_recording(key, kind)
+            if self.replay_latency:
+                await asyncio.sleep(recording["latency_ms"] / 1000)
+            return recording["response"]
+        started_at = time.monotonic()
+        response = await coro_fn()
+        self._record(key, kind, response, (time.monotonic() - started_at) * 1000)
+        return response
+
+    def call(self, kind: str, request: dict, fn):
+        """
+        synchronous version of acall
+        """
+        if self.mode == OFF:
+            return fn()
+        key = get_call_key(kind, request)
+        if self.mode == REPLAY:
+            recording = self._get_recording(key, kind)
+            if self.replay_latency:
+                time.sleep(recording["latency_ms"] / 1000)
+            return recording["response"]
+        started_at = time.monotonic()
+        response = fn()
+        self._record(key, kind, response, (time.monotonic() - started_at) * 1000)
+        return response
+
+    async def astream(self, request: dict, on_token, coro_fn) -> str:
+        """
+        streaming version of acall, coro_fn(on_token) streams the tokens to on_token and returns the full text
+        :return: str
+        """
+        if self.mode == OFF:
+            return await coro_fn(on_token)
+        key = get_call_key("stream", request)
+        if self.mode == REPLAY:
+            recording = self._get_recording(key, "stream")
+            replayed_at = 0
+            for token, offset_ms in recording["response"]:
+                if self.replay_latency:
+                    await asyncio.sleep((offset_ms - replayed_at) / 1000)
+                    replayed_at = offset_ms
+                await on_token(token)
+            return "".join(_token for _token, _ in recording["response"])
+
+        started_at = time.monotonic()
+        tokens = []
+
+        async def _on_token(token):
+            tokens.append((token, round((time.monotonic() - started_at) * 1000, 3)))
+            await on_token(token)
+
+        response = await coro_fn(_on_token)
+        self._record(key, "stream", tokens, (time.monotonic() - started_at) * 1000)
+        return response
+
+    def load(self) -> None:
+        """
+        read the recordings when replaying, otherwise done on the first replayed call
+        """
+        if self.mode == REPLAY and self._recordings is None:
+            self._recordings = self._load()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _get_recording(self, key: str, kind: str) -> dict:
+        self.load()
+        recordings = self._recordings.get(key)
+        if not recordings:
+            metrics.incr(f"cassette.{kind}.misses")
+            raise CassetteMiss(f"No {kind} call with key {key} on cassette {self.path}")
+        metrics.incr(f"cassette.{kind}.replayed")
+        count = self._replay_counts[key]
+        self._replay_counts[key] += 1
+        return recordings[count % len(recordings)]
+
+    def _load(self) -> dict:
+        recordings = defaultdict(list)
+        with self._open("rt") as fp:
+            try:
+                for line in fp:
+                    if line.strip():
+                        recording = json.loads(line)
+                        recordings[recording["key"]].append(recording)
+            except EOFError:
+                # gzip cassette of a recording process that was not shut down, all flushed lines were read
+                pass
+        return dict(recordings)
+
+    def _record(self, key: str, kind: str, response, latency_ms: float) -> None:
+        line = json.dumps(
+            {"key": key, "kind": kind, "latency_ms": round(latency_ms, 3), "response": response},
+            separators=(",", ":"),
+        )
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = self._open("at")
+            self._file.write(line + "\n")
+            # a recording must survive the process being stopped without shutdown
+            self._file.flush()
+        metrics.incr(f"cassette.{kind}.recorded")
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode, encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+
+cassette = Cassette.from_settings()
@@ -1,14 +1,39 @@
 """
 utils for working with GCP APIs
 """
+import json
 import os
+import threading
+import time
+import urllib.error
+import urllib.request
 
-from dotenv import load_dotenv
+from app.config.settings import get_settings
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+# env-vars that name the project, in order of precedence
+PROJECT_ID_ENV_VARS = ("GCP_PROJECT_NAME", "GOOGLE_CLOUD_PROJECT", "GCP_PROJECT", "DEVSHELL_PROJECT_ID")
 
 
 class CloudProjectUtils:
+    """
+    the project id and secrets environment are resolved once per process and shared by all instances,
+    get_project_id_and_secrets_env(refresh=True) resolves them again. A failed resolution is kept for
+    GCP_PROJECT_RETRY_S seconds, so that off GCP not every client waits for the metadata server.
+    The lock only guards the stored results, it is not held while resolving.
+    """
+
+    _resolved = None
+    _failed = None
+    _failed_until = 0.0
+    _lock = threading.Lock()
+
     def __init__(self):
-        load_dotenv()
+        # settings load the .env file (once)
+        get_settings()
         self.run_env = self.get_run_environment()
         self.secrets_env = "CLOUD"
         self.project_id = None
@@ -19,52 +44,84 @@ class CloudProjectUtils:
 
     def get_project_id_and_secrets_env(
             self,
+            refresh: bool = False,
     ) -> dict:
         """
         return project-id and secrets_env for GCP using different sources
-        :return: dict
+        env-vars and the credentials file are checked first, the metadata server is only asked when running
+        in the cloud and none of them has the project id
+        :param refresh: bool | resolve again instead of returning the result of the first resolution
+        :return: dict | with the source of the project id and the time the resolution took
         """
-        if self.run_env == "LOCAL":
-            self.project_id = self._get_project_id_locally()
-        else:  # > python37
-            self.project_id = self.get_project_id_from_gcp()
+        resolved = None if refresh else self._get_stored()
+        if resolved is None:
+            resolved = self._resolve()
+            self._store(resolved)
+        self.project_id = resolved["project_id"]
+        if not self.project_id and self.run_env != "LOCAL":
+            raise ValueError("Could not get a value for PROJECT_ID")
+        return resolved
+
+    @classmethod
+    def _get_stored(cls):
+        with cls._lock:
+            if cls._resolved is not None:
+                return dict(cls._resolved)
+            if cls._failed is not None and time.monotonic() < cls._failed_until:
+                return dict(cls._failed)
+            return None
 
-            if not self.project_id:
-                raise ValueError("Could not get a value for PROJECT_ID")
+    @classmethod
+    def _store(cls, resolved: dict) -> None:
+        with cls._lock:
+            if resolved["project_id"]:
+                cls._resolved, cls._failed = dict(resolved), None
+            else:
+                # e.g. the metadata server not reachable (yet), tried again once the retry interval passed
+                cls._failed = dict(resolved)
+                cls._failed_until = time.monotonic() + get_settings().gcp_project_retry_s
+
+    def _resolve(self) -> dict:
+        started_at = time.monotonic()
+        source = "env"
+        project_id = self._get_project_id_locally()
+        if not project_id and self.run_env != "LOCAL":
+            source = "metadata_server"
+            project_id = self.get_project_id_from_gcp(timeout=get_settings().gcp_metadata_timeout_s)
+        resolution_ms = (time.monotonic() - started_at) * 1000
+        metrics.observe("gcp.project_resolution_ms", resolution_ms)
+        log.info(f"Resolved project id {project_id} from {source} in {resolution_ms:.0f} ms")
         return {
-            "project_id": self.project_id,
+            "project_id": project_id,
             "secrets_env": self.secrets_env,
+            "source": source if project_id else None,
+            "resolution_ms": round(resolution_ms, 3),
         }
 
     @staticmethod
     def _get_project_id_locally():
-        _project_id = os.getenv("GCP_PROJECT_NAME")
+        _project_id = next(filter(None, map(os.getenv, PROJECT_ID_ENV_VARS)), None)
 
         # else if this is running locally then GOOGLE_APPLICATION_CREDENTIALS should be defined
         if not _project_id and "GOOGLE_APPLICATION_CREDENTIALS" in os.environ:
-            import json
-
             with open(os.environ["GOOGLE_APPLICATION_CREDENTIALS"], "r") as fp:
                 credentials = json.load(fp)
-            _project_id = credentials["project_id"]
+            _project_id = credentials.get("project_id")
         return _project_id or None
 
     @staticmethod
-    def get_project_id_from_gcp():
-        # Only works on Cloud App Run
-        import urllib.request
-
-        url = "http://metadata.google.internal/computeMetadata/v1/project/project-id"
-        req = urllib.request.Request(url)
+    def get_project_id_from_gcp(timeout: float = 1.0):
+        # Only works on GCP (Cloud Run, GCE, ...), off GCP the request fails within timeout.
+        # The metadata server is addressed by ip, resolving its host name off GCP may take longer than timeout.
+        host = os.getenv("GCE_METADATA_HOST") or "169.254.169.254"
+        req = urllib.request.Request(f"http://{host}/computeMetadata/v1/project/project-id")
         req.add_header("Metadata-Flavor", "Google")
-        _project_id = urllib.request.urlopen(req).read().decode()
-
-        if not _project_id:  # Running from Cloud Shell
-            _project_id = os.environ["DEVSHELL_PROJECT_ID"]
-
-        # If this is running in a cloud function, then GCP_PROJECT should be defined
-        if not _project_id and "GCP_PROJECT" in os.environ:
-            _project_id = os.environ["GCP_PROJECT"]
+        try:
+            _project_id = urllib.request.urlopen(req, timeout=timeout).read().decode()
+        except (urllib.error.URLError, OSError) as e:
+            metrics.incr("gcp.metadata_server.failures")
+            log.warning(f"Metadata server not reachable: {e}")
+            return None
         return _project_id or None
 
 
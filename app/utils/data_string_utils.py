@@ -1,6 +1,10 @@
+from __future__ import annotations
+
 import json
-from tabulate import tabulate
-import pandas as pd
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def add_missing_dummy_columns(d, columns):
@@ -81,6 +85,8 @@ def pretty_print_df(dataframe: pd.DataFrame) -> dict:
     :param dataframe:
     :return: dict| with info of status of pretty_print_df
     """
+    from tabulate import tabulate
+
     try:
         print(tabulate(dataframe, headers="keys", tablefmt="psql"))
         return {
@@ -2,11 +2,12 @@
 utils to work with/on different data-types including interconversions
 """
 from __future__ import annotations
-from tabulate import tabulate
-import pandas as pd
 # from app.models.fin_attribute import FinAttribute
 import re
-from typing import Iterable, Generator
+from typing import TYPE_CHECKING, Iterable, Generator
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def flatten(items: Iterable) -> Generator:
@@ -283,6 +284,8 @@ def pretty_print_df(dataframe: pd.DataFrame) -> dict:
     :param dataframe:
     :return:
     """
+    from tabulate import tabulate
+
     try:
         print(tabulate(dataframe, headers="keys", tablefmt="psql"))
         return {
@@ -298,6 +301,8 @@ def pretty_print_df(dataframe: pd.DataFrame) -> dict:
 def fix_special_characters_in_json_keys(
     data_to_update: dict | list[dict] | pd.DataFrame,
 ) -> list[dict]:
+    import pandas as pd
+
     if isinstance(data_to_update, (dict, list)):
         if isinstance(data_to_update, dict):
             data_to_update = [data_to_update]
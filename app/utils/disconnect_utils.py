@@ -0,0 +1,42 @@
+"""
+utils for aborting request handling when the HTTP client goes away
+"""
+import asyncio
+import contextlib
+
+from starlette.requests import Request
+
+from app.utils.metrics_utils import metrics
+
+
+class ClientDisconnected(Exception):
+    """
+    the HTTP client disconnected before the response was ready
+    """
+
+    pass
+
+
+async def run_until_disconnected(request: Request, coro, poll_interval: float = 0.1):
+    """
+    run coro as a task and cancel it as soon as the client of request disconnects
+    cancelling the task cancels the upstream call in flight and all steps that have not started yet
+    :param request: Request | request whose connection is watched
+    :param coro: coroutine to be run
+    :param poll_interval: float | seconds between two disconnect checks
+    :return: result of coro
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                metrics.incr("chat.cancelled_on_disconnect")
+                raise ClientDisconnected(f"Client disconnected from {request.url.path}")
+    finally:
+        if not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
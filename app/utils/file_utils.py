@@ -8,7 +8,6 @@ import json
 from pathlib import Path
 import os
 from datetime import datetime
-import pandas as pd
 
 from typing import Union
 
@@ -79,6 +78,8 @@ def save_data_as_file(
     file_subdir: str,
     api_name: str = None,
 ) -> str:
+    import pandas as pd
+
     file_ext = f".{file_type}"
     file_path = get_write_data_file_name(
         file_path=file_subdir,
@@ -108,6 +109,8 @@ def csv_to_json_content(content: str, key: str = "data") -> str:
     :param key: str|key used for creating dict for json
     :return: str|json string
     """
+    import pandas as pd
+
     delimiter = csv.Sniffer().sniff(io.StringIO(content).readline()).delimiter
 
     return json.dumps(
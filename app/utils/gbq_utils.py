@@ -1,9 +1,14 @@
 """
 utils for GBQQ-usage
 """
+from __future__ import annotations
+
 import re
 import json
-from google.cloud import bigquery
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from google.cloud import bigquery
 
 
 def get_mapping_json_string_from_mssql_string(
@@ -96,6 +101,22 @@ def convert_to_gbq_data_type(data_type: str) -> str:
     }.get(data_type, data_type)
 
 
+def get_mapping_entry(table_name_key: str = None, schema_name_key: str = None):
+    """
+    get the mapping of the mapping config file for a GBQ table, by table-name or schema-name as key
+    :param table_name_key: str | table-name to be used as key
+    :param schema_name_key: str | schema-name to be used as key
+    :return: MappingEntry | None if there is no mapping for either key
+    """
+    from app.data.data_transformer.mapping_registry import mapping_registry
+
+    # the mapping config is only read again once it changed
+    for _key in (table_name_key, schema_name_key):
+        if _key and (_mapping := mapping_registry.get(_key.upper())):
+            return _mapping
+    return None
+
+
 def get_gbq_schema_from_json(
     table_name_key: str = None, schema_name_key: str = None
 ) -> list:
@@ -106,31 +127,10 @@ def get_gbq_schema_from_json(
     :return: list | GBQ table schema as list of Schema-fields
     """
     bigquery_schema_list = []
-    from app.utils.file_utils import (
-        get_data_from_json_file,
-        get_config_filepath,
-    )
-
-    _mapping_config_file = get_config_filepath("MAPPING_CONFIG_FILE")
-
-    if not (
-        json_data := get_data_from_json_file(
-            file_path=get_config_filepath("MAPPING_CONFIG_FILE")
-        )
-    ):
-        raise "mapping config file not found!"
     try:
-        _key_map = (
-            json_data.get(table_name_key.upper())
-            or (json_data.get(schema_name_key.upper()) if schema_name_key else None)
-        )
-
-        if _key_map:
-            if _db_col_mapping := _key_map.get("db_col_to_json_mapping"):
-                bigquery_schema_list.extend(
-                    bigquery.SchemaField(_key, _val.split(":")[-1])
-                    for _key, _val in _db_col_mapping.items()
-                )
+        # the schema is built once per mapping
+        if _mapping := get_mapping_entry(table_name_key, schema_name_key):
+            bigquery_schema_list.extend(_mapping.schema_fields)
     except AttributeError as e:
         print(f"{e}, returning empty schema")
     return bigquery_schema_list
@@ -145,6 +145,8 @@ def update_write_disposition(
     :param write_disposition:
     :return:
     """
+    from google.cloud import bigquery
+
     if write_disposition and write_disposition == "overwrite":
         job_config.write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE
     else:
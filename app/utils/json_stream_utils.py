@@ -0,0 +1,149 @@
+"""
+utils for reading large json files incrementally, one record at a time
+"""
+import json
+from typing import Iterator, List, Optional, TextIO
+
+READ_SIZE = 1 << 20
+_WHITESPACE = " \t\n\r"
+# characters at the end of the buffer an incomplete number ("1e-") or escape ("\u00e") may leave undecoded
+_NUMBER_TAIL = 2
+_ESCAPE_TAIL = 6
+
+
+class JsonStreamReader:
+    """
+    reads one json document from fp in blocks, the buffer only holds the value being decoded (and the rest of
+    the last block). Values are decoded with json.JSONDecoder.raw_decode, the structure around them is walked here.
+    """
+
+    def __init__(self, fp: TextIO, read_size: int = READ_SIZE):
+        self.fp = fp
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, min_size: int = 0) -> bool:
+        """
+        drop the consumed part of the buffer and read the next block(s)
+        :param min_size: int | read at least this many characters (unless the file ends)
+        :return: bool | False at the end of the file
+        """
+        if self.eof:
+            return False
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        read = 0
+        while True:
+            block = self.fp.read(max(self.read_size, min_size - read))
+            if not block:
+                self.eof = True
+                return read > 0
+            self.buffer += block
+            read += len(block)
+            if read >= min_size:
+                return True
+
+    def peek(self) -> str:
+        """
+        :return: str | next character that is not whitespace, "" at the end of the file
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        if (found := self.peek()) != char:
+            raise ValueError(f"Expected {char!r} in json, found {found or 'end of file'!r}")
+        self.pos += 1
+
+    def skip_comma(self) -> None:
+        if self.peek() == ",":
+            self.pos += 1
+
+    def decode_value(self):
+        """
+        decode the next value, reading more of the file until it is complete
+        :return: the value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self.eof or not self._is_incomplete(e):
+                    raise
+                # the value does not fit in the buffer, at least double it so that large values are not decoded
+                # again for every block
+                self._fill(min_size=len(self.buffer) - self.pos)
+                continue
+            if isinstance(value, (int, float)) and end + _NUMBER_TAIL >= len(self.buffer) and not self.eof:
+                # a number at the end of the buffer may continue in the next block ("12" of "123", "1" of "1.5")
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def _is_incomplete(self, error: json.JSONDecodeError) -> bool:
+        """
+        whether decoding failed because the value goes on after the end of the buffer, other errors are raised
+        right away instead of reading the rest of the file into the buffer
+        """
+        return error.pos >= len(self.buffer) - _ESCAPE_TAIL or error.msg.startswith("Unterminated string")
+
+    def find_key(self, key: str) -> bool:
+        """
+        move into the object at the current position up to the value of key, the values before it are skipped
+        :param key: str
+        :return: bool | False if the object has no key (the whole object is consumed then)
+        """
+        self.expect("{")
+        while self.peek() != "}":
+            _key = self.decode_value()
+            self.expect(":")
+            if _key == key:
+                return True
+            self.decode_value()
+            self.skip_comma()
+        self.pos += 1
+        return False
+
+    def iter_items(self) -> Iterator:
+        """
+        the items of the array at the current position, an object counts as an array of one item
+        """
+        if self.peek() != "[":
+            value = self.decode_value()
+            if isinstance(value, dict):
+                yield value
+            return
+        self.pos += 1
+        while self.peek() != "]":
+            if not self.peek():
+                raise ValueError("Unterminated array in json")
+            yield self.decode_value()
+            self.skip_comma()
+        self.pos += 1
+
+
+def iter_json_records(
+    file_path: str, data_envelope: Optional[List[str]] = None, read_size: int = READ_SIZE
+) -> Iterator:
+    """
+    records of the json file in file_path, read incrementally: memory depends on the size of a record, not the file
+    :param file_path: str
+    :param data_envelope: list of str | keys from the outermost object to the array of records, None if the file
+                          is the array; the records are the same as from TransformedData.get_raw_data_envelope
+    :param read_size: int | characters read at once
+    :return: iterator of records
+    """
+    with open(file_path, "r", encoding="utf-8") as fp:
+        reader = JsonStreamReader(fp, read_size)
+        for key in data_envelope or []:
+            if not reader.find_key(key):
+                return
+        yield from reader.iter_items()
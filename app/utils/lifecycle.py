@@ -0,0 +1,132 @@
+"""
+lifecycle of a worker process: warmup before it is ready, draining of in-flight work on shutdown
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Callable, Dict, Optional
+
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+DRAINING = "draining"
+
+
+class _WarmupStep:
+    __slots__ = ("name", "fn", "required", "duration_ms", "error")
+
+    def __init__(self, name: str, fn: Callable, required: bool):
+        self.name = name
+        self.fn = fn
+        self.required = required
+        self.duration_ms = None
+        self.error = None
+
+
+class Lifecycle:
+    """
+    the warmup steps (loading data, importing and creating clients) run in parallel when the worker starts,
+    plain callables in threads, async callables on the event loop. The worker is ready once all steps are done
+    and no required step failed, failed optional steps only leave their resource to be created on first use.
+    On shutdown the worker is draining: it is no longer ready and waits for in-flight work to finish.
+    """
+
+    def __init__(self, warmup_timeout_s: float):
+        self.warmup_timeout_s = warmup_timeout_s
+        self.warmup_ms = None
+        self._steps: Dict[str, _WarmupStep] = {}
+        self._warmup_task: Optional[asyncio.Task] = None
+        self.state = STARTING
+        metrics.set_gauge("lifecycle.ready", 0)
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def add_warmup_step(self, name: str, fn: Callable, required: bool = True) -> None:
+        """
+        :param name: str | name of the step in status and metrics
+        :param fn: callable without arguments, plain or async
+        :param required: bool | whether the worker cannot be ready if the step fails
+        """
+        self._steps[name] = _WarmupStep(name, fn, required)
+
+    def start_warmup(self) -> asyncio.Task:
+        """
+        run the warmup in the background, must be called from the event loop
+        :return: asyncio.Task
+        """
+        if self._warmup_task is None:
+            self._warmup_task = asyncio.ensure_future(self.warmup())
+        return self._warmup_task
+
+    async def warmup(self) -> None:
+        """
+        run all warmup steps in parallel, steps not done after warmup_timeout_s count as failed
+        """
+        started_at = time.monotonic()
+        tasks = {asyncio.ensure_future(self._run_step(_step)): _step for _step in self._steps.values()}
+        if tasks:
+            _, pending = await asyncio.wait(set(tasks), timeout=self.warmup_timeout_s)
+            for task in pending:
+                task.cancel()
+                tasks[task].error = f"not done within {self.warmup_timeout_s}s"
+                metrics.incr(f"lifecycle.warmup.{tasks[task].name}.failed")
+        self.warmup_ms = (time.monotonic() - started_at) * 1000
+        metrics.observe("lifecycle.warmup_ms", self.warmup_ms)
+        if self.state == STARTING:
+            failed = [_step.name for _step in self._steps.values() if _step.required and _step.error]
+            self._set_state(FAILED if failed else READY)
+            log.info(f"Warmup finished in {self.warmup_ms:.0f} ms, worker is {self.state}")
+
+    async def drain(self, get_in_flight: Callable[[], int], timeout: float) -> int:
+        """
+        stop being ready and wait (at most timeout seconds) until no work is in flight anymore
+        :param get_in_flight: callable returning the number of requests in flight
+        :param timeout: float | seconds
+        :return: int | requests still in flight after the timeout
+        """
+        self._set_state(DRAINING)
+        if self._warmup_task is not None and not self._warmup_task.done():
+            self._warmup_task.cancel()
+        deadline = time.monotonic() + timeout
+        while (in_flight := get_in_flight()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if in_flight:
+            metrics.incr("lifecycle.drain.abandoned", in_flight)
+        return in_flight
+
+    def get_status(self) -> dict:
+        return {
+            "state": self.state,
+            "warmup_ms": self.warmup_ms,
+            "steps": {
+                _step.name: {"duration_ms": _step.duration_ms, "required": _step.required, "error": _step.error}
+                for _step in self._steps.values()
+            },
+        }
+
+    async def _run_step(self, step: _WarmupStep) -> None:
+        started_at = time.monotonic()
+        try:
+            if asyncio.iscoroutinefunction(step.fn):
+                await step.fn()
+            else:
+                await asyncio.to_thread(step.fn)
+        except Exception as e:
+            step.error = str(e)
+            metrics.incr(f"lifecycle.warmup.{step.name}.failed")
+            log.warning(f"Warmup step {step.name} failed: {e}", exc_info=True)
+        finally:
+            step.duration_ms = (time.monotonic() - started_at) * 1000
+            metrics.observe(f"lifecycle.warmup.{step.name}_ms", step.duration_ms)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        metrics.set_gauge("lifecycle.ready", int(state == READY))
@@ -0,0 +1,208 @@
+"""
+allocation tracking with tracemalloc: periodic snapshot diffs and peak allocations of sampled requests
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import random
+import threading
+import time
+import tracemalloc
+from collections import deque
+from typing import List, Optional
+
+from app.config.settings import get_settings
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+# allocations of tracemalloc itself and of the import machinery are not of interest
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def get_top_allocations(snapshot, previous=None, limit: int = 20) -> List[dict]:
+    """
+    allocation sites (file and line) with the most memory, or the most growth since previous
+    :param snapshot: tracemalloc.Snapshot
+    :param previous: tracemalloc.Snapshot | (optional) older snapshot to diff against
+    :param limit: int | number of sites
+    :return: list of dicts
+    """
+    if previous is None:
+        return [
+            {"site": str(_stat.traceback), "size_kb": round(_stat.size / 1024, 1), "count": _stat.count}
+            for _stat in snapshot.statistics("lineno")[:limit]
+        ]
+    return [
+        {
+            "site": str(_stat.traceback),
+            "size_kb": round(_stat.size / 1024, 1),
+            "size_diff_kb": round(_stat.size_diff / 1024, 1),
+            "count": _stat.count,
+            "count_diff": _stat.count_diff,
+        }
+        for _stat in snapshot.compare_to(previous, "lineno")[:limit]
+    ]
+
+
+def get_loggers_with_duplicate_handlers() -> dict:
+    """
+    loggers with more than one handler of the same type, e.g. from calling get_logger repeatedly
+    :return: dict | logger name -> number of handlers
+    """
+    duplicates = {}
+    for name, logger in logging.Logger.manager.loggerDict.items():
+        handlers = getattr(logger, "handlers", [])
+        if len({type(_handler) for _handler in handlers}) < len(handlers):
+            duplicates[name] = len(handlers)
+    return duplicates
+
+
+class MemoryDiagnostics:
+    """
+    traces allocations with tracemalloc (frames frames per allocation) once started. Every interval_s a snapshot
+    is taken and compared with the previous one and the first one (the baseline), the top_n allocation sites are
+    kept for the report.
+    Of sample_rate of the requests the peak of traced memory during the request is recorded, one request at a
+    time, as the peak is process-wide. Tracing slows down allocations noticeably, so this is a diagnostics mode.
+    """
+
+    def __init__(self, interval_s: int, frames: int, top_n: int, sample_rate: float, max_requests: int = 100):
+        self.interval_s = interval_s
+        self.frames = frames
+        self.top_n = top_n
+        self.sample_rate = sample_rate
+        self._baseline = None
+        self._previous = None
+        self._report = {}
+        self._request_peaks = deque(maxlen=max_requests)
+        self._measuring = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_settings(cls) -> "MemoryDiagnostics":
+        settings = get_settings()
+        return cls(
+            interval_s=settings.memory_snapshot_interval_s,
+            frames=settings.memory_trace_frames,
+            top_n=settings.memory_top_n,
+            sample_rate=settings.memory_request_sample_rate,
+        )
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self) -> None:
+        """
+        start tracing and the periodic snapshots, must be called from the event loop
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._snapshot_periodically())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        tracemalloc.stop()
+        self._baseline = self._previous = None
+
+    async def take_snapshot(self) -> dict:
+        """
+        take a snapshot (in a thread, it walks all traced allocations) and update the report
+        :return: dict | the report
+        """
+        snapshot = await asyncio.to_thread(self._take_snapshot)
+        self._report = {
+            "taken_at": time.time(),
+            "top_allocations": get_top_allocations(snapshot, limit=self.top_n),
+            "growth_since_previous": (
+                get_top_allocations(snapshot, self._previous, self.top_n) if self._previous else []
+            ),
+            "growth_since_baseline": (
+                get_top_allocations(snapshot, self._baseline, self.top_n) if self._baseline else []
+            ),
+        }
+        if self._baseline is None:
+            self._baseline = snapshot
+        self._previous = snapshot
+        return self._report
+
+    def get_report(self) -> dict:
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": self.tracing,
+            "traced_current_kb": round(current / 1024, 1),
+            "traced_peak_kb": round(peak / 1024, 1),
+            "loggers_with_duplicate_handlers": get_loggers_with_duplicate_handlers(),
+            "snapshot": self._report,
+            "request_peaks": list(self._request_peaks),
+        }
+
+    def start_request(self) -> Optional[int]:
+        """
+        :return: int | traced memory at the start of a sampled request, None if the request is not measured
+        """
+        if not self.tracing or not self.sample_rate or random.random() >= self.sample_rate:
+            return None
+        if not self._measuring.acquire(blocking=False):
+            return None
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    def finish_request(self, method: str, path: str, started_with: int) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        self._measuring.release()
+        peak_kb = round((peak - started_with) / 1024, 1)
+        self._request_peaks.appendleft({
+            "method": method,
+            "path": path,
+            "peak_kb": peak_kb,
+            "retained_kb": round((current - started_with) / 1024, 1),
+            "at": time.time(),
+        })
+        metrics.observe("memory.request_peak_kb", peak_kb)
+
+    def _take_snapshot(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        metrics.incr("memory.snapshots")
+        return snapshot
+
+    async def _snapshot_periodically(self) -> None:
+        while True:
+            try:
+                await self.take_snapshot()
+            except Exception:
+                log.exception("Memory snapshot failed")
+            await asyncio.sleep(self.interval_s)
+
+
+class MemoryDiagnosticsMiddleware:
+    """
+    ASGI middleware recording the peak allocations of the http requests sampled by diagnostics
+    """
+
+    def __init__(self, app, diagnostics: MemoryDiagnostics):
+        self.app = app
+        self.diagnostics = diagnostics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (started_with := self.diagnostics.start_request()) is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.diagnostics.finish_request(scope["method"], scope["path"], started_with)
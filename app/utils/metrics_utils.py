@@ -0,0 +1,57 @@
+"""
+process-wide, in-memory metrics: counters, gauges and observed values (e.g. latencies)
+"""
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.observations = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        """
+        record one observed value, keeps count, sum, min and max per metric name
+        :param name: str | metric name
+        :param value: float | observed value, e.g. a latency in ms
+        """
+        with self._lock:
+            stats = self.observations.get(name)
+            if stats is None:
+                self.observations[name] = {"count": 1, "sum": value, "min": value, "max": value}
+            else:
+                stats["count"] += 1
+                stats["sum"] += value
+                stats["min"] = min(stats["min"], value)
+                stats["max"] = max(stats["max"], value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "observations": {
+                    _name: {**_stats, "avg": _stats["sum"] / _stats["count"]}
+                    for _name, _stats in self.observations.items()
+                },
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.observations.clear()
+
+
+metrics = Metrics()
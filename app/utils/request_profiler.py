@@ -0,0 +1,207 @@
+"""
+opt-in sampling profiler for single requests, writes folded stacks (input format of flamegraph.pl and speedscope)
+"""
+from __future__ import annotations
+
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import List, Optional
+
+from app.config.settings import get_settings
+from app.utils.metrics_utils import metrics
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+PROFILE_FILE_EXT = ".folded"
+
+
+def _get_frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def get_folded_stack(frame, thread_name: str) -> str:
+    """
+    stack of frame as one line of folded stacks: thread and functions from the outermost, separated by ;
+    :param frame: frame | innermost frame of the stack
+    :param thread_name: str
+    :return: str
+    """
+    names = []
+    while frame is not None:
+        names.append(_get_frame_name(frame))
+        frame = frame.f_back
+    return ";".join([thread_name, *reversed(names)])
+
+
+class _Profile:
+    """
+    samples the stacks of all threads (but its own) every interval_s until stopped, then writes them
+    the event loop thread is sampled as a whole, so requests served concurrently show up in the profile as well
+    """
+
+    def __init__(self, profiler: "RequestProfiler", profile_id: str, meta: dict):
+        self.profiler = profiler
+        self.profile_id = profile_id
+        self.meta = meta
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{profile_id}", daemon=True)
+
+    def start(self) -> None:
+        self.meta["started_at"] = time.time()
+        self._thread.start()
+
+    def stop(self, status_code: Optional[int]) -> None:
+        # the sampler thread writes the profile, the caller does not wait for it
+        self.meta["status_code"] = status_code
+        self.meta["duration_ms"] = round((time.time() - self.meta["started_at"]) * 1000, 3)
+        self._stopped.set()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.profiler.interval_s):
+            thread_names = {_thread.ident: _thread.name for _thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.samples[get_folded_stack(frame, thread_names.get(thread_id, str(thread_id)))] += 1
+        try:
+            self.profiler.write(self)
+        finally:
+            self.profiler.release()
+
+
+class RequestProfiler:
+    """
+    profiles sample_rate of the requests and those sent with the header X-Profile: 1, one request at a time.
+    Requests to profile while a profile is running are not profiled. Profiles are written to profile_dir, the
+    oldest are deleted once the files take more than max_bytes.
+    """
+
+    def __init__(self, profile_dir: str, sample_rate: float, interval_ms: int, max_bytes: int, max_listed: int = 100):
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.interval_s = interval_ms / 1000
+        self.max_bytes = max_bytes
+        self._recent = deque(maxlen=max_listed)
+        self._busy = threading.Lock()
+        self._files_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "RequestProfiler":
+        settings = get_settings()
+        return cls(
+            profile_dir=settings.profiler_dir,
+            sample_rate=settings.profiler_sample_rate,
+            interval_ms=settings.profiler_interval_ms,
+            max_bytes=settings.profiler_max_bytes,
+        )
+
+    def should_profile(self, headers: List[tuple]) -> bool:
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        return any(_name == PROFILE_HEADER and _value == b"1" for _name, _value in headers)
+
+    def start(self, method: str, path: str) -> Optional[_Profile]:
+        """
+        :return: _Profile | None if another profile is running
+        """
+        if not self._busy.acquire(blocking=False):
+            metrics.incr("profiler.skipped_busy")
+            return None
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+        profile_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{time.time_ns() % 10 ** 9:09d}_{method.lower()}_{slug[:60]}"
+        profile = _Profile(self, profile_id, {"id": profile_id, "method": method, "path": path})
+        try:
+            profile.start()
+        except Exception:
+            self.release()
+            raise
+        metrics.incr("profiler.started")
+        return profile
+
+    def release(self) -> None:
+        self._busy.release()
+
+    def write(self, profile: _Profile) -> None:
+        file_path = self.get_file_path(profile.profile_id)
+        with self._files_lock:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            with open(file_path, "w", encoding="utf-8") as fp:
+                fp.writelines(f"{_stack} {_count}\n" for _stack, _count in profile.samples.items())
+            self._recent.appendleft({
+                **profile.meta,
+                "samples": sum(profile.samples.values()),
+                "bytes": os.path.getsize(file_path),
+            })
+            self._rotate()
+        metrics.observe("profiler.samples", sum(profile.samples.values()))
+
+    def list_recent(self) -> List[dict]:
+        """
+        the most recent profiles whose files still exist, newest first
+        :return: list of dicts
+        """
+        with self._files_lock:
+            return [_meta for _meta in self._recent if os.path.exists(self.get_file_path(_meta["id"]))]
+
+    def get_file_path(self, profile_id: str) -> Optional[str]:
+        """
+        :param profile_id: str
+        :return: str | None if profile_id is not a valid id
+        """
+        if not re.fullmatch(r"[A-Za-z0-9_]+", profile_id):
+            return None
+        return os.path.join(self.profile_dir, profile_id + PROFILE_FILE_EXT)
+
+    def _rotate(self) -> None:
+        files = sorted(
+            (_entry for _entry in os.scandir(self.profile_dir) if _entry.name.endswith(PROFILE_FILE_EXT)),
+            key=lambda _entry: _entry.stat().st_mtime,
+        )
+        total_bytes = sum(_entry.stat().st_size for _entry in files)
+        # the newest profile is kept, even if it alone exceeds max_bytes
+        for entry in files[:-1]:
+            if total_bytes <= self.max_bytes:
+                break
+            total_bytes -= entry.stat().st_size
+            os.remove(entry.path)
+            metrics.incr("profiler.rotated")
+
+
+class RequestProfilerMiddleware:
+    """
+    ASGI middleware profiling the http requests chosen by profiler, the id of a profile is sent back
+    in the header X-Profile-Id
+    """
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.should_profile(scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+        profile = self.profiler.start(scope["method"], scope["path"])
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+        status_code = None
+
+        async def _send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (PROFILE_ID_HEADER, profile.profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            profile.stop(status_code)
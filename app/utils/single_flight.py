@@ -0,0 +1,74 @@
+"""
+single-flight coalescing of identical concurrent async calls
+"""
+import asyncio
+import hashlib
+import json
+
+from app.utils.metrics_utils import metrics
+
+
+def get_call_key(*args) -> str:
+    """
+    stable key for json-serializable call arguments
+    :return: str | sha256 hex-digest
+    """
+    return hashlib.sha256(
+        json.dumps(args, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    concurrent callers passing the same key share one in-flight call and all receive its result (or exception).
+    Nothing is kept once the call finishes, so unlike a cache this never serves stale results.
+    A caller that is cancelled only stops waiting, the shared call is cancelled when its last caller is gone.
+    The shared call must not be bound to the timeout of the caller that started it: each caller passes its own
+    timeout to do(), a caller that times out stops waiting while the others keep their budget.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+
+    async def do(self, key: str, coro_fn, timeout: float = None):
+        """
+        await the in-flight call for key, or start one with coro_fn
+        :param key: str | normalized call input, see get_call_key
+        :param coro_fn: callable returning the coroutine to be run if no call for key is in flight
+        :param timeout: float | seconds this caller waits at most, None to wait until the call finishes
+        :return: result of the shared call
+        :raises asyncio.TimeoutError: if the call did not finish within timeout
+        """
+        flight = self._flights.get(key)
+        if flight is None or flight.task.get_loop() is not asyncio.get_running_loop():
+            flight = _Flight(asyncio.ensure_future(coro_fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _task: self._forget(key, flight, _task))
+            metrics.incr(f"single_flight.{self.name}.calls")
+        else:
+            metrics.incr(f"single_flight.{self.name}.coalesced")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                flight.task.cancel()
+
+    def _forget(self, key: str, flight: _Flight, task: asyncio.Task) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not task.cancelled():
+            # mark the exception as retrieved, all waiters may have been cancelled already
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._flights)
@@ -0,0 +1,87 @@
+"""
+in-process async queue for work that does not have to finish before the response is sent
+"""
+import asyncio
+import contextlib
+import time
+
+from app.config.settings import get_settings
+from app.utils.logging_utils import get_logger
+from app.utils.metrics_utils import metrics
+
+log = get_logger(__name__)
+
+
+class BackgroundTaskQueue:
+    """
+    bounded queue worked off by worker tasks on the running event loop
+    work items are plain or async callables, items submitted while the queue is full are dropped (and counted).
+    The queue and its workers are created on first use, so they are bound to the loop serving the requests.
+    """
+
+    def __init__(self, name: str, capacity: int, workers: int):
+        self.name = name
+        self.capacity = capacity
+        self.num_workers = workers
+        self._queue = None
+        self._workers = []
+
+    def submit(self, fn, *args, **kwargs) -> bool:
+        """
+        enqueue fn(*args, **kwargs) without blocking, must be called from the event loop
+        :return: bool | False if the item was dropped as the queue is full
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.monotonic(), fn, args, kwargs))
+        except asyncio.QueueFull:
+            metrics.incr(f"task_queue.{self.name}.dropped")
+            return False
+        metrics.set_gauge(f"task_queue.{self.name}.depth", self._queue.qsize())
+        return True
+
+    async def drain(self, timeout: float = None) -> None:
+        """
+        wait (at most timeout seconds) until all queued items are done, then stop the workers
+        items still queued after the timeout are dropped (and counted)
+        """
+        if self._queue is None:
+            return
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._queue.join(), timeout)
+        if dropped := self._queue.qsize():
+            metrics.incr(f"task_queue.{self.name}.dropped", dropped)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._queue, self._workers = None, []
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._workers and self._workers[0].get_loop() is loop:
+            return
+        self._queue = asyncio.Queue(maxsize=self.capacity)
+        self._workers = [asyncio.ensure_future(self._work(self._queue)) for _ in range(self.num_workers)]
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            enqueued_at, fn, args, kwargs = await queue.get()
+            metrics.observe(f"task_queue.{self.name}.lag_ms", (time.monotonic() - enqueued_at) * 1000)
+            metrics.set_gauge(f"task_queue.{self.name}.depth", queue.qsize())
+            try:
+                result = fn(*args, **kwargs)
+                if asyncio.iscoroutine(result):
+                    await result
+                metrics.incr(f"task_queue.{self.name}.done")
+            except Exception:
+                metrics.incr(f"task_queue.{self.name}.failed")
+                log.exception(f"Background task {getattr(fn, '__name__', fn)} failed")
+            finally:
+                queue.task_done()
+
+
+background_tasks = BackgroundTaskQueue(
+    name="background",
+    capacity=get_settings().background_queue_capacity,
+    workers=get_settings().background_queue_workers,
+)
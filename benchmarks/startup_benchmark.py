@@ -0,0 +1,131 @@
+"""
+startup benchmark: cold import time of the app and time to its first served request
+
+usage (from the project root):
+    $ python benchmarks/startup_benchmark.py --runs 5
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules that must not be imported just to serve the chat api
+HEAVY_MODULES = [
+    "openai",
+    "pandas",
+    "numpy",
+    "tabulate",
+    "google.cloud.bigquery",
+    "google.cloud.storage",
+    "google.cloud.secretmanager",
+    "uvicorn",
+]
+_IMPORT_SCRIPT = """
+import json, sys, time
+started_at = time.perf_counter()
+import {module}
+import_ms = (time.perf_counter() - started_at) * 1000
+print(json.dumps({{"import_ms": import_ms, "loaded": [_m for _m in {heavy_modules!r} if _m in sys.modules]}}))
+"""
+
+
+def _get_env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [PROJECT_ROOT, env.get("PYTHONPATH")]))
+    # the api key is read on the first upstream call, not needed to start
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    return env
+
+
+def _get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import(module: str) -> dict:
+    """
+    import module in a fresh interpreter, without bytecode being written
+    :param module: str | e.g. app.main
+    :return: dict | import_ms and the heavy modules loaded by the import
+    """
+    result = subprocess.run(
+        [sys.executable, "-B", "-c", _IMPORT_SCRIPT.format(module=module, heavy_modules=HEAVY_MODULES)],
+        cwd=PROJECT_ROOT,
+        env=_get_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_first_request(path: str = "/", timeout_s: float = 60) -> float:
+    """
+    start the app with uvicorn as in the Dockerfile and poll path until it is served
+    :param path: str | path of the first request
+    :param timeout_s: float | give up after
+    :return: float | ms from process start to the first successful response
+    """
+    port = _get_free_port()
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-B", "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=PROJECT_ROOT,
+        env=_get_env(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started_at < timeout_s:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - started_at) * 1000
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise TimeoutError(f"{path} not served within {timeout_s}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def _get_summary(values: list) -> dict:
+    return {
+        "median_ms": round(statistics.median(values), 1),
+        "min_ms": round(min(values), 1),
+        "max_ms": round(max(values), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modules", nargs="+", default=["app.main", "app.base.process_user_message"])
+    parser.add_argument("--path", default="/ready", help="first request, /ready is only served once warmed up")
+    parser.add_argument("--skip-server", action="store_true", help="only measure the import times")
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules:
+        runs = [measure_import(module) for _ in range(args.runs)]
+        results[module] = {
+            **_get_summary([_run["import_ms"] for _run in runs]),
+            "heavy_modules_loaded": runs[-1]["loaded"],
+        }
+    if not args.skip_server:
+        results["first_request"] = _get_summary([measure_first_request(args.path) for _ in range(args.runs)])
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,14 @@ from app.utils.data_string_utils import pretty_print_df
 import json
 
 from gcp.base_client import BaseClient
+from gcp.client_registry import client_registry
 
 
 class BigQueryClient(BaseClient):
-    def __init__(self, project_id: str = None):
-        super().__init__(project_id)
-        self.bq_client = bigquery.Client()
+    @property
+    def bq_client(self) -> bigquery.Client:
+        # shared by all instances for the project, created on first use
+        return client_registry.get_bigquery_client(self.project_id)
 
     def get_dataset_tables_list(
         self, dataset_name: str, stdout_print: bool = True
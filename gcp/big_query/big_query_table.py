@@ -1,17 +1,21 @@
 """
 class to abstract interactions with BigQuery Tables
 """
+from __future__ import annotations
+
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
 from gcp.big_query.big_query_client import BigQueryClient
 from app.utils.data_string_utils import pretty_print_df
-from app.utils.gbq_utils import get_gbq_schema_from_json
+from app.utils.gbq_utils import get_mapping_entry
 from app.models.models import GbqUploadResults
 from dotenv import load_dotenv
-from typing import Union
-import pandas as pd
+from typing import TYPE_CHECKING, Union
 import json
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 class BigQueryTable(BigQueryClient):
     def __init__(
@@ -21,6 +25,7 @@ class BigQueryTable(BigQueryClient):
             table_name: str,
             p_key: str = None,
             schema_id: str = None,
+            schema: list = None,
     ):
         super().__init__(project_id=project_id)
         load_dotenv()
@@ -30,12 +35,11 @@ class BigQueryTable(BigQueryClient):
         self.p_key = p_key
         self.exists = self.check_exists()
         self.highest_pkey_value = self.get_highest_pkey_value() if self.exists else None
-        self.schema = (
-                get_gbq_schema_from_json(
-                    table_name_key=self.table_name, schema_name_key=schema_id
-                )
-                or None
+        # a schema passed explicitly takes precedence over the mapping config file
+        self.mapping = None if schema else get_mapping_entry(
+            table_name_key=self.table_name, schema_name_key=schema_id
         )
+        self.schema = schema or (list(self.mapping.schema_fields) if self.mapping else None) or None
 
     def create(self) -> None:
         """
@@ -190,6 +194,8 @@ class BigQueryTable(BigQueryClient):
         :param data_json:
         :return:
         """
+        import pandas as pd
+
         job_config = self.get_load_job_config(source="json")
         if isinstance(data_json, dict):
             df = pd.DataFrame([data_json])
@@ -256,6 +262,9 @@ class BigQueryTable(BigQueryClient):
             source_format = bigquery.SourceFormat.CSV
         else:
             source_format = None
+        if self.mapping is not None and self.schema == self.mapping.schema_fields:
+            # a copy of the template built once per mapping and source
+            return self.mapping.get_load_job_config(source)
         if self.schema:
             return bigquery.LoadJobConfig(
                 autodetect=False,
@@ -2,12 +2,16 @@
 class to upload data to BigQuery
 """
 from __future__ import annotations
+from typing import TYPE_CHECKING
+
 from gcp.big_query.big_query_table import BigQueryTable
-import pandas as pd
 from app.utils.data_type_utils import (
     fix_special_characters_in_json_keys,
 )
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 class BigQueryUploader(BigQueryTable):
     def __init__(
@@ -35,6 +39,8 @@ class BigQueryUploader(BigQueryTable):
 
         :return:
         """
+        import pandas as pd
+
         upload_results = {"table_id": self.table_id}
         try:
             if isinstance(self.data_to_upload, dict):
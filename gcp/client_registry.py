@@ -0,0 +1,74 @@
+"""
+process-wide registry of GCP API clients, each created once per project and credentials on first use
+"""
+import os
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from app.utils.metrics_utils import metrics
+
+
+class ClientRegistry:
+    """
+    creating a client sets up authentication and a connection pool, so clients are shared by all BaseClient
+    instances instead of being created per instance. Clients are keyed by kind, project and the credentials file
+    (GOOGLE_APPLICATION_CREDENTIALS) at the time of the request. The google-cloud clients are safe to be used from
+    several threads, the registry makes sure each is only created once even if requested concurrently.
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, Optional[str], Optional[str]], object] = {}
+        self._locks: Dict[Tuple[str, Optional[str], Optional[str]], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, project_id: Optional[str], create_client: Callable[[], object]):
+        """
+        the client of kind for project_id, created with create_client() if there is none yet
+        :param kind: str | e.g. bigquery, storage
+        :param project_id: str | None for clients that are not bound to a project
+        :param create_client: callable without arguments, returning a new client
+        :return: client
+        """
+        key = (kind, project_id, os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
+        if (client := self._clients.get(key)) is not None:
+            return client
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        # one lock per client, so that creating a client does not block getting the others
+        with lock:
+            if (client := self._clients.get(key)) is None:
+                client = self._clients[key] = create_client()
+                metrics.incr(f"gcp.clients.{kind}.created")
+        return client
+
+    def get_bigquery_client(self, project_id: str = None):
+        from google.cloud import bigquery
+
+        return self.get("bigquery", project_id, lambda: bigquery.Client(project=project_id))
+
+    def get_storage_client(self, project_id: str = None):
+        from google.cloud import storage
+
+        return self.get("storage", project_id, lambda: storage.Client(project=project_id))
+
+    def get_secret_manager_client(self):
+        from google.cloud import secretmanager
+
+        # the project is part of the secret names, not of the client
+        return self.get("secretmanager", None, secretmanager.SecretManagerServiceClient)
+
+    def get_logging_client(self, project_id: str = None):
+        import google.cloud.logging
+
+        return self.get("logging", project_id, lambda: google.cloud.logging.Client(project=project_id))
+
+    def clear(self) -> None:
+        """
+        forget all clients, e.g. after the credentials were rotated in place
+        """
+        with self._lock:
+            self._clients.clear()
+            self._locks.clear()
+
+
+client_registry = ClientRegistry()
@@ -1,17 +1,28 @@
 # set up the Google Cloud Logging python client library
 # use Python’s standard logging library to send logs to GCP
 import logging
+import threading
 
-import google.cloud.logging
+from gcp.client_registry import client_registry
 
 
 class CloudLogger:
+    # the cloud handler is attached to the root logger once per process, not per message
+    _setup_lock = threading.Lock()
+    _is_setup = False
+
     def __init__(self, msg: str, level: str = None):
-        client = google.cloud.logging.Client()
-        client.setup_logging()
+        self._setup_logging()
         if level == "warn":
             logging.warning(msg)
         elif level == "error":
             logging.error(msg)
         else:
             logging.info(msg)
+
+    @classmethod
+    def _setup_logging(cls) -> None:
+        with cls._setup_lock:
+            if not cls._is_setup:
+                client_registry.get_logging_client().setup_logging()
+                cls._is_setup = True
@@ -3,6 +3,7 @@ class to use Google Cloud Storage APIs
 """
 
 from gcp.base_client import BaseClient
+from gcp.client_registry import client_registry
 from app.models.models import GcsUploadResults, GcpResponse
 from google.cloud import storage
 import os
@@ -13,9 +14,10 @@ from typing import Union, List
 
 
 class StorageManager(BaseClient):
-    def __init__(self, project_id: str = None):
-        super().__init__(project_id)
-        self.gcs_client = storage.Client()
+    @property
+    def gcs_client(self) -> storage.Client:
+        # shared by all instances for the project, created on first use
+        return client_registry.get_storage_client(self.project_id)
 
     def list_buckets(self) -> list:
         """
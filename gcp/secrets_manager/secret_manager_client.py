@@ -7,13 +7,14 @@ from google.api_core import exceptions
 from google.cloud import secretmanager
 
 from gcp.base_client import BaseClient
+from gcp.client_registry import client_registry
 
 
 class SecretsManagerClient(BaseClient):
-    def __init__(self, project_id: str = None):
-        super().__init__(project_id=project_id)
-        # Create the Secret Manager client.
-        self.sm_client = secretmanager.SecretManagerServiceClient()
+    @property
+    def sm_client(self) -> secretmanager.SecretManagerServiceClient:
+        # Secret Manager client shared by all instances, created on first use.
+        return client_registry.get_secret_manager_client()
 
     def create_secret(self, secret_id: str) -> secretmanager.Secret:
         """
@@ -0,0 +1,32 @@
+"""
+answers of the answer store are on the allow-list of the moderation, and leave it once their product changed
+"""
+import asyncio
+
+from app.base import answer_store as answer_store_module
+from app.base.answer_store import AnswerStore
+from app.base.catalog import CatalogIndex
+from app.base.moderation import moderator
+
+PRODUCT = {"name": "GameSphere X", "category": "Gaming Consoles and Accessories", "price": 499.99}
+
+
+def test_rendered_answers_pass_moderation_without_a_remote_call(monkeypatch):
+    catalog = CatalogIndex({"GameSphere X": PRODUCT})
+    monkeypatch.setattr(answer_store_module, "get_catalog_index", lambda: catalog)
+    answer = AnswerStore(max_words=20).lookup("How much is the GameSphere X?")
+    assert answer
+    assert moderator.decide_locally(answer) == {"flagged": False, "source": "allowlist"}
+    assert asyncio.run(moderator.amoderate(answer))["source"] == "allowlist"
+
+
+def test_answers_of_changed_products_leave_the_allow_list(monkeypatch):
+    store = AnswerStore(max_words=20)
+    catalog = CatalogIndex({"GameSphere X": PRODUCT})
+    monkeypatch.setattr(answer_store_module, "get_catalog_index", lambda: catalog)
+    old_answer = store.lookup("How much is the GameSphere X?")
+    catalog = CatalogIndex({"GameSphere X": {**PRODUCT, "price": 449.99}})
+    new_answer = store.lookup("How much is the GameSphere X?")
+    assert new_answer != old_answer
+    assert moderator.decide_locally(new_answer)["source"] == "allowlist"
+    assert (moderator.decide_locally(old_answer) or {}).get("source") != "allowlist"
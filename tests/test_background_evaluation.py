@@ -0,0 +1,53 @@
+"""
+with CHAT_EVALUATION_MODE=background, answers are only cached once the background evaluation approved them
+"""
+import asyncio
+
+import pytest
+
+from app.base import process_user_message as pum
+from app.base.near_duplicate_cache import NearDuplicateCache
+from app.config.settings import get_settings
+from app.utils.task_queue import background_tasks
+
+QUESTION = "Which accessories would you recommend for a new console?"
+
+
+@pytest.fixture
+def turn(monkeypatch):
+    monkeypatch.setattr(get_settings(), "chat_evaluation_mode", "background")
+    monkeypatch.setattr(pum, "answer_cache", NearDuplicateCache("test", 0.9, 100, 3600))
+
+    async def _moderate(text):
+        return {"flagged": False}
+
+    async def _find_products(user_input, deadline, debug, batch=None):
+        return []
+
+    monkeypatch.setattr(pum.moderator, "amoderate", _moderate)
+    monkeypatch.setattr(pum, "afind_products", _find_products)
+
+    def _run(verdict):
+        async def _complete(messages, timeout=None, **kwargs):
+            return verdict if "sufficiently answer" in messages[-1]["content"] else "A controller."
+
+        monkeypatch.setattr(pum.GenerateResponse, "aget_completion_from_messages", _complete)
+
+        async def _turn():
+            response, _ = await pum.aprocess_user_message(QUESTION, [], debug=False)
+            await background_tasks.drain(timeout=5)
+            return response
+
+        return asyncio.run(_turn())
+
+    return _run
+
+
+def test_rejected_answer_is_not_cached(turn):
+    assert turn("N") == "A controller."
+    assert len(pum.answer_cache) == 0
+
+
+def test_approved_answer_is_cached(turn):
+    assert turn("Y") == "A controller."
+    assert len(pum.answer_cache) == 1
@@ -0,0 +1,64 @@
+"""
+the catalog is read again once its file changed, and the answer store follows the new product versions
+"""
+import json
+import os
+
+import pytest
+
+from app.base import answer_store as answer_store_module
+from app.base.answer_store import AnswerStore
+from app.base.catalog import CatalogLoader
+
+PRODUCTS = {
+    "GameSphere X": {"name": "GameSphere X", "category": "Gaming Consoles and Accessories", "price": 499.99},
+    "GameSphere Y": {"name": "GameSphere Y", "category": "Gaming Consoles and Accessories", "price": 399.99},
+}
+
+
+def _write(path, products: dict, mtime_ns: int) -> None:
+    path.write_text(json.dumps(products), encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def products_file(tmp_path):
+    path = tmp_path / "products.json"
+    _write(path, PRODUCTS, 1_000_000_000)
+    return path
+
+
+def test_changed_file_bumps_the_versions_of_changed_products(products_file):
+    loader = CatalogLoader(str(products_file))
+    catalog = loader.get()
+    assert loader.get() is catalog
+    _write(products_file, {**PRODUCTS, "GameSphere X": {**PRODUCTS["GameSphere X"], "price": 449.99}}, 2_000_000_000)
+    reloaded = loader.get()
+    assert reloaded.version != catalog.version
+    assert reloaded.product_versions["GameSphere X"] != catalog.product_versions["GameSphere X"]
+    assert reloaded.product_versions["GameSphere Y"] == catalog.product_versions["GameSphere Y"]
+
+
+def test_file_is_only_checked_every_interval(products_file):
+    loader = CatalogLoader(str(products_file), check_interval_s=3600)
+    catalog = loader.get()
+    _write(products_file, {"GameSphere Y": PRODUCTS["GameSphere Y"]}, 2_000_000_000)
+    assert loader.get() is catalog
+    assert "GameSphere X" not in loader.reload().products
+
+
+def test_unreadable_file_keeps_the_previous_catalog(products_file):
+    loader = CatalogLoader(str(products_file))
+    catalog = loader.get()
+    products_file.write_text("{not json", encoding="utf-8")
+    os.utime(products_file, ns=(2_000_000_000, 2_000_000_000))
+    assert loader.get() is catalog
+
+
+def test_answer_store_follows_the_reloaded_catalog(products_file, monkeypatch):
+    loader = CatalogLoader(str(products_file))
+    monkeypatch.setattr(answer_store_module, "get_catalog_index", loader.get)
+    store = AnswerStore(max_words=20)
+    assert "499.99" in store.lookup("How much is the GameSphere X?")
+    _write(products_file, {**PRODUCTS, "GameSphere X": {**PRODUCTS["GameSphere X"], "price": 449.99}}, 2_000_000_000)
+    assert "449.99" in store.lookup("How much is the GameSphere X?")
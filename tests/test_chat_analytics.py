@@ -0,0 +1,57 @@
+"""
+analytics rows of a failed load are spilled to disk and loaded again after the next successful flush
+"""
+import asyncio
+import os
+
+from app.base.chat_analytics import AnalyticsSink
+
+
+def _get_sink(spill_dir) -> AnalyticsSink:
+    return AnalyticsSink(
+        dataset_name="analytics",
+        table_name="chat_turns",
+        flush_size=100,
+        flush_interval_s=60,
+        max_buffer=1000,
+        spill_dir=str(spill_dir),
+    )
+
+
+def test_failed_load_is_spilled_and_loaded_on_next_flush(tmp_path, caplog):
+    sink = _get_sink(tmp_path / "spill")
+    loaded = []
+    failing = [True]
+
+    def _load(rows):
+        if failing[0]:
+            raise RuntimeError("bigquery unreachable")
+        loaded.append(list(rows))
+
+    sink._load = _load
+    sink._buffer.extend([{"turn_id": "1"}, {"turn_id": "2"}])
+    with caplog.at_level("WARNING", logger="app.base.chat_analytics"):
+        asyncio.run(sink.flush())
+    assert "Loading 2 analytics rows failed, spilling to disk: bigquery unreachable" in caplog.text
+    assert len(os.listdir(tmp_path / "spill")) == 1
+    assert loaded == []
+
+    failing[0] = False
+    sink._buffer.append({"turn_id": "3"})
+    asyncio.run(sink.flush())
+    assert loaded == [[{"turn_id": "3"}], [{"turn_id": "1"}, {"turn_id": "2"}]]
+    assert os.listdir(tmp_path / "spill") == []
+
+
+def test_failed_reload_keeps_the_spilled_rows(tmp_path, caplog):
+    sink = _get_sink(tmp_path)
+    sink._spill([{"turn_id": "1"}])
+
+    def _load(rows):
+        raise RuntimeError("still unreachable")
+
+    sink._load = _load
+    with caplog.at_level("WARNING", logger="app.base.chat_analytics"):
+        sink._load_spilled()
+    assert "retrying after the next flush: still unreachable" in caplog.text
+    assert len(os.listdir(tmp_path)) == 1
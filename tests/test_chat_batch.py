@@ -0,0 +1,40 @@
+"""
+/chat/batch request validation and bounded concurrency of ChatBatch
+"""
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+from app.base import chat_batch
+from app.base.chat_batch import ChatBatch
+from app.models.models import ChatBatchRequest
+
+
+@pytest.mark.parametrize("concurrency", [0, -1])
+def test_request_rejects_concurrency_below_one(concurrency):
+    with pytest.raises(ValidationError):
+        ChatBatchRequest(messages=[{"message": "hi"}], concurrency=concurrency)
+
+
+def test_request_accepts_missing_concurrency():
+    assert ChatBatchRequest(messages=[{"message": "hi"}]).concurrency is None
+
+
+def test_batch_runs_with_negative_concurrency(monkeypatch):
+    async def _moderate_many(texts, batch_size):
+        raise RuntimeError("moderation down")
+
+    async def _process(user_input, messages, debug=False, deadline=None, batch=None):
+        return f"answer to {user_input}", []
+
+    monkeypatch.setattr(chat_batch.moderator, "amoderate_many", _moderate_many)
+    monkeypatch.setattr(chat_batch, "aprocess_user_message", _process)
+
+    async def _run():
+        batch = ChatBatch([{"message": "a"}, {"message": "b"}], concurrency=-3)
+        assert batch.concurrency == 1
+        return [_result async for _result in batch.run()]
+
+    results = asyncio.run(_run())
+    assert sorted(_result["response"] for _result in results) == ["answer to a", "answer to b"]
@@ -0,0 +1,66 @@
+"""
+the admission slot of a /chat/batch request is released however the request ends
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+
+
+@pytest.fixture
+def client():
+    # without the with-block, startup (warmup) does not run
+    return TestClient(main.app, raise_server_exceptions=False)
+
+
+def _post_batch(client):
+    return client.post("/chat/batch", json={"messages": [{"message": "hi"}, {"message": "ho"}]})
+
+
+def test_slot_is_released_when_the_batch_cannot_be_created(client, monkeypatch):
+    def _fail(**kwargs):
+        raise RuntimeError("bad batch")
+
+    monkeypatch.setattr(main, "ChatBatch", _fail)
+    assert _post_batch(client).status_code == 500
+    assert main.admission_controller.in_flight == 0
+
+
+def test_slot_is_released_when_the_stream_fails(client, monkeypatch):
+    class _FailingBatch:
+        def __init__(self, **kwargs):
+            pass
+
+        async def run(self):
+            yield {"index": 0, "response": "first"}
+            raise RuntimeError("upstream broke mid-stream")
+
+    monkeypatch.setattr(main, "ChatBatch", _FailingBatch)
+    _post_batch(client)
+    assert main.admission_controller.in_flight == 0
+
+
+def test_slot_is_released_after_the_stream(client, monkeypatch):
+    class _Batch:
+        def __init__(self, **kwargs):
+            pass
+
+        async def run(self):
+            yield {"index": 0, "response": "first"}
+
+    monkeypatch.setattr(main, "ChatBatch", _Batch)
+    response = _post_batch(client)
+    assert response.status_code == 200
+    assert response.text == '{"index": 0, "response": "first"}\n'
+    assert main.admission_controller.in_flight == 0
+
+
+def test_batch_with_too_many_turns_is_rejected(client, monkeypatch):
+    def _fail(**kwargs):
+        raise AssertionError("the batch must not be created")
+
+    monkeypatch.setattr(main, "ChatBatch", _fail)
+    max_turns = main.get_settings().chat_batch_max_turns
+    response = client.post("/chat/batch", json={"messages": [{"message": "hi"}] * (max_turns + 1)})
+    assert response.status_code == 422
+    assert main.admission_controller.in_flight == 0
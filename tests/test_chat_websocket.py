@@ -0,0 +1,67 @@
+"""
+malformed and failing turns on the chat websocket
+"""
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app import main
+from app.base import chat_websocket
+
+
+@pytest.fixture
+def client():
+    # without the with-block, startup (warmup) does not run
+    return TestClient(main.app, raise_server_exceptions=False)
+
+
+@pytest.fixture
+def turns(monkeypatch):
+    calls = []
+
+    async def _turn(conversation, message, deadline=None, on_token=None):
+        calls.append(message)
+        if message == "fail":
+            raise RuntimeError("upstream broke")
+        await on_token(message)
+        return message, []
+
+    monkeypatch.setattr(chat_websocket, "aprocess_conversation_turn", _turn)
+    return calls
+
+
+def test_frame_without_message_is_answered_with_an_error(client, turns):
+    with client.websocket_connect("/ws/chat/ws-missing") as websocket:
+        websocket.send_json({"deadline_ms": 1000})
+        error = websocket.receive_json()
+        assert error["type"] == "error"
+        assert error["status_code"] == 422
+        # the connection is still usable
+        websocket.send_json({"message": "hello"})
+        assert websocket.receive_json() == {"type": "token", "content": "hello"}
+        assert websocket.receive_json()["type"] == "final"
+    assert turns == ["hello"]
+
+
+def test_failing_turn_is_answered_with_an_error(client, turns):
+    with client.websocket_connect("/ws/chat/ws-fail") as websocket:
+        websocket.send_json({"message": "fail"})
+        error = websocket.receive_json()
+        assert error["type"] == "error"
+        assert error["status_code"] == 500
+        websocket.send_json({"message": "hello"})
+        assert websocket.receive_json()["type"] == "token"
+        assert websocket.receive_json()["response"] == "hello"
+    assert main.admission_controller.in_flight == 0
+
+
+def test_invalid_json_closes_the_connection(client, turns):
+    with client.websocket_connect("/ws/chat/ws-invalid") as websocket:
+        websocket.send_text("{not json")
+        error = websocket.receive_json()
+        assert error["type"] == "error"
+        assert error["status_code"] == 400
+        with pytest.raises(WebSocketDisconnect) as disconnect:
+            websocket.receive_json()
+        assert disconnect.value.code == chat_websocket.CLOSE_UNSUPPORTED_DATA
+    assert turns == []
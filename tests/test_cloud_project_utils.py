@@ -0,0 +1,48 @@
+"""
+the project id is resolved once per process, a failed resolution is kept until the retry interval passed
+"""
+import pytest
+
+from app.utils import cloud_project_utils
+from app.utils.cloud_project_utils import PROJECT_ID_ENV_VARS, CloudProjectUtils
+
+
+@pytest.fixture
+def metadata_calls(monkeypatch):
+    for name in PROJECT_ID_ENV_VARS + ("GOOGLE_APPLICATION_CREDENTIALS", "RUN_ENV"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(CloudProjectUtils, "_resolved", None)
+    monkeypatch.setattr(CloudProjectUtils, "_failed", None)
+    monkeypatch.setattr(CloudProjectUtils, "_failed_until", 0.0)
+    calls = []
+
+    def _get_project_id_from_gcp(timeout=1.0):
+        calls.append(timeout)
+        return None
+
+    monkeypatch.setattr(CloudProjectUtils, "get_project_id_from_gcp", staticmethod(_get_project_id_from_gcp))
+    return calls
+
+
+def test_failed_resolution_is_kept_until_the_retry_interval_passed(metadata_calls, monkeypatch):
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            CloudProjectUtils().get_project_id_and_secrets_env()
+    assert len(metadata_calls) == 1
+    with pytest.raises(ValueError):
+        CloudProjectUtils().get_project_id_and_secrets_env(refresh=True)
+    assert len(metadata_calls) == 2
+    monkeypatch.setattr(cloud_project_utils.time, "monotonic", lambda: CloudProjectUtils._failed_until + 1)
+    with pytest.raises(ValueError):
+        CloudProjectUtils().get_project_id_and_secrets_env()
+    assert len(metadata_calls) == 3
+
+
+def test_resolved_project_id_replaces_a_failed_resolution(metadata_calls, monkeypatch):
+    with pytest.raises(ValueError):
+        CloudProjectUtils().get_project_id_and_secrets_env()
+    monkeypatch.setenv("GOOGLE_CLOUD_PROJECT", "my-project")
+    assert CloudProjectUtils().get_project_id_and_secrets_env(refresh=True)["project_id"] == "my-project"
+    monkeypatch.delenv("GOOGLE_CLOUD_PROJECT")
+    assert CloudProjectUtils().get_project_id_and_secrets_env()["source"] == "env"
+    assert len(metadata_calls) == 1
@@ -0,0 +1,155 @@
+"""
+column-wise casts of the transformer give the same rows as the per-record casts
+"""
+import random
+
+import pytest
+
+pytest.importorskip("pandas")
+
+from app.data.data_transformer import column_casters  # noqa: E402
+from app.data.data_transformer.mapping_plan import MappingPlan  # noqa: E402
+
+SCHEMA = {
+    "ts": "ts:TIMESTAMP",
+    "day": "day:DATE",
+    "price": "price:FLOAT64",
+    "count": "count:INT64",
+    "flag": "flag:BOOL",
+    "payload": "payload:JSON",
+    "name": "name",
+}
+TIMESTAMPS = [
+    "2020-01-01 10:00:00",
+    "2020-01-01T10:00:00+02:00",
+    "2020-01-01T10:00:00Z",
+    "2020-01-02 10:00",
+    "2020-1-2 3:04:05",
+    "2020 01 02 03 04 05",
+    "2020 01 02 03 04 05 123",
+    "2020-01-02 03:04:05 UTC",
+    "2020-01-02",
+    "not a timestamp",
+    1577872800000,
+    1577872800000.5,
+    # the NaT sentinel of pandas
+    -2 ** 63,
+    None,
+]
+DAYS = [
+    "2020-01-02", "2020-01-02T10:00:00Z", "2020-1-2", "2020-01-02 03:04:05", "bad", 1577872800000, -2 ** 63, True, None,
+]
+PRICES = [
+    "123456789.123456789",
+    "3.14159265358979323846",
+    " 1.5 ",
+    "1e3",
+    "nan",
+    "abc",
+    1,
+    2.5,
+    True,
+    2 ** 70,
+    [1],
+    None,
+]
+COUNTS = ["5", " 7", "5.0", "1e3", "12345678901234567890123", 1.9, -3, True, "x", {"a": 1}, None]
+FLAGS = [0, 1, 2, True, "true", None]
+PAYLOADS = [{"a": [1, 2]}, [1], "s", 1.5, {1, 2}, None]
+NAMES = ["a", 1, {"k": 1}, [1], None]
+
+
+def _get_records(n: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [
+        {
+            "ts": rng.choice(TIMESTAMPS),
+            "day": rng.choice(DAYS),
+            "price": rng.choice(PRICES),
+            "count": rng.choice(COUNTS),
+            "flag": rng.choice(FLAGS),
+            "payload": rng.choice(PAYLOADS),
+            "name": rng.choice(NAMES),
+        }
+        for _ in range(n)
+    ]
+
+
+def _normalize(rows: list) -> list:
+    # nan != nan, float("nan") is a valid FLOAT64 value
+    return [{_key: "nan" if _value != _value else _value for _key, _value in _row.items()} for _row in rows]
+
+
+def _apply_rows(plan: MappingPlan, records: list) -> tuple:
+    errors = []
+    return [plan.apply(_record, {}, on_error=errors.append) for _record in records], errors
+
+
+def _apply_columnar(plan: MappingPlan, records: list) -> tuple:
+    errors = []
+    return plan.apply_columnar(records, {}, on_error=errors.append), errors
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_columnar_matches_rows_on_mixed_values(seed):
+    plan = MappingPlan(SCHEMA, split_json_by_dot=False)
+    records = _get_records(500, seed)
+    rows, row_errors = _apply_rows(plan, records)
+    columnar_rows, columnar_errors = _apply_columnar(plan, records)
+    assert _normalize(columnar_rows) == _normalize(rows)
+    assert len(columnar_errors) == len(row_errors)
+
+
+def test_columnar_reports_nat_sentinel_epochs_like_rows():
+    plan = MappingPlan({"ts": "ts:TIMESTAMP"}, split_json_by_dot=False)
+    records = [{"ts": 1577872800000}, {"ts": -2 ** 63}]
+    rows, row_errors = _apply_rows(plan, records)
+    columnar_rows, columnar_errors = _apply_columnar(plan, records)
+    assert columnar_rows == rows
+    assert columnar_rows[1]["ts"] is None
+    assert len(columnar_errors) == len(row_errors) == 1
+
+
+def test_columnar_keeps_rows_with_offset_timestamps_in_a_column():
+    # pandas reads the offset value tz-aware, which must not cost the other rows
+    plan = MappingPlan({"ts": "ts:TIMESTAMP", "day": "day:DATE"}, split_json_by_dot=False)
+    records = [{"ts": "2020-01-01 10:00:00", "day": "2020-01-02"}] * 1500 + [
+        {"ts": "2020-01-01T10:00:00+02:00", "day": "2020-01-02T10:00:00Z"}
+    ]
+    columnar_rows, _ = _apply_columnar(plan, records)
+    assert len(columnar_rows) == 1501
+    assert columnar_rows == _apply_rows(plan, records)[0]
+
+
+def test_columnar_floats_round_trip_like_float():
+    plan = MappingPlan({"price": "price:FLOAT64"}, split_json_by_dot=False)
+    records = [{"price": "123456789.123456789"}, {"price": "3.14159265358979323846"}]
+    assert [_row["price"] for _row in _apply_columnar(plan, records)[0]] == [
+        float("123456789.123456789"),
+        float("3.14159265358979323846"),
+    ]
+
+
+def test_columnar_reports_errors_per_row():
+    plan = MappingPlan({"count": "count:INT64"}, split_json_by_dot=False)
+    columnar_rows, errors = _apply_columnar(plan, [{"count": "1"}, {"count": "x"}, {"count": "3"}])
+    assert columnar_rows == [{"count": 1}, {"count": None}, {"count": 3}]
+    assert len(errors) == 1 and "row 1" in errors[0]
+
+
+def test_failing_column_cast_falls_back_to_each_value(monkeypatch):
+    def _fail(values, cast, stats):
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setitem(column_casters.COLUMN_CASTERS, "FLOAT64", _fail)
+    plan = MappingPlan({"price": "price:FLOAT64"}, split_json_by_dot=False)
+    records = [{"price": "1.5"}, {"price": None}, {"price": 2}]
+    assert _apply_columnar(plan, records)[0] == _apply_rows(plan, records)[0]
+
+
+def test_columnar_reports_timestamp_outliers(caplog):
+    plan = MappingPlan({"ts": "ts:TIMESTAMP"}, split_json_by_dot=False)
+    records = [{"ts": "2020-01-01 10:00:00"}] * 200 + [{"ts": "2020-01-01T10:00:00Z"}] * 3
+    with caplog.at_level("INFO", logger="app.data.data_transformer.mapping_plan"):
+        _apply_columnar(plan, records)
+    assert "ts: 3 of 203 values not in the inferred format(s) ['%Y-%m-%d %H:%M:%S']" in caplog.text
@@ -0,0 +1,60 @@
+"""
+streamed transformations give the same records as transformations of the whole input
+"""
+import json
+
+import pytest
+
+pytest.importorskip("pandas")
+
+from app.data.data_transformer.data_transformer import DataTransformer  # noqa: E402
+from app.data.data_transformer.mapping_registry import mapping_registry  # noqa: E402
+
+MAPPING = {
+    "db_col_to_json_mapping": {
+        "id": "id:INT64",
+        "price": "price:FLOAT64",
+        "created_at": "created_at:TIMESTAMP",
+        "account_id": "${getAccountId}",
+    },
+    "json_data_config": {"data_envelope": ["report", "rows"], "primary_key": "id"},
+    "special_mapping": [],
+}
+
+
+@pytest.fixture
+def mapping_file(tmp_path, monkeypatch):
+    path = tmp_path / "json_key_mapping.json"
+    all_data_mapping = json.loads(json.dumps(MAPPING))
+    all_data_mapping["db_col_to_json_mapping"]["raw"] = "${getAllData}"
+    path.write_text(json.dumps({"report": MAPPING, "report_all_data": all_data_mapping}), encoding="utf-8")
+    monkeypatch.setattr(mapping_registry, "_file_path", str(path))
+    monkeypatch.setattr(mapping_registry, "_stat_signature", None)
+    monkeypatch.setattr(mapping_registry, "_content_hash", None)
+    return path
+
+
+@pytest.fixture
+def report_file(tmp_path):
+    rows = [
+        {"id": str(_id), "price": f"{_id}.25", "created_at": f"2020-01-01 10:{_id % 60:02d}:00"}
+        for _id in range(2500)
+    ]
+    path = tmp_path / "report.json"
+    path.write_text(json.dumps({"meta": {"rows": 2500}, "report": {"rows": rows}}), encoding="utf-8")
+    return path
+
+
+def test_streamed_chunks_match_whole_transformation(mapping_file, report_file):
+    whole = DataTransformer(account_id="acc").get_transformed_data("report", file_path=str(report_file))
+    chunks = list(
+        DataTransformer(account_id="acc").iter_transformed_data("report", file_path=str(report_file), chunk_size=1000)
+    )
+    assert [len(_chunk) for _chunk in chunks] == [1000, 1000, 500]
+    assert [_record for _chunk in chunks for _record in _chunk] == whole
+    assert whole[1] == {"id": 1, "price": 1.25, "created_at": "2020-01-01T10:01:00+00:00", "account_id": "acc"}
+
+
+def test_streaming_rejects_all_data_mappings(mapping_file, report_file):
+    with pytest.raises(ValueError):
+        next(DataTransformer().iter_transformed_data("report_all_data", file_path=str(report_file)))
@@ -0,0 +1,73 @@
+"""
+incremental reading of json files down to the data envelope
+"""
+import io
+import json
+import random
+
+import pytest
+
+from app.utils.json_stream_utils import JsonStreamReader, iter_json_records
+
+
+def _get_records(n: int = 300) -> list:
+    rng = random.Random(0)
+    return [
+        {
+            "id": _id,
+            "price": rng.random() * 1e6,
+            "text": 'quote " bracket ] brace } \\u00e9 ' * rng.randint(0, 3) + "é",
+            "nested": [1, {"a": None, "b": [True, False]}],
+            "big": 12345678901234567890,
+            "exp": -1.5e-7,
+        }
+        for _id in range(n)
+    ]
+
+
+def _write(tmp_path, data) -> str:
+    path = tmp_path / "data.json"
+    path.write_text(json.dumps(data, indent=1), encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_records_in_data_envelope(tmp_path, read_size):
+    records = _get_records()
+    path = _write(tmp_path, {"meta": {"skip": [1, {"items": "no"}], "n": 1.25}, "data": {"items": records, "n": 1}})
+    assert list(iter_json_records(path, ["data", "items"], read_size)) == records
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 5])
+def test_top_level_array_of_numbers(tmp_path, read_size):
+    numbers = [1, 22, 333, 1.5, -2.25, 1e-05, 123456789012345678901234, 0, -0.0]
+    path = _write(tmp_path, numbers)
+    assert list(iter_json_records(path, None, read_size)) == numbers
+
+
+def test_object_envelope_is_one_record(tmp_path):
+    path = _write(tmp_path, {"data": {"id": 1}})
+    assert list(iter_json_records(path, ["data"], 2)) == [{"id": 1}]
+
+
+def test_missing_envelope_has_no_records(tmp_path):
+    path = _write(tmp_path, {"data": [{"id": 1}]})
+    assert list(iter_json_records(path, ["other"], 2)) == []
+
+
+def test_unterminated_array_raises(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text("[1, 22, 333", encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_json_records(str(path), None, 2))
+
+
+def test_malformed_record_fails_without_reading_the_rest():
+    content = '[{"id": 1}, {"id": 2,, "x": 1}, ' + ", ".join(['{"id": 3}'] * 10000) + "]"
+    fp = io.StringIO(content)
+    reader = JsonStreamReader(fp, read_size=64)
+    items = reader.iter_items()
+    assert next(items) == {"id": 1}
+    with pytest.raises(json.JSONDecodeError):
+        next(items)
+    assert fp.tell() < 1024
@@ -0,0 +1,29 @@
+"""
+warmup of a worker: failed required steps keep it from being ready, failures are logged
+"""
+import asyncio
+
+from app.utils.lifecycle import FAILED, READY, Lifecycle
+
+
+def _fail():
+    raise RuntimeError("no api key")
+
+
+def test_failed_required_step_is_logged_and_fails_the_warmup(caplog):
+    lifecycle = Lifecycle(warmup_timeout_s=5)
+    lifecycle.add_warmup_step("openai", _fail)
+    lifecycle.add_warmup_step("catalog", lambda: None)
+    with caplog.at_level("WARNING", logger="app.utils.lifecycle"):
+        asyncio.run(lifecycle.warmup())
+    assert lifecycle.state == FAILED
+    assert lifecycle.get_status()["steps"]["openai"]["error"] == "no api key"
+    assert "Warmup step openai failed: no api key" in caplog.text
+    assert "RuntimeError: no api key" in caplog.text
+
+
+def test_failed_optional_step_leaves_the_worker_ready():
+    lifecycle = Lifecycle(warmup_timeout_s=5)
+    lifecycle.add_warmup_step("analytics_table", _fail, required=False)
+    asyncio.run(lifecycle.warmup())
+    assert lifecycle.state == READY
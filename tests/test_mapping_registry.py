@@ -0,0 +1,65 @@
+"""
+mapping config registry: validation, reloading on change and lookups by table or schema name
+"""
+import json
+import os
+
+import pytest
+
+from app.data.data_transformer.mapping_registry import MappingRegistry, mapping_registry
+from app.utils.gbq_utils import get_mapping_entry
+
+MAPPING = {
+    "db_col_to_json_mapping": {"id": "id:INT64", "name": "name:STRING"},
+    "json_data_config": {"data_envelope": "rows"},
+    "special_mapping": [],
+}
+
+
+def _write(path, config: dict, mtime_ns: int = None) -> None:
+    path.write_text(json.dumps(config), encoding="utf-8")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_invalid_mappings_are_logged_and_skipped(tmp_path, caplog):
+    path = tmp_path / "json_key_mapping.json"
+    _write(path, {"GOOD": MAPPING, "BAD": {"db_col_to_json_mapping": {"id": 1}}})
+    registry = MappingRegistry(str(path))
+    with caplog.at_level("WARNING", logger="app.data.data_transformer.mapping_registry"):
+        assert registry.get("BAD") is None
+    assert registry.get("GOOD").db_col_mapping == MAPPING["db_col_to_json_mapping"]
+    assert "Skipping invalid mapping: db_col_to_json_mapping of mapping BAD" in caplog.text
+
+
+def test_config_is_reloaded_only_when_content_changes(tmp_path):
+    path = tmp_path / "json_key_mapping.json"
+    _write(path, {"A": MAPPING}, mtime_ns=1_000_000_000)
+    registry = MappingRegistry(str(path))
+    entry = registry.get("A")
+    # same content, new mtime: the entries are kept
+    _write(path, {"A": MAPPING}, mtime_ns=2_000_000_000)
+    assert registry.get("A") is entry
+    changed = json.loads(json.dumps(MAPPING))
+    changed["db_col_to_json_mapping"]["extra"] = "extra"
+    _write(path, {"A": changed}, mtime_ns=3_000_000_000)
+    assert registry.get("A") is not entry
+    assert "extra" in registry.get("A").db_col_mapping
+
+
+@pytest.fixture
+def registry_file(tmp_path, monkeypatch):
+    path = tmp_path / "json_key_mapping.json"
+    _write(path, {"ORDERS": MAPPING})
+    monkeypatch.setattr(mapping_registry, "_file_path", str(path))
+    monkeypatch.setattr(mapping_registry, "_stat_signature", None)
+    monkeypatch.setattr(mapping_registry, "_content_hash", None)
+    return path
+
+
+def test_mapping_entry_by_table_or_schema_name(registry_file):
+    assert get_mapping_entry("orders").key == "ORDERS"
+    assert get_mapping_entry("unknown", "orders").key == "ORDERS"
+    assert get_mapping_entry(None, "orders").key == "ORDERS"
+    assert get_mapping_entry(None, None) is None
+    assert get_mapping_entry("unknown") is None
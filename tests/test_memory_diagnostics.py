@@ -0,0 +1,28 @@
+"""
+a failing periodic memory snapshot is logged with its traceback and does not stop the snapshots
+"""
+import asyncio
+
+from app.utils.memory_diagnostics import MemoryDiagnostics
+
+
+def test_failed_snapshot_is_logged_and_retried(caplog):
+    diagnostics = MemoryDiagnostics(interval_s=0, frames=1, top_n=5, sample_rate=0.0)
+    attempts = []
+
+    async def _take_snapshot():
+        attempts.append(1)
+        raise RuntimeError("snapshot broke")
+
+    diagnostics.take_snapshot = _take_snapshot
+
+    async def _run():
+        diagnostics.start()
+        while len(attempts) < 2:
+            await asyncio.sleep(0)
+        await diagnostics.stop()
+
+    with caplog.at_level("ERROR", logger="app.utils.memory_diagnostics"):
+        asyncio.run(_run())
+    assert "Memory snapshot failed" in caplog.text
+    assert "RuntimeError: snapshot broke" in caplog.text
@@ -0,0 +1,55 @@
+"""
+streamed segments are only sent once they passed the moderation
+"""
+import asyncio
+
+from app.base.moderated_stream import ModeratedTokenStream
+
+TOKENS = ["Good ", "choice. ", "It is ", "BAD. ", "More ", "text."]
+
+
+def _stream(hold=False, fail=False):
+    sent, checked = [], []
+
+    async def _on_token(segment):
+        sent.append(segment)
+
+    async def _is_flagged(text):
+        checked.append(text)
+        if fail:
+            raise RuntimeError("moderation unavailable")
+        return "BAD" in text
+
+    return ModeratedTokenStream(_on_token, _is_flagged, min_segment_chars=5, hold=hold), sent, checked
+
+
+def _feed(stream, tokens=TOKENS):
+    async def _run():
+        for token in tokens:
+            await stream.add_token(token)
+
+    asyncio.run(_run())
+
+
+def test_flagged_text_is_not_sent():
+    stream, sent, checked = _stream()
+    _feed(stream)
+    asyncio.run(stream.release())
+    assert sent == ["Good choice. "]
+    assert checked == ["Good choice. ", "Good choice. It is BAD. "]
+
+
+def test_held_stream_is_sent_on_release_only():
+    stream, sent, checked = _stream(hold=True)
+    _feed(stream, ["Good ", "choice. ", "More ", "text."])
+    assert sent == [] and checked == []
+    asyncio.run(stream.release())
+    assert "".join(sent) == "Good choice. More text."
+
+
+def test_failed_moderation_holds_back_the_rest():
+    stream, sent, _ = _stream(fail=True)
+    _feed(stream, ["Good ", "choice. ", "More ", "text."])
+    assert sent == []
+    asyncio.run(stream.release())
+    assert "".join(sent) == "Good choice. More text."
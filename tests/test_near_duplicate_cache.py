@@ -0,0 +1,34 @@
+"""
+near-duplicate questions share cached results, questions about different products do not
+"""
+import pytest
+
+from app.base.near_duplicate_cache import NearDuplicateCache
+
+
+@pytest.fixture
+def cache():
+    return NearDuplicateCache("test", threshold=0.5, max_entries=100, ttl_seconds=3600)
+
+
+def test_rephrased_question_hits(cache):
+    cache.put("What is the price of the GameSphere X?", "v1", "answer x")
+    assert cache.get("what's the price of GameSphere X", "v1") == "answer x"
+
+
+def test_questions_about_different_products_do_not_collide(cache):
+    cache.put("What is the price of the GameSphere X?", "v1", "answer x")
+    assert cache.get("What is the price of the GameSphere Y?", "v1") is None
+    cache.put("What is the price of the GameSphere Y?", "v1", "answer y")
+    assert cache.get("What is the price of the GameSphere X?", "v1") == "answer x"
+    assert cache.get("What is the price of the GameSphere Y?", "v1") == "answer y"
+
+
+def test_numbered_products_do_not_collide(cache):
+    cache.put("Does the CineView 4K TV support HDR?", "v1", "answer 4k")
+    assert cache.get("Does the CineView 8K TV support HDR?", "v1") is None
+
+
+def test_scopes_do_not_share_results(cache):
+    cache.put("What is the price of the GameSphere X?", "v1", "answer x")
+    assert cache.get("What is the price of the GameSphere X?", "v2") is None
@@ -0,0 +1,95 @@
+"""
+single-flight coalescing: shared calls, per-caller timeouts and cancellation of single callers
+"""
+import asyncio
+
+import pytest
+
+from app.base import chat_response
+from app.base.chat_response import GenerateResponse, UpstreamTimeout
+from app.utils.single_flight import SingleFlight
+
+
+def _get_call(calls: list, release: asyncio.Event):
+    async def _call():
+        calls.append(1)
+        await release.wait()
+        return "result"
+
+    return _call
+
+
+def test_concurrent_callers_share_one_call():
+    async def _run():
+        flights, calls, release = SingleFlight("test"), [], asyncio.Event()
+        waiters = [asyncio.ensure_future(flights.do("key", _get_call(calls, release))) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*waiters), calls, flights.in_flight()
+
+    results, calls, in_flight = asyncio.run(_run())
+    assert results == ["result"] * 3
+    assert len(calls) == 1
+    assert in_flight == 0
+
+
+def test_cancelled_caller_does_not_cancel_the_call_of_the_others():
+    async def _run():
+        flights, calls, release = SingleFlight("test"), [], asyncio.Event()
+        first = asyncio.ensure_future(flights.do("key", _get_call(calls, release)))
+        second = asyncio.ensure_future(flights.do("key", _get_call(calls, release)))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return first, await second, calls
+
+    first, second_result, calls = asyncio.run(_run())
+    assert first.cancelled()
+    assert second_result == "result"
+    assert len(calls) == 1
+
+
+def test_caller_with_a_larger_timeout_outlasts_the_one_that_started_the_call():
+    async def _run():
+        flights, calls, release = SingleFlight("test"), [], asyncio.Event()
+        short = asyncio.ensure_future(flights.do("key", _get_call(calls, release), timeout=0.01))
+        long = asyncio.ensure_future(flights.do("key", _get_call(calls, release), timeout=5))
+        with pytest.raises(asyncio.TimeoutError):
+            await short
+        release.set()
+        return await long
+
+    assert asyncio.run(_run()) == "result"
+
+
+def test_call_is_cancelled_once_all_callers_are_gone():
+    async def _run():
+        flights, calls, release = SingleFlight("test"), [], asyncio.Event()
+        waiter = asyncio.ensure_future(flights.do("key", _get_call(calls, release)))
+        await asyncio.sleep(0)
+        task = flights._flights["key"].task
+        waiter.cancel()
+        await asyncio.sleep(0)
+        return task
+
+    assert asyncio.run(_run()).cancelled()
+
+
+def test_completion_joiner_keeps_its_own_budget(monkeypatch):
+    async def _create(messages, model, temperature, max_tokens):
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    monkeypatch.setattr(GenerateResponse, "_acreate_completion", staticmethod(_create))
+    messages = [{"role": "user", "content": "hi"}]
+
+    async def _run():
+        short = asyncio.ensure_future(GenerateResponse.aget_completion_from_messages(messages, timeout=0.01))
+        long = asyncio.ensure_future(GenerateResponse.aget_completion_from_messages(messages, timeout=5))
+        with pytest.raises(UpstreamTimeout):
+            await short
+        return await long
+
+    assert asyncio.run(_run()) == "answer"
+    assert chat_response.completion_flights.in_flight() == 0
@@ -0,0 +1,46 @@
+"""
+bounded background task queue: dropping when full, draining on shutdown and reporting failures
+"""
+import asyncio
+
+from app.utils.metrics_utils import metrics
+from app.utils.task_queue import BackgroundTaskQueue
+
+
+def test_overfilled_queue_drops_and_drain_runs_pending_work():
+    queue = BackgroundTaskQueue(name="test_overfill", capacity=2, workers=1)
+    done = []
+
+    async def _work(item):
+        await asyncio.sleep(0)
+        done.append(item)
+
+    async def _run():
+        # the worker does not run before the first await, so the queue fills up
+        accepted = [queue.submit(_work, _item) for _item in range(4)]
+        await queue.drain(timeout=5)
+        return accepted
+
+    dropped_before = metrics.counters["task_queue.test_overfill.dropped"]
+    assert asyncio.run(_run()) == [True, True, False, False]
+    assert metrics.counters["task_queue.test_overfill.dropped"] - dropped_before == 2
+    assert done == [0, 1]
+
+
+def test_failed_task_is_logged_with_traceback(caplog):
+    queue = BackgroundTaskQueue(name="test_failure", capacity=10, workers=1)
+    done = []
+
+    def _fail():
+        raise RuntimeError("broken")
+
+    async def _run():
+        queue.submit(_fail)
+        queue.submit(done.append, "after")
+        await queue.drain(timeout=5)
+
+    with caplog.at_level("ERROR", logger="app.utils.task_queue"):
+        asyncio.run(_run())
+    assert done == ["after"]
+    assert "Background task _fail failed" in caplog.text
+    assert "RuntimeError: broken" in caplog.text